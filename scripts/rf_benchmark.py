@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.benchmark import (
+    BENCHMARKS,
+    DEFAULT_NB_STREAMLINES,
+    DEFAULT_NB_SUBSETS,
+    DEFAULT_REPEAT,
+    DEFAULT_SUBSET_SIZES,
+    DEFAULT_TOLERANCE,
+    compare_to_baseline,
+    run_benchmarks,
+    save_benchmark_data,
+)
+
+
+DESC = dedent(
+    """
+    Benchmark the evaluation and training data paths on synthetic data.
+
+    Creates a benchmark data folder (random tractogram, experiment output folders
+    with random votes, plausible/implausible split) at the given scale, unless
+    the folder already holds data of the same scale, and measures the wall time
+    (best of --repeat runs) and peak memory of every stage.
+
+    Results are written as JSON. Given a --baseline (results of an earlier run),
+    the script lists all stages that became slower or use more memory than the
+    --tolerance allows and exits with status 1 if there are any.
+
+    Available benchmarks:
+      {benchmarks}
+"""
+).format(benchmarks="\n      ".join(BENCHMARKS))
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} /tmp/rf_bench --output baseline.json
+      {filename} /tmp/rf_bench --output current.json --baseline baseline.json
+      {filename} /tmp/rf_bench --nb-streamlines 10000000 --subset-sizes 500000 \\
+          --only get_vote_counts evaluate_vote_counts
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("data_folder", help="Folder for the synthetic benchmark data.")
+    p.add_argument(
+        "--nb-streamlines",
+        type=int,
+        default=DEFAULT_NB_STREAMLINES,
+        help=f"Number of streamlines (default: {DEFAULT_NB_STREAMLINES}).",
+    )
+    p.add_argument(
+        "--subset-sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SUBSET_SIZES),
+        help="Subset sizes, one output folder each "
+        f"(default: {' '.join(map(str, DEFAULT_SUBSET_SIZES))}).",
+    )
+    p.add_argument(
+        "--nb-subsets",
+        type=int,
+        default=DEFAULT_NB_SUBSETS,
+        help=f"Number of subsets per subset size (default: {DEFAULT_NB_SUBSETS}).",
+    )
+    p.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic data (default: 0)."
+    )
+    p.add_argument(
+        "--only",
+        nargs="+",
+        required=False,
+        help="Run only the given benchmarks (default: all).",
+    )
+    p.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"Number of timed runs per benchmark (default: {DEFAULT_REPEAT}).",
+    )
+    p.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="Path to output .json file (default: benchmark_results.json).",
+    )
+    p.add_argument(
+        "--baseline",
+        required=False,
+        help="Path to results of an earlier run to compare against.",
+    )
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed relative increase of time and memory over the baseline "
+        f"(default: {DEFAULT_TOLERANCE}).",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    spec = save_benchmark_data(
+        args["data_folder"],
+        nb_streamlines=args["nb_streamlines"],
+        subset_sizes=args["subset_sizes"],
+        nb_subsets=args["nb_subsets"],
+        seed=args["seed"],
+    )
+    results = run_benchmarks(
+        args["data_folder"], spec, names=args.get("only"), repeat=args["repeat"]
+    )
+
+    with open(args["output"], "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", args["output"])
+
+    if not args.get("baseline"):
+        return
+
+    with open(args["baseline"], "r") as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args["tolerance"])
+
+    print()
+    if not regressions:
+        print("No regressions compared to", args["baseline"])
+        return
+    print("Regressions compared to", args["baseline"])
+    print("benchmark;metric;baseline;current")
+    for r in regressions:
+        print(f"{r['benchmark']};{r['metric']};{r['baseline']};{r['current']}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.classifier.feature_cache import (
+    DEFAULT_CHUNK_SIZE,
+    get_or_build_feature_cache,
+)
+
+
+DESC = dedent(
+    """
+    Normalize and resample all streamlines of a tractogram once and store them,
+    together with their labels, in a feature cache for `rf_train_model.py`.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} cache all.trk pos_streamlines.json neg_streamlines.json
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+DEFAULT_POINTS_PER_STREAMLINE = 23
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("cache_dir", help="Folder for feature caches.")
+    p.add_argument("tractogram", help="Tractogram file (.trk)")
+    p.add_argument("positive", help="Path to json file with indices of positive votes")
+    p.add_argument("negative", help="Path to json file with indices of negative votes")
+    p.add_argument(
+        "--points-per-streamline",
+        type=int,
+        default=DEFAULT_POINTS_PER_STREAMLINE,
+        help="Resample streamlines with given number of points (default: {}).".format(
+            DEFAULT_POINTS_PER_STREAMLINE
+        ),
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of streamlines processed at once "
+        f"(default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    path_to_cache = get_or_build_feature_cache(
+        args["cache_dir"],
+        args["tractogram"],
+        args["positive"],
+        args["negative"],
+        args["points_per_streamline"],
+        chunk_size=args["chunk_size"],
+    )
+    print(path_to_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import os
+import nibabel as nib
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.sift import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_STEP_SIZE,
+    build_incidence_matrix,
+    save_incidence_matrix,
+)
+
+
+DESC = dedent(
+    """
+    Map all streamlines of a tractogram once onto the fixels (or voxels) of a
+    fibre density image and store the sparse streamline x fixel incidence matrix,
+    for running SIFT on many subsets with `rf_sift_subsets.py`.
+
+    The fibre density image can be obtained from the FODs with MRtrix3, e.g.
+      voxel mode: mrconvert WM_FODs.mif -coord 3 0 fd.nii.gz
+      fixel mode: sh2peaks WM_FODs.mif peaks.nii.gz
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} all.trk fd.nii.gz incidence.npz
+      {filename} all.trk peaks.nii.gz incidence.npz --peaks
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("tractogram", help="Tractogram file (.trk).")
+    p.add_argument(
+        "fd_image",
+        help="Fibre density image (.nii/.nii.gz), or peak image if --peaks is given.",
+    )
+    p.add_argument("output_file", help="Path to output file (.npz).")
+    p.add_argument(
+        "--peaks",
+        action="store_true",
+        help="Interpret the image as peaks (X, Y, Z, 3 * nb_peaks) and map onto "
+        "fixels instead of voxels.",
+    )
+    p.add_argument(
+        "--step-size",
+        type=float,
+        default=DEFAULT_STEP_SIZE,
+        help="Sampling distance along streamlines in mm "
+        f"(default: {DEFAULT_STEP_SIZE}).",
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of streamlines mapped at once (default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    img = nib.load(args["fd_image"])
+    incidence, fd = build_incidence_matrix(
+        args["tractogram"],
+        img,
+        peaks=img.get_fdata() if args["peaks"] else None,
+        step_size=args["step_size"],
+        chunk_size=args["chunk_size"],
+    )
+    print(
+        f"Incidence matrix: {incidence.shape[0]} streamlines x {incidence.shape[1]} "
+        f"fixels, {incidence.nnz} entries"
+    )
+    save_incidence_matrix(args["output_file"], incidence, fd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.spatial_index import (
+    DEFAULT_CELL_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    build_spatial_index,
+)
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
+
+
+DESC = dedent(
+    """
+    Build the spatial index of a tractogram (endpoints on a grid and bounding
+    boxes of all streamlines), for selecting streamlines by region of interest
+    with `rf_query_spatial_index.py`.
+"""
+)
+EPILOG = dedent(
+    """
+    example call:
+
+      {filename} all.trk spatial_index
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("tractogram", help="Tractogram file.")
+    p.add_argument("spatial_index", help="Path to output folder of the index.")
+    p.add_argument(
+        "--cell-size",
+        type=float,
+        default=DEFAULT_CELL_SIZE,
+        help="Edge length of the endpoint grid cells in mm "
+        f"(default: {DEFAULT_CELL_SIZE}).",
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of streamlines read at once (default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    add_trace_argument(p)
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
+
+    build_spatial_index(
+        args["spatial_index"],
+        os.path.abspath(args["tractogram"]),
+        cell_size=args["cell_size"],
+        chunk_size=args["chunk_size"],
+    )
+    print("Spatial index written to", args["spatial_index"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.vote_archive import VoteArchive, write_vote_archive
+
+
+DESC = dedent(
+    """
+    Write the packed vote archive of rSIFT output folders.
+
+    The votes of all subsets of a folder are stored as two bit matrices
+    (subsets x streamlines), one for "seen" and one for "accepted", so that
+    later analyses do not need to parse the index files again.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} output_*
+      {filename} output_625000 --summary
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("output_folders", nargs="+", help="Output folders of experiments.")
+    p.add_argument(
+        "--nb_streamlines",
+        type=int,
+        required=False,
+        help="Number of streamlines in the reference tractogram. "
+        "(default: read from the reference tractogram of the index files)",
+    )
+    p.add_argument(
+        "--summary",
+        action="store_true",
+        help="Print acceptance per subset and mean agreement of subsets.",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    for folder in args["output_folders"]:
+        write_vote_archive(folder, nb_streamlines=args.get("nb_streamlines"))
+
+        if args["summary"]:
+            archive = VoteArchive(folder)
+            acceptance = archive.get_subset_acceptance()
+            agreement = archive.get_pairwise_agreement()
+            print(f"{folder}: {archive.nb_subsets} subsets")
+            print("acceptance per subset:", " ".join(f"{a:.3f}" for a in acceptance))
+            off_diagonal = agreement[~np.eye(len(agreement), dtype=bool)]
+            print(f"mean agreement of subsets: {np.nanmean(off_diagonal):.3f}")
+
+
+if __name__ == "__main__":
+    main()
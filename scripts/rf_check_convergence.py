@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.classifier.streamline_loader import get_nb_streamlines
+from randomised_filtering.convergence import (
+    DEFAULT_NEGATIVE_LIMIT,
+    DEFAULT_PATIENCE,
+    DEFAULT_POSITIVE_LIMIT,
+    DEFAULT_TOLERANCE,
+    monitor_output_folder,
+)
+
+
+DESC = dedent(
+    """
+    Check whether the votes of an rSIFT experiment converged.
+
+    The complete subsets of the output folder are added one after another, and
+    after every subset the numbers of plausible (acceptance rate >= positive
+    limit) and implausible (acceptance rate <= negative limit) streamlines and
+    the share of streamlines whose label changed are computed. The experiment is
+    converged if these stayed within the tolerance for the last `patience`
+    subsets.
+
+    Exits with status 0 if converged and 1 otherwise, so that it can be used to
+    stop further repetitions in shell scripts.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} all.trk output_625000 --history output_625000/convergence.csv
+
+      # in a loop running one subset after another
+      if {filename} all.trk output_625000 ; then break ; fi
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("reference_file", help="Reference tractogram file.")
+    p.add_argument("output_folder", help="Output folder of the experiment.")
+    p.add_argument(
+        "--positive-limit",
+        type=float,
+        default=DEFAULT_POSITIVE_LIMIT,
+        help="Minimal acceptance rate (%%) of plausible streamlines "
+        f"(default: {DEFAULT_POSITIVE_LIMIT}).",
+    )
+    p.add_argument(
+        "--negative-limit",
+        type=float,
+        default=DEFAULT_NEGATIVE_LIMIT,
+        help="Maximal acceptance rate (%%) of implausible streamlines "
+        f"(default: {DEFAULT_NEGATIVE_LIMIT}).",
+    )
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Maximal relative change of the P/N class sizes and share of changed "
+        f"labels per subset (default: {DEFAULT_TOLERANCE}).",
+    )
+    p.add_argument(
+        "--patience",
+        type=int,
+        default=DEFAULT_PATIENCE,
+        help="Number of consecutive subsets within the tolerance "
+        f"(default: {DEFAULT_PATIENCE}).",
+    )
+    p.add_argument(
+        "--history",
+        required=False,
+        help="Path to csv file with the statistics after every subset.",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    monitor = monitor_output_folder(
+        args["output_folder"],
+        get_nb_streamlines(args["reference_file"]),
+        positive_limit=args["positive_limit"],
+        negative_limit=args["negative_limit"],
+        tolerance=args["tolerance"],
+        patience=args["patience"],
+    )
+
+    if args.get("history"):
+        monitor.write_history(args["history"])
+
+    converged = monitor.is_converged()
+    print(f"{monitor.nb_subsets} subsets: " + ("converged" if converged else "running"))
+    sys.exit(0 if converged else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.compression import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_SEGMENT_LENGTH,
+    DEFAULT_TOL_ERROR,
+    compress_tractogram,
+)
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
+
+
+DESC = dedent(
+    """
+    Compress all streamlines of a tractogram with the Dipy function
+    `compress_streamlines` (tol_error=0.35 by default, as for the experiments).
+
+    Chunks of streamlines are compressed in parallel by worker processes and
+    written in their original order, so index files of the input tractogram
+    remain valid for the output tractogram.
+"""
+)
+EPILOG = dedent(
+    """
+    example call:
+
+      {filename} tracking.trk all.trk --num-processes 8
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("tractogram", help="Input tractogram file.")
+    p.add_argument("output_file", help="Output tractogram file.")
+    p.add_argument(
+        "--tol-error",
+        type=float,
+        default=DEFAULT_TOL_ERROR,
+        help=f"Tolerance error in mm (default: {DEFAULT_TOL_ERROR}).",
+    )
+    p.add_argument(
+        "--max-segment-length",
+        type=float,
+        default=DEFAULT_MAX_SEGMENT_LENGTH,
+        help="Maximal segment length in mm of the compressed streamlines "
+        f"(default: {DEFAULT_MAX_SEGMENT_LENGTH}).",
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of streamlines compressed at once "
+        f"(default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    p.add_argument(
+        "--num-processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes (default: number of CPUs).",
+    )
+    add_trace_argument(p)
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
+
+    stats = compress_tractogram(
+        args["tractogram"],
+        args["output_file"],
+        tol_error=args["tol_error"],
+        max_segment_length=args["max_segment_length"],
+        chunk_size=args["chunk_size"],
+        num_processes=args["num_processes"],
+    )
+    print(
+        f"{stats['streamlines']} streamlines, {stats['points_in']} -> "
+        f"{stats['points_out']} points (compression ratio {stats['ratio']:.2f}), "
+        f"{stats['seconds']:.1f}s ({stats['streamlines_per_s']:.0f} streamlines/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,28 @@
 import numpy as np
 import nibabel as nib
 
-import matplotlib
+from textwrap import dedent
+from argparse import ArgumentParser, RawTextHelpFormatter
 
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt  # noqa: E402
-
-from textwrap import dedent  # noqa: E402
-from argparse import ArgumentParser, RawTextHelpFormatter  # noqa: E402
-
-from randomised_filtering.streamline_indices import (  # noqa: E402
+from randomised_filtering.adaptive import (
+    DEFAULT_MIN_WEIGHT,
+    create_adaptive_streamline_indices,
+)
+from randomised_filtering.evaluation import get_vote_counts
+from randomised_filtering.streamline_indices import (
+    create_streamline_indices,
     write_list_of_streamline_indices,
 )
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = dedent(
     """
     Create a .json file of randomly chosen streamline indices.
+
+    With --adaptive, the votes of the subsets in the given output folder are used
+    to draw streamlines with uncertain acceptance rate more often (see
+    `rf_run_experiment.py --adaptive`).
 """
 )
 EPILOG = dedent(
@@ -44,28 +50,44 @@ def build_argparser():
     p.add_argument(
         "--hist", required=False, help="Path to histogram plot of the created indices."
     )
+    p.add_argument(
+        "--adaptive",
+        required=False,
+        help="Output folder with votes of previous subsets; draw streamlines with "
+        "uncertain votes more often (only randomized).",
+    )
+    p.add_argument(
+        "--min-weight",
+        type=float,
+        default=DEFAULT_MIN_WEIGHT,
+        help="Sampling weight of settled streamlines in adaptive mode "
+        f"(default: {DEFAULT_MIN_WEIGHT}).",
+    )
+    add_trace_argument(p)
     return p
 
 
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     tf = nib.streamlines.load(args["reference_file"], lazy_load=True)
 
-    # modified from original script to contain if/else
-    if args.get("randomized") == 1:
-        # randomized procedure
-        idx_list = np.random.choice(
-            np.arange(tf.header["nb_streamlines"]),
-            size=args["num_streamlines"],
-            replace=False,
-        ).tolist()
+    if args.get("adaptive") and args.get("randomized") == 1:
+        idx_list = create_adaptive_streamline_indices(
+            get_vote_counts(args["adaptive"], tf.header["nb_streamlines"]),
+            num_streamlines=args["num_streamlines"],
+            min_weight=args["min_weight"],
+        )
     else:
-        # sequential procedure
-        idx_list = np.arange(
-            (args["set"] - 1) * args["num_streamlines"],
-            args["set"] * args["num_streamlines"],
-        ).tolist()
+        # randomized procedure if 1, sequential procedure otherwise
+        idx_list = create_streamline_indices(
+            nb_streamlines=tf.header["nb_streamlines"],
+            num_streamlines=args["num_streamlines"],
+            randomized=args.get("randomized") == 1,
+            set_id=args.get("set"),
+        )
 
     write_list_of_streamline_indices(
         path_to_json_file=args["output_file"],
@@ -74,8 +96,16 @@ def main():
     )
 
     if args.get("hist"):
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        # new figure, several calls can share the interpreter (`rf batch`)
+        plt.figure()
         plt.hist(np.array(idx_list))
         plt.savefig(args["hist"])
+        plt.close()
 
 
 if __name__ == "__main__":
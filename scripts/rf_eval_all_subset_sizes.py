@@ -5,15 +5,32 @@ import numpy as np
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 
-from randomised_filtering.classifier.streamline_loader import get_indices_from_json
+from randomised_filtering.streamline_indices import get_indices_from_json
 from randomised_filtering.evaluation import (
+    evaluate_cohorts,
     get_output_folders,
-    get_meta_streamline_index,
-    evaluate_subsets,
+    get_meta_vote_counts,
+    get_nb_streamlines_from_folder,
+    evaluate_vote_counts,
+    open_vote_counts,
 )
+from randomised_filtering.vote_store import VoteStore, build_vote_store, is_vote_store
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
-DESC = "Evaluates vote statistics across multiple subset sizes."
+DESC = """
+Evaluates vote statistics across multiple subset sizes.
+
+The number of streamlines is read from the reference tractogram of the index
+files (or given with --nb_streamlines). With --out_of_core, the vote counts are
+kept in a memory-mapped file instead of memory, for very large tractograms.
+
+With --vote_store, the votes of all subset sizes are counted once into a
+per-size vote store (uint16, memory-mapped; reused if it already exists). The
+statistics across all subset sizes and those of every single subset size
+(results_<folder>.csv) are then computed from the store without reading the
+index files again.
+"""
 EPILOG = ""
 
 
@@ -35,30 +52,112 @@ def build_argparser():
         help="Path to json file containing indices that are relevant for the "
         "statistics. If not specified, evaluate for all streamlines.",
     )
+    p.add_argument(
+        "--cohorts",
+        nargs="+",
+        required=False,
+        help="Paths to json files with indices of cohorts (e.g. bundles); writes "
+        "the statistics of all cohorts to one file (results_<name>_cohorts.csv).",
+    )
+    p.add_argument(
+        "--nb_streamlines",
+        type=int,
+        required=False,
+        help="Number of streamlines in the reference tractogram. "
+        "(default: read from the reference tractogram of the index files)",
+    )
+    p.add_argument(
+        "--out_of_core",
+        required=False,
+        help="Path to .npy file in which the vote counts are accumulated.",
+    )
+    p.add_argument(
+        "--vote_store",
+        required=False,
+        help="Path to folder with the vote counts per subset size "
+        "(created if it does not exist).",
+    )
+    add_trace_argument(p)
     return p
 
 
+def evaluate_vote_store(path_to_store, folders, nb_streamlines, args):
+    """Evaluates all subset sizes and their totals from a vote store.
+
+    The store is (re)built if it does not exist or does not hold the votes of all
+    subsets of the given folders.
+    """
+    if is_vote_store(path_to_store):
+        if VoteStore(path_to_store).is_up_to_date(folders, nb_streamlines):
+            print("Using vote store", path_to_store)
+        else:
+            print(f"Vote store {path_to_store} is outdated, rebuilding it.")
+            build_vote_store(path_to_store, folders, nb_streamlines=nb_streamlines)
+    else:
+        build_vote_store(path_to_store, folders, nb_streamlines=nb_streamlines)
+    store = VoteStore(path_to_store)
+
+    ind = None
+    if args.get("json_path"):
+        print("Analyzing only indices from", args["json_path"])
+        ind = np.sort(get_indices_from_json(args["json_path"], dtype=np.int64))
+
+    for folder, subsets in zip(store.folders, store.subsets):
+        counts = store.get_counts(folder)
+        if args.get("cohorts"):
+            evaluate_cohorts(counts, args["cohorts"], subsets, folder)
+            continue
+        if ind is not None:
+            counts = counts[ind]
+        evaluate_vote_counts(counts, subsets, folder)
+
+    counts = store.get_total_counts(ind)
+    if args.get("cohorts"):
+        evaluate_cohorts(counts, args["cohorts"], MAX_SUBSETS, "all")
+    else:
+        evaluate_vote_counts(counts, MAX_SUBSETS, "all")
+
+
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     filepath = os.getcwd()
 
     # get all relevant folders from the path (name must begin with OUTPUT_FOLDER_NAME)
     folders = get_output_folders(filepath, OUTPUT_FOLDER_NAME)
 
-    # get vote distributions for each streamline across all subset sizes in one variable
-    meta_streamline_index = get_meta_streamline_index(folders)
+    nb_streamlines = args.get("nb_streamlines")
+    if nb_streamlines is None:
+        nb_streamlines = get_nb_streamlines_from_folder(
+            os.path.join(filepath, folders[0])
+        )
+
+    if args.get("vote_store"):
+        evaluate_vote_store(args["vote_store"], folders, nb_streamlines, args)
+        return
+
+    # get vote counts for each streamline across all subset sizes in one variable
+    counts = None
+    if args.get("out_of_core"):
+        counts = open_vote_counts(args["out_of_core"], nb_streamlines)
+    counts = get_meta_vote_counts(folders, nb_streamlines=nb_streamlines, out=counts)
+
+    if args.get("cohorts"):
+        evaluate_cohorts(counts, args["cohorts"], MAX_SUBSETS, "all")
+        return
 
     if args.get("json_path"):
         json_path = args["json_path"]
         print("Analyzing only indices from", json_path)
-        ind = get_indices_from_json(json_path, dtype=np.int32)
+        ind = get_indices_from_json(json_path, dtype=np.int64)
 
         # select index subset
-        meta_streamline_index = np.array(meta_streamline_index)[ind]
+        counts = counts[np.sort(ind)]
 
     # evaluate relevant streamlines and write vote distributions to file
-    evaluate_subsets(meta_streamline_index, MAX_SUBSETS, "all")
+    evaluate_vote_counts(counts, MAX_SUBSETS, "all")
 
 
 if __name__ == "__main__":
@@ -5,18 +5,30 @@ import numpy as np
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 
-from randomised_filtering.classifier.streamline_loader import get_indices_from_json
+from randomised_filtering.streamline_indices import get_indices_from_json
 from randomised_filtering.evaluation import (
-    get_meta_streamline_index,
+    get_acceptance_rates,
+    get_nb_streamlines_from_folder,
     get_output_folders,
-    get_acceptance_rate
+    get_vote_counts,
 )
+from randomised_filtering.vote_archive import VoteArchive, is_vote_archive
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = """
 Retrieves percentage of positives votes received by streamlines across all ex-
 periment instances/subset sizes. Either for all streamlines or a set of stream-
 lines of interest.
+
+The percentages are written to a binary file (percentages_<name>.npy) with one
+row per streamline (in the order of the reference tractogram, or of the index
+file if --json_path is given) and the columns
+  0    : percentage across all subset sizes
+  1... : percentage per subset size (output folders in ascending order)
+Streamlines without votes are NaN. With --txt, the streamline index and the
+percentage across all subset sizes are written to a text file as well (-1 for
+streamlines without votes).
 """
 EPILOG = ""
 
@@ -36,35 +48,70 @@ def build_argparser():
         help="Path to json file containing indices that are relevant for the "
         "statistics. If not specified, evaluate for all streamlines.",
     )
+    p.add_argument(
+        "--dtype",
+        choices=("float16", "float32"),
+        default="float32",
+        help="Data type of the binary output (default: float32).",
+    )
+    p.add_argument(
+        "--txt",
+        action="store_true",
+        help="Additionally write the percentages across all subset sizes to a "
+        "text file (percentages_<name>.txt).",
+    )
+    add_trace_argument(p)
     return p
 
 
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     filepath = os.getcwd()
 
     # get all relevant folders from the path (name must begin with OUTPUT_FOLDER_NAME)
     folders = get_output_folders(filepath, OUTPUT_FOLDER_NAME)
 
-    # get vote distributions for each streamline across all subset sizes in one variable
-    meta_streamline_index = get_meta_streamline_index(folders)
-
     # get relevant streamlines
-    entries = meta_streamline_index
+    ind = None
     name = ""
     if args.get("json_path"):
         jsonpath = args["json_path"]
         print("Analyzing only indices from", jsonpath)
-        ind = get_indices_from_json(jsonpath, dtype=np.int32)
-        entries = meta_streamline_index[ind]
+        ind = get_indices_from_json(jsonpath, dtype=np.int64)
         name = jsonpath.split(".")[0]
 
+    # get vote counts per subset size and across all subset sizes
+    meta_counts = None
+    folder_counts = []
+    for folder in folders:
+        path = os.path.join(filepath, folder)
+        if is_vote_archive(path):
+            counts = VoteArchive(path).get_vote_counts()
+        else:
+            counts = get_vote_counts(path, get_nb_streamlines_from_folder(path))
+        meta_counts = counts.copy() if meta_counts is None else meta_counts + counts
+        folder_counts.append(counts if ind is None else counts[ind])
+
+    if ind is not None:
+        meta_counts = meta_counts[ind]
+
     # get acceptance rates for all streamlines of interests and write to file.
-    result = np.array(
-        [[entry[2], get_acceptance_rate(entry)] for entry in entries] 
-    )  
-    np.savetxt(f"percentages_{name}.txt", result)
+    result = np.stack(
+        [get_acceptance_rates(c, unseen=np.nan) for c in [meta_counts] + folder_counts],
+        axis=1,
+    ).astype(args["dtype"])
+    np.save(f"percentages_{name}.npy", result)
+    print(f"percentages_{name}.npy: columns all, " + ", ".join(folders))
+
+    if args["txt"]:
+        idx = np.arange(len(result)) if ind is None else ind
+        votes = meta_counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ar = np.where(votes > 0, meta_counts[:, 0] * 100 / votes, -1)
+        np.savetxt(f"percentages_{name}.txt", np.stack([idx, ar], axis=1))
 
 
 if __name__ == "__main__":
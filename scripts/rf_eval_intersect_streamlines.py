@@ -6,13 +6,18 @@ import numpy as np
 from argparse import ArgumentParser, RawTextHelpFormatter
 
 from randomised_filtering.evaluation import (
+    get_acceptance_rates,
     get_output_folders,
     get_conditional_sets_from_folder,
+    get_vote_counts,
     intersect,
     intersect_all_sets_in_list,
+    sweep_intersections,
     unify_all_sets_in_list,
 )
 from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+from randomised_filtering.vote_archive import VoteArchive, is_vote_archive
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = """
@@ -21,11 +26,17 @@ in a folder. It analyzes the intersection of the sets of fully "positive" (P)
 or fully "negative" (N) streamlines and writes the results to a file.
 Additionally can write indices of streamlines with only positive/negative
 votes to a json file.
+
+With --sweep, the acceptance rates of all folders are computed once and the
+intersections are evaluated for many acceptance rate limits, for plausible and
+implausible streamlines, and written to a single table (intersection_sweep.csv).
 """
 EPILOG = ""
 
 
 OUTPUT_FOLDER_NAME = "output"
+SWEEP_FILENAME = "intersection_sweep.csv"
+DEFAULT_SWEEP_LIMITS = list(range(0, 101, 10))
 
 
 def build_argparser():
@@ -52,15 +63,72 @@ def build_argparser():
         required=False,
         help="Name of json containing plausible streamlines (without file ending).",
     )
+    p.add_argument(
+        "--sweep",
+        nargs="*",
+        type=float,
+        required=False,
+        help="Evaluate the given acceptance rate limits in both directions at once "
+        "(default limits: 0, 10, ..., 100).",
+    )
+    add_trace_argument(p)
     return p
 
 
+def run_sweep(folders, limits):
+    """Evaluates all limits in both directions and writes one table."""
+    acceptance_rates = []
+    for folder in folders:
+        print("Computing acceptance rates for", folder)
+        if is_vote_archive(folder):
+            counts = VoteArchive(folder).get_vote_counts()
+        else:
+            counts = get_vote_counts(os.path.join(os.getcwd(), folder))
+        acceptance_rates.append(get_acceptance_rates(counts))
+
+    with open(SWEEP_FILENAME, "w") as f:
+        f.write(
+            "direction;ar limit;first subset size;# streamlines in first subset size;"
+            "subset size;# streamlines in intersection;% of streamlines in "
+            "intersection;# streamlines not in intersection;"
+            "# streamlines with other votes;# streamlines not seen;"
+            "# streamlines left after intersection with all up to subset size\n"
+        )
+
+        for direction, plausible in [("plausible", True), ("implausible", False)]:
+            # smallest subset size for plausible, biggest for implausible
+            order = folders if plausible else folders[::-1]
+            ars = acceptance_rates if plausible else acceptance_rates[::-1]
+            nb_first, rows = sweep_intersections(ars, limits, plausible=plausible)
+
+            for i, limit in enumerate(limits):
+                for folder, row in zip(order[1:], rows):
+                    nb_seen = nb_first[i] - row["not_seen"][i]
+                    percentage = 0
+                    if nb_seen > 0:
+                        percentage = 100 * row["intersection"][i] / nb_seen
+                    f.write(
+                        f"{direction};{limit:g};{order[0]};{nb_first[i]};{folder};"
+                        f"{row['intersection'][i]};{round(percentage, 2)}%;"
+                        f"{row['not_fulfilled'][i]};{row['other_votes'][i]};"
+                        f"{row['not_seen'][i]};{row['left'][i]}\n"
+                    )
+
+    print("Sweep written to", SWEEP_FILENAME)
+
+
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     # get all relevant folders from the path (name must begin with OUTPUT_FOLDER_NAME)
     folders = get_output_folders(os.getcwd(), OUTPUT_FOLDER_NAME)
 
+    if args.get("sweep") is not None:
+        run_sweep(folders, args["sweep"] or DEFAULT_SWEEP_LIMITS)
+        return
+
     if args.get("implausible"):
         intersect_plausible = False
         folders.reverse()
@@ -5,13 +5,28 @@ import numpy as np
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 
-from randomised_filtering.classifier.streamline_loader import get_indices_from_json
-from randomised_filtering.evaluation import process_subsets, evaluate_subsets
+from randomised_filtering.streamline_indices import get_indices_from_json
+from randomised_filtering.evaluation import (
+    evaluate_cohorts,
+    evaluate_vote_counts,
+    get_nb_streamlines_from_folder,
+    get_nb_subsets_from_folder,
+    get_vote_counts,
+    open_vote_counts,
+)
+from randomised_filtering.vote_archive import VoteArchive, is_vote_archive
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = """
 This script evaluates streamline votes in a folder containing both plausible/
 implausible index .jsons and write main statistics them to a result file.
+
+The number of streamlines is read from the reference tractogram of the index
+files (or given with --nb_streamlines). With --out_of_core, the vote counts are
+kept in a memory-mapped file instead of memory, for very large tractograms.
+If the folder contains a vote archive (rf_build_vote_archive.py), the votes are
+read from it instead of the index files.
 """
 EPILOG = ""
 
@@ -31,11 +46,33 @@ def build_argparser():
         help="Path to json file containing indices that are relevant for "
         "the statistics. (default: evaluate for all streamlines)",
     )
+    p.add_argument(
+        "--cohorts",
+        nargs="+",
+        required=False,
+        help="Paths to json files with indices of cohorts (e.g. bundles); writes "
+        "the statistics of all cohorts to one file (results_<name>_cohorts.csv).",
+    )
+    p.add_argument(
+        "--nb_streamlines",
+        type=int,
+        required=False,
+        help="Number of streamlines in the reference tractogram. "
+        "(default: read from the reference tractogram of the index files)",
+    )
+    p.add_argument(
+        "--out_of_core",
+        required=False,
+        help="Path to .npy file in which the vote counts are accumulated.",
+    )
+    add_trace_argument(p)
     return p
 
 
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     filepath = os.getcwd()
 
@@ -46,20 +83,34 @@ def main():
         filepath = os.path.join(filepath, name)
 
     # determine number of subsets
-    subsets = sum([x[-19:] == "_plausible_ref.json" for x in os.listdir(filepath)])
+    subsets = get_nb_subsets_from_folder(filepath)
+
+    # get vote statistics for every streamline (the archive is only used if it
+    #   holds the votes of all subsets)
+    if is_vote_archive(filepath):
+        print("Using vote archive of", filepath)
+        counts = VoteArchive(filepath).get_vote_counts()
+    else:
+        nb_streamlines = args.get("nb_streamlines")
+        if nb_streamlines is None:
+            nb_streamlines = get_nb_streamlines_from_folder(filepath)
+
+        counts = None
+        if args.get("out_of_core"):
+            counts = open_vote_counts(args["out_of_core"], nb_streamlines)
+        counts = get_vote_counts(filepath, nb_streamlines, out=counts)
+
+    if args.get("cohorts"):
+        evaluate_cohorts(counts, args["cohorts"], subsets, name)
+        return
 
+    # call function that evaluates votes and writes them to [name].csv
     if args.get("json_path"):
         json_path = args["json_path"]
         print("Analyzing only indices from", json_path)
-        ind = get_indices_from_json(json_path)
-
-    # get vote statistics for every of the 10M streamlines
-    streamline_index = process_subsets(filepath)
-
-    # call function that evaluates votes and writes them to [name].csv
-    if args.get("json_path"):
-        streamline_index = np.array(streamline_index[ind])
-    evaluate_subsets(streamline_index, subsets, name)
+        ind = get_indices_from_json(json_path, dtype=np.int64)
+        counts = counts[np.sort(ind)]
+    evaluate_vote_counts(counts, subsets, name)
 
 
 if __name__ == "__main__":
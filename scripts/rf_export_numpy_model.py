@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.classifier.numpy_model import (
+    load_numpy_model,
+    save_numpy_model,
+)
+from randomised_filtering.classifier.preprocessing import get_preprocessing_spec_path
+
+
+DESC = dedent(
+    """
+    Export the weights of a trained model (SavedModel) to an .npz file.
+
+    The .npz file can be used by `rf_predict.py` in place of the model; it is
+    classified with the numpy backend, so tensorflow is neither needed for
+    exporting nor for inference. A preprocessing spec stored with the model is
+    copied beside the .npz file.
+"""
+)
+EPILOG = dedent(
+    """
+    example call:
+
+      {filename} data/models/model_negative_positive model_negative_positive.npz
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("model", help="Path to trained model (e.g. in data/models).")
+    p.add_argument("output_file", help="Path to output .npz file.")
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    if not args["output_file"].endswith(".npz"):
+        raise ValueError("Output file must end with '.npz'.")
+
+    model = load_numpy_model(args["model"])
+    save_numpy_model(args["output_file"], model)
+    print(f"Weights of {args['model']} written to {args['output_file']}.")
+
+    path_to_spec = get_preprocessing_spec_path(args["model"])
+    if os.path.exists(path_to_spec):
+        shutil.copyfile(path_to_spec, get_preprocessing_spec_path(args["output_file"]))
+        print("Preprocessing spec copied.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import zlib
+import shutil
+import numpy as np
+import nibabel as nib
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+
+DESC = dedent(
+    """
+    Stand-in for MRtrix3's `tcksift` to test experiment pipelines without MRtrix3.
+
+    Accepts the same positional arguments and writes the same outputs: the
+    filtered tractogram (here: a copy of the input) and the selection file given
+    by -out_selection, in which every streamline is selected at random with the
+    given probability. The selection only depends on the input file name.
+    All other options of tcksift are ignored.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} subset_1.tck WM_FODs.mif subset_1_sift.tck \\
+        -out_selection subset_1_selection.txt
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_parser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("in_tracks", help="Input tractogram (.tck).")
+    p.add_argument("in_fod", help="Input FOD image (not read).")
+    p.add_argument("out_tracks", help="Output tractogram (.tck).")
+    p.add_argument(
+        "-out_selection", required=False, help="Output selection file (0/1 per line)."
+    )
+    p.add_argument(
+        "-acceptance",
+        type=float,
+        default=0.5,
+        help="Probability of a streamline to be selected (default: 0.5).",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    args, _ = build_parser().parse_known_args()
+    args = vars(args)
+
+    nb_streamlines = len(nib.streamlines.load(args["in_tracks"]).streamlines)
+
+    rng = np.random.default_rng(
+        zlib.crc32(os.path.basename(args["in_tracks"]).encode())
+    )
+    selection = (rng.random(nb_streamlines) < args["acceptance"]).astype(int)
+
+    if args.get("out_selection"):
+        np.savetxt(args["out_selection"], selection, fmt="%d")
+    shutil.copyfile(args["in_tracks"], args["out_tracks"])
+
+    print(f"tcksift (fake): {selection.sum()} of {nb_streamlines} streamlines selected")
@@ -3,11 +3,6 @@
 from argparse import ArgumentParser, RawTextHelpFormatter
 from textwrap import dedent
 
-from keras.models import save_model
-from tensorflow.keras.utils import plot_model
-
-from randomised_filtering.classifier.model import get_categorical_model
-
 DESC = dedent(
     """
     Print the model architecture as a figure.
@@ -51,6 +46,12 @@ def main():
 
     args = vars(build_argparser().parse_args())
 
+    # tensorflow is slow to import, load it only after the arguments are checked
+    from keras.models import save_model
+    from tensorflow.keras.utils import plot_model
+
+    from randomised_filtering.classifier.model import get_categorical_model
+
     # build model
     model = get_categorical_model(
         num_classes=args["num_classes"],
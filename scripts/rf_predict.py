@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.classifier.inference import (
+    BACKEND_NUMPY,
+    BACKEND_TENSORFLOW,
+    BACKENDS,
+    CLASS_INCONCLUSIVE,
+    CLASS_NAMES,
+    CLASS_NEGATIVE,
+    CLASS_POSITIVE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_NUM_WORKERS,
+    StageTimer,
+    get_class_order,
+    get_indices_of_class,
+    get_num_classes,
+    get_points_per_streamline,
+    load_model,
+    predict_tractogram,
+    write_class_labels,
+)
+from randomised_filtering.classifier.cascade import (
+    DEFAULT_UNCERTAINTY_BAND,
+    CascadeModel,
+)
+from randomised_filtering.classifier.ensemble import (
+    get_uncertain_indices,
+    load_ensemble,
+    split_ensemble_output,
+)
+from randomised_filtering.classifier.preprocessing import (
+    build_preprocessing_spec,
+    load_preprocessing_spec,
+)
+from randomised_filtering.classifier.streamline_loader import get_min_max_from_trk
+from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+
+
+DESC = dedent(
+    """
+    Classify all streamlines of a tractogram with a trained model.
+
+    Writes the class probabilities of every streamline to a .npy file as well as
+    the indices of plausible and implausible streamlines (most probable class)
+    to .json files.
+
+    If the model was stored with a preprocessing spec (see `rf_train_model.py`),
+    the normalization bounds, number of points and class order are taken from it.
+
+    With `--backend numpy`, the model runs in plain NumPy without loading
+    tensorflow (same results within floating point tolerance), and
+    `--num-processes` classifies chunks in parallel worker processes. Models
+    exported with `rf_export_numpy_model.py` (.npz) always use the numpy backend.
+
+    If several models are given (e.g. the cross-validation models of one
+    training run), they are evaluated as an ensemble in a single pass (numpy
+    backend): the probabilities are averaged over the models and the
+    disagreement of the models (standard deviation of the probability of the
+    predicted class) is written to an additional .npy file. With
+    --max-disagreement, the indices of streamlines with a higher disagreement
+    are written to a .json file.
+
+    With --cascade, the given (binary, negative vs. positive) model only decides
+    the streamlines it is certain about. Streamlines whose probability of being
+    positive lies inside --band are passed to the cascade model (e.g. the
+    three-class model). Probabilities are written in the order negative,
+    positive, inconclusive, together with the labels of all streamlines (index
+    of the most probable class, .npy) and the indices of inconclusive
+    streamlines (.json).
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} all.trk data/models/model_negative_positive out/all
+      {filename} all.trk data/models/model_negative_positive out/all \\
+          --backend numpy --num-processes 8
+      {filename} all.trk model_binarypn_0 model_binarypn_1 model_binarypn_2 \\
+          model_binarypn_3 model_binarypn_4 out/all --max-disagreement 0.2
+      {filename} all.trk data/models/model_negative_positive out/all \\
+          --cascade data/models/model_negative_positive_inconclusive --band 0.1 0.9
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+# SETTINGS
+SUFFIX_PROBABILITIES = "_probabilities.npy"
+SUFFIX_PLAUSIBLE = "_plausible_indices.json"
+SUFFIX_IMPLAUSIBLE = "_implausible_indices.json"
+SUFFIX_DISAGREEMENT = "_disagreement.npy"
+SUFFIX_UNCERTAIN = "_uncertain_indices.json"
+SUFFIX_ENSEMBLE_OUTPUT = "_ensemble_output.npy"
+SUFFIX_LABELS = "_labels.npy"
+SUFFIX_INCONCLUSIVE = "_inconclusive_indices.json"
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("tractogram", help="Tractogram file (.trk).")
+    p.add_argument(
+        "model",
+        nargs="+",
+        help="Path to trained model (e.g. in data/models); several models are "
+        "evaluated as an ensemble.",
+    )
+    p.add_argument(
+        "output_basename",
+        help="Path to output files without file ending. (The script will append "
+        f"'{SUFFIX_PROBABILITIES}', '{SUFFIX_PLAUSIBLE}' and '{SUFFIX_IMPLAUSIBLE}'.)",
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of streamlines loaded and preprocessed at once "
+        f"(default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    p.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Number of streamlines per model call (default: {DEFAULT_BATCH_SIZE}).",
+    )
+    p.add_argument(
+        "--num-workers",
+        type=int,
+        default=DEFAULT_NUM_WORKERS,
+        help="Number of threads for streamline preprocessing "
+        f"(default: {DEFAULT_NUM_WORKERS}).",
+    )
+    p.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=BACKEND_TENSORFLOW,
+        help=f"Inference backend (default: {BACKEND_TENSORFLOW}).",
+    )
+    p.add_argument(
+        "--num-processes",
+        type=int,
+        default=0,
+        help="Number of worker processes that preprocess and classify chunks; "
+        "needs the numpy backend. (default: 0, classify in the main process)",
+    )
+    p.add_argument(
+        "--max-disagreement",
+        type=float,
+        required=False,
+        help="Ensembles only: write the indices of streamlines whose disagreement "
+        f"exceeds this value to '<output_basename>{SUFFIX_UNCERTAIN}'.",
+    )
+    p.add_argument(
+        "--cascade",
+        required=False,
+        help="Model for streamlines the given binary model is uncertain about "
+        "(e.g. data/models/model_negative_positive_inconclusive).",
+    )
+    p.add_argument(
+        "--band",
+        type=float,
+        nargs=2,
+        default=DEFAULT_UNCERTAINTY_BAND,
+        help="Cascade only: range of the probability of the positive class for "
+        "which streamlines are passed to the cascade model "
+        f"(default: {DEFAULT_UNCERTAINTY_BAND[0]} {DEFAULT_UNCERTAINTY_BAND[1]}).",
+    )
+    p.add_argument(
+        "--min-coord",
+        type=float,
+        nargs=3,
+        required=False,
+        help="Minimum coordinate used for normalization during training. "
+        "(default: from the preprocessing spec of the model or determined from the "
+        "tractogram in an additional pass)",
+    )
+    p.add_argument(
+        "--max-coord",
+        type=float,
+        nargs=3,
+        required=False,
+        help="Maximum coordinate used for normalization during training. "
+        "(default: from the preprocessing spec of the model or determined from the "
+        "tractogram in an additional pass)",
+    )
+    return p
+
+
+def main():
+    parser = build_argparser()
+    args = vars(parser.parse_args())
+
+    ensemble = len(args["model"]) > 1
+    if ensemble or args["model"][0].endswith(".npz"):
+        args["backend"] = BACKEND_NUMPY
+    if args["num_processes"] > 0 and args["backend"] != BACKEND_NUMPY:
+        parser.error("--num-processes needs the numpy backend.")
+    if args.get("max_disagreement") is not None and not ensemble:
+        parser.error("--max-disagreement needs several models.")
+    if args.get("cascade") and (ensemble or args["num_processes"] > 0):
+        parser.error("--cascade needs a single model and no worker processes.")
+
+    if ensemble:
+        print(f"Evaluating an ensemble of {len(args['model'])} models.")
+        model = load_ensemble(args["model"])
+        num_classes = model.num_classes
+    else:
+        model = load_model(args["model"][0], backend=args["backend"])
+        num_classes = get_num_classes(model)
+    spec = load_preprocessing_spec(args["model"][0])
+
+    if spec:
+        print("Using preprocessing spec stored with the model.")
+    else:
+        spec = build_preprocessing_spec(
+            None,
+            None,
+            get_points_per_streamline(model),
+            get_class_order(args["model"][0], num_classes),
+        )
+    class_order = spec["class_order"]
+    print("Class order:", class_order)
+    print("Points per streamline:", spec["points_per_streamline"])
+
+    if args.get("cascade"):
+        second_model = load_model(args["cascade"], backend=args["backend"])
+        second_spec = load_preprocessing_spec(args["cascade"])
+        # both models get the same input, preprocessed with the spec of the first
+        if get_points_per_streamline(second_model) != spec["points_per_streamline"]:
+            raise ValueError(
+                f"Input length of '{args['cascade']}' differs from "
+                f"'{args['model'][0]}'."
+            )
+        if second_spec and any(
+            second_spec.get(key) != spec[key] for key in spec if key != "class_order"
+        ):
+            raise ValueError(
+                f"Preprocessing spec of '{args['cascade']}' differs from "
+                f"'{args['model'][0]}'."
+            )
+        if second_spec:
+            second_class_order = second_spec["class_order"]
+        else:
+            second_class_order = get_class_order(
+                args["cascade"], get_num_classes(second_model)
+            )
+        print("Cascade class order:", second_class_order)
+        model = CascadeModel(
+            model, class_order, second_model, second_class_order, args["band"]
+        )
+        class_order = list(CLASS_NAMES)
+        num_classes = len(class_order)
+
+    if args.get("min_coord") and args.get("max_coord"):
+        mincoord, maxcoord = args["min_coord"], args["max_coord"]
+    elif spec["mincoord"] is not None:
+        mincoord, maxcoord = spec["mincoord"], spec["maxcoord"]
+    else:
+        mincoord, maxcoord = get_min_max_from_trk(
+            args["tractogram"], chunk_size=args["chunk_size"]
+        )
+    spec = build_preprocessing_spec(
+        mincoord, maxcoord, spec["points_per_streamline"], class_order
+    )
+    print("min", spec["mincoord"])
+    print("max", spec["maxcoord"])
+
+    # an ensemble outputs the disagreement as additional column
+    path_to_output = args["output_basename"] + SUFFIX_PROBABILITIES
+    if ensemble:
+        path_to_output = args["output_basename"] + SUFFIX_ENSEMBLE_OUTPUT
+
+    timer = StageTimer()
+    probabilities = predict_tractogram(
+        model,
+        args["tractogram"],
+        path_to_output,
+        spec=spec,
+        num_classes=model.output_shape[1] if ensemble else num_classes,
+        chunk_size=args["chunk_size"],
+        batch_size=args["batch_size"],
+        num_workers=args["num_workers"],
+        timer=timer,
+        num_processes=args["num_processes"],
+    )
+
+    print()
+    print("Time per stage:")
+    print(timer.report())
+    print()
+
+    if args.get("cascade"):
+        print("Streamlines per cascade stage:")
+        print(model.report())
+        print()
+
+        write_class_labels(
+            probabilities, args["output_basename"] + SUFFIX_LABELS, args["chunk_size"]
+        )
+        idx_list = get_indices_of_class(
+            probabilities, class_order.index(CLASS_INCONCLUSIVE), args["chunk_size"]
+        )
+        print(f"{CLASS_INCONCLUSIVE}: {len(idx_list)} streamlines")
+        write_list_of_streamline_indices(
+            args["output_basename"] + SUFFIX_INCONCLUSIVE, idx_list, args["tractogram"]
+        )
+
+    if ensemble:
+        probabilities, disagreement = split_ensemble_output(
+            probabilities,
+            args["output_basename"] + SUFFIX_PROBABILITIES,
+            args["output_basename"] + SUFFIX_DISAGREEMENT,
+            args["chunk_size"],
+        )
+        os.remove(path_to_output)
+
+        if args.get("max_disagreement") is not None:
+            idx_list = get_uncertain_indices(
+                disagreement, args["max_disagreement"], args["chunk_size"]
+            )
+            print(f"uncertain: {len(idx_list)} streamlines")
+            write_list_of_streamline_indices(
+                args["output_basename"] + SUFFIX_UNCERTAIN, idx_list, args["tractogram"]
+            )
+
+    for class_name, suffix in [
+        (CLASS_POSITIVE, SUFFIX_PLAUSIBLE),
+        (CLASS_NEGATIVE, SUFFIX_IMPLAUSIBLE),
+    ]:
+        idx_list = []
+        if class_name in class_order:
+            idx_list = get_indices_of_class(
+                probabilities, class_order.index(class_name), args["chunk_size"]
+            )
+        print(f"{class_name}: {len(idx_list)} streamlines")
+        write_list_of_streamline_indices(
+            args["output_basename"] + suffix, idx_list, args["tractogram"]
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import os
+import time
+import numpy as np
+import nibabel as nib
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.evaluation import (
+    ACCEPTANCE_RATE_BINS,
+    get_acceptance_rate_distribution,
+    get_cohort_vote_combinations,
+)
+from randomised_filtering.spatial_index import (
+    ENDS,
+    ENDS_ANY,
+    Region,
+    SpatialIndex,
+)
+from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+from randomised_filtering.vote_store import VoteStore
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
+
+
+DESC = dedent(
+    """
+    Select the streamlines that start/end in or pass through a region of
+    interest (mask image or box), using the index of `rf_build_spatial_index.py`.
+
+    The selection is written as index file, to be used with the --json_path or
+    --cohorts options of the evaluation scripts. With --vote_store, the
+    acceptance rate distribution of the selection is printed per subset size.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} spatial_index roi.json --mask roi.nii.gz --ends both
+      {filename} spatial_index roi.json --box -10 -20 0 10 20 15 --passing
+      {filename} spatial_index roi.json --mask roi.nii.gz --vote_store vote_store
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("spatial_index", help="Path to spatial index folder.")
+    p.add_argument("output_file", help="Path to output index file (.json).")
+    region = p.add_mutually_exclusive_group(required=True)
+    region.add_argument("--mask", help="Mask image of the region (non-zero voxels).")
+    region.add_argument(
+        "--box",
+        type=float,
+        nargs=6,
+        metavar=("X0", "Y0", "Z0", "X1", "Y1", "Z1"),
+        help="Lower and upper corner of a box in mm (RAS).",
+    )
+    p.add_argument(
+        "--ends",
+        choices=ENDS,
+        default=ENDS_ANY,
+        help="Endpoints which have to lie in the region (default: any).",
+    )
+    p.add_argument(
+        "--passing",
+        action="store_true",
+        help="Select streamlines passing through the region instead (needs a "
+        "pass over the tractogram). Segments are resampled to half the voxel "
+        "or grid cell size, segments only clipping a corner of the region may "
+        "be missed.",
+    )
+    p.add_argument(
+        "--approximate",
+        action="store_true",
+        help="With --passing: select all streamlines whose bounding box overlaps "
+        "the region, without reading the tractogram.",
+    )
+    p.add_argument(
+        "--vote_store",
+        required=False,
+        help="Path to vote store; print the acceptance rates of the selection.",
+    )
+    add_trace_argument(p)
+    return p
+
+
+def print_acceptance_rates(path_to_store, streamline_ids):
+    store = VoteStore(path_to_store)
+    print("folder;" + ";".join(f"{lo}-{hi}%" for lo, hi in ACCEPTANCE_RATE_BINS))
+    for folder, subsets in zip(store.folders, store.subsets):
+        histograms = get_cohort_vote_combinations(
+            store.get_counts(folder), [streamline_ids], subsets
+        )
+        distribution = get_acceptance_rate_distribution(histograms)[0]
+        print(f"{folder};" + ";".join(str(c) for c in distribution))
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
+
+    index = SpatialIndex(args["spatial_index"])
+    if args.get("mask"):
+        region = Region.from_mask(nib.load(args["mask"]))
+    else:
+        region = Region.from_box(args["box"][:3], args["box"][3:])
+
+    start = time.perf_counter()
+    if args["passing"]:
+        streamline_ids = index.query_passing(region, exact=not args["approximate"])
+    else:
+        streamline_ids = index.query_endpoints(region, ends=args["ends"])
+    print(
+        f"{len(streamline_ids)} of {index.nb_streamlines} streamlines selected "
+        f"({time.perf_counter() - start:.3f}s)"
+    )
+
+    write_list_of_streamline_indices(
+        path_to_json_file=args["output_file"],
+        list_sl_idx=streamline_ids.tolist(),
+        path_to_tractogram=index.path_to_tractogram,
+    )
+
+    if args.get("vote_store"):
+        print_acceptance_rates(args["vote_store"], np.asarray(streamline_ids))
+
+
+if __name__ == "__main__":
+    main()
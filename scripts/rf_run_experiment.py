@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.adaptive import (
+    DEFAULT_MAX_UNCERTAIN_FRACTION,
+    DEFAULT_MIN_WEIGHT,
+    DEFAULT_TARGET_WIDTH,
+)
+from randomised_filtering.classifier.streamline_loader import get_nb_streamlines
+from randomised_filtering.convergence import (
+    DEFAULT_NEGATIVE_LIMIT,
+    DEFAULT_PATIENCE,
+    DEFAULT_POSITIVE_LIMIT,
+    DEFAULT_TOLERANCE,
+    ConvergenceMonitor,
+)
+from randomised_filtering.pipeline import (
+    DEFAULT_TCKSIFT,
+    RESOURCE_CPU,
+    RESOURCE_TRACTOGRAM,
+    SUBSET_SIZES,
+    TRACTOGRAM_NAME,
+    FOD_NAME,
+    VOTES_PER_STREAMLINE,
+    build_rsift_tasks,
+    run_experiment_in_rounds,
+    run_tasks,
+)
+
+
+DESC = dedent(
+    """
+    Run all SIFT experiments for one subject (Python counterpart of `main.sh`).
+
+    The stages of all subsets of all subset sizes are scheduled on a pool of
+    workers within the given CPU budget. Subsets of existing `output_<size>`
+    folders whose reference index files already exist are skipped, so an
+    interrupted run can be resumed by calling the script again.
+
+    With --adaptive, the subsets of every subset size are drawn in rounds. After
+    every round, the votes so far are used to draw the next subsets with extra
+    weight on streamlines whose acceptance rate is still uncertain, and the
+    experiment stops once the acceptance rates of (almost) all streamlines are
+    settled. --num-streamlines then is an upper bound.
+
+    With --stop-on-convergence, the subsets are run in rounds as well, and every
+    subset size stops once the numbers of plausible/implausible streamlines
+    (w.r.t. --positive-limit/--negative-limit, as in
+    `rf_eval_intersect_streamlines.py`) and the share of streamlines changing
+    their label stayed within --tolerance for --patience subsets. The statistics
+    per subset are written to `convergence.csv` in the output folder.
+
+    The subject folder must contain the tractogram (all.trk) and the FODs
+    (WM_FODs.mif), see `main.sh --help`.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} data/599671 1 --cpus 32 --sift-threads 8
+
+      # adaptive sampling, stop once 99% of the acceptance rates are settled
+      {filename} data/599671 1 --adaptive --max-uncertain 0.01 --cpus 32
+
+      # stop every subset size once the P/N class sizes are stable
+      {filename} data/599671 1 --stop-on-convergence --tolerance 0.001
+
+      # offline test without MRtrix3
+      {filename} data/test 1 --tcksift rf_fake_tcksift.py --seed 0
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("base_path", help="Path to folder with subject data.")
+    p.add_argument(
+        "randomized",
+        type=int,
+        choices=(0, 1),
+        help="1 for randomized filtering (rSIFT), 0 for sequential filtering.",
+    )
+    p.add_argument(
+        "--subset-sizes",
+        type=int,
+        nargs="+",
+        default=list(SUBSET_SIZES),
+        help=f"Subset sizes (default: {' '.join(str(s) for s in SUBSET_SIZES)}).",
+    )
+    p.add_argument(
+        "--num-streamlines",
+        type=int,
+        required=False,
+        help="Number of streamlines evaluated per subset size. "
+        "(default: 5 times the tractogram size if randomized, otherwise the "
+        "tractogram size)",
+    )
+    p.add_argument(
+        "--cpus",
+        type=int,
+        default=os.cpu_count(),
+        help=f"Number of CPUs to use in total (default: {os.cpu_count()}).",
+    )
+    p.add_argument(
+        "--sift-threads",
+        type=int,
+        default=1,
+        help="Number of threads per tcksift call (default: 1).",
+    )
+    p.add_argument(
+        "--max-loaded-tractograms",
+        type=int,
+        default=1,
+        help="Number of stages which may hold the full tractogram in memory at "
+        "the same time (default: 1).",
+    )
+    p.add_argument(
+        "--tcksift",
+        default=DEFAULT_TCKSIFT,
+        help=f"SIFT executable (default: {DEFAULT_TCKSIFT}).",
+    )
+    p.add_argument(
+        "--seed", type=int, required=False, help="Seed for the random subsets."
+    )
+    p.add_argument(
+        "--evaluate",
+        action="store_true",
+        help="Write vote statistics (results_output_<size>.csv) per subset size.",
+    )
+    p.add_argument(
+        "--archive",
+        action="store_true",
+        help="Write the packed vote archive (votes_*.npy) per subset size.",
+    )
+    p.add_argument(
+        "--tractogram-name",
+        default=TRACTOGRAM_NAME,
+        help=f"Tractogram file in the base path (default: {TRACTOGRAM_NAME}).",
+    )
+    p.add_argument(
+        "--fod-name",
+        default=FOD_NAME,
+        help=f"FOD file in the base path (default: {FOD_NAME}).",
+    )
+    p.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Draw subsets in rounds, favouring streamlines with uncertain votes "
+        "(only randomized).",
+    )
+    p.add_argument(
+        "--subsets-per-round",
+        type=int,
+        required=False,
+        help="Number of subsets per round with --adaptive/--stop-on-convergence "
+        "(default: tractogram size / subset size).",
+    )
+    p.add_argument(
+        "--target-width",
+        type=float,
+        default=DEFAULT_TARGET_WIDTH,
+        help="Width of the 90%% credible interval of the acceptance rate below which "
+        f"a streamline is settled (default: {DEFAULT_TARGET_WIDTH}).",
+    )
+    p.add_argument(
+        "--max-uncertain",
+        type=float,
+        default=DEFAULT_MAX_UNCERTAIN_FRACTION,
+        help="Fraction of streamlines which may remain unsettled "
+        f"(default: {DEFAULT_MAX_UNCERTAIN_FRACTION}).",
+    )
+    p.add_argument(
+        "--min-weight",
+        type=float,
+        default=DEFAULT_MIN_WEIGHT,
+        help="Sampling weight of settled streamlines, relative to a streamline "
+        f"without votes (default: {DEFAULT_MIN_WEIGHT}).",
+    )
+    p.add_argument(
+        "--stop-on-convergence",
+        action="store_true",
+        help="Run subsets in rounds and stop once the P/N class sizes converged.",
+    )
+    p.add_argument(
+        "--positive-limit",
+        type=float,
+        default=DEFAULT_POSITIVE_LIMIT,
+        help="Minimal acceptance rate (%%) of plausible streamlines "
+        f"(default: {DEFAULT_POSITIVE_LIMIT}).",
+    )
+    p.add_argument(
+        "--negative-limit",
+        type=float,
+        default=DEFAULT_NEGATIVE_LIMIT,
+        help="Maximal acceptance rate (%%) of implausible streamlines "
+        f"(default: {DEFAULT_NEGATIVE_LIMIT}).",
+    )
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Maximal relative change of the P/N class sizes and share of changed "
+        f"labels per subset (default: {DEFAULT_TOLERANCE}).",
+    )
+    p.add_argument(
+        "--patience",
+        type=int,
+        default=DEFAULT_PATIENCE,
+        help="Number of consecutive subsets within the tolerance "
+        f"(default: {DEFAULT_PATIENCE}).",
+    )
+    return p
+
+
+def run_in_rounds(args, budget):
+    nb_streamlines = get_nb_streamlines(
+        os.path.join(args["base_path"], args["tractogram_name"])
+    )
+    num_streamlines = args.get("num_streamlines")
+    if num_streamlines is None:
+        num_streamlines = nb_streamlines
+        if args["randomized"] == 1:
+            num_streamlines *= VOTES_PER_STREAMLINE
+
+    for size in args["subset_sizes"]:
+        monitor = None
+        if args["stop_on_convergence"]:
+            monitor = ConvergenceMonitor(
+                nb_streamlines,
+                positive_limit=args["positive_limit"],
+                negative_limit=args["negative_limit"],
+                tolerance=args["tolerance"],
+                patience=args["patience"],
+            )
+
+        nb_subsets = run_experiment_in_rounds(
+            args["base_path"],
+            randomized=args["randomized"] == 1,
+            sample_size=size,
+            subsets_per_round=args.get("subsets_per_round")
+            or max(nb_streamlines // size, 1),
+            max_subsets=num_streamlines // size,
+            output_folder=f"output_{size}",
+            budget=budget,
+            adaptive=args["adaptive"],
+            target_width=args["target_width"],
+            max_uncertain_fraction=args["max_uncertain"],
+            min_weight=args["min_weight"],
+            monitor=monitor,
+            seed=args.get("seed"),
+            evaluate=args["evaluate"],
+            archive=args["archive"],
+            tcksift=args["tcksift"],
+            sift_threads=args["sift_threads"],
+            tractogram_name=args["tractogram_name"],
+            fod_name=args["fod_name"],
+        )
+        print(f"output_{size}: finished after {nb_subsets} subsets.")
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    budget = {
+        RESOURCE_CPU: args["cpus"],
+        RESOURCE_TRACTOGRAM: args["max_loaded_tractograms"],
+    }
+
+    if args["adaptive"] or args["stop_on_convergence"]:
+        run_in_rounds(args, budget)
+        return
+
+    tasks = build_rsift_tasks(
+        args["base_path"],
+        randomized=args["randomized"] == 1,
+        subset_sizes=args["subset_sizes"],
+        num_streamlines=args.get("num_streamlines"),
+        tcksift=args["tcksift"],
+        sift_threads=args["sift_threads"],
+        seed=args.get("seed"),
+        evaluate=args["evaluate"],
+        archive=args["archive"],
+        tractogram_name=args["tractogram_name"],
+        fod_name=args["fod_name"],
+    )
+    print(f"Running {len(tasks)} tasks.")
+
+    run_tasks(tasks, budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.vote_service import DEFAULT_HOST, DEFAULT_PORT, VoteServer
+from randomised_filtering.vote_store import build_vote_store, is_vote_store
+
+
+DESC = dedent(
+    """
+    Serve vote queries (vote counts, acceptance rates, cohort histograms and
+    threshold sets by streamline index) from a vote store over HTTP.
+
+    The store is memory-mapped once; queries are answered without reading index
+    files, by as many clients as needed. See `randomised_filtering.vote_service`
+    for the endpoints and `VoteServiceClient` for queries from Python.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} vote_store
+      {filename} vote_store --build output_*
+      curl -d '{{"streamlines": [0, 1, 2]}}' http://127.0.0.1:{port}/acceptance_rates
+    """.format(
+        filename=os.path.basename(__file__), port=DEFAULT_PORT
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("vote_store", help="Path to vote store folder.")
+    p.add_argument(
+        "--build",
+        nargs="+",
+        required=False,
+        metavar="FOLDER",
+        help="Output folders from which the vote store is built if it does not "
+        "exist yet.",
+    )
+    p.add_argument(
+        "--nb_streamlines",
+        type=int,
+        required=False,
+        help="Number of streamlines in the reference tractogram (for --build). "
+        "(default: read from the reference tractogram of the index files)",
+    )
+    p.add_argument(
+        "--host", default=DEFAULT_HOST, help=f"Address (default: {DEFAULT_HOST})."
+    )
+    p.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port (default: {DEFAULT_PORT}).",
+    )
+    p.add_argument("--verbose", action="store_true", help="Log every request.")
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    if not is_vote_store(args["vote_store"]):
+        if not args.get("build"):
+            raise ValueError(
+                f"No vote store at '{args['vote_store']}', use --build to create it."
+            )
+        build_vote_store(
+            args["vote_store"], args["build"], nb_streamlines=args.get("nb_streamlines")
+        )
+
+    server = VoteServer(
+        args["vote_store"],
+        host=args["host"],
+        port=args["port"],
+        verbose=args["verbose"],
+    )
+    host, port = server.server_address[:2]
+    print(f"Serving votes of '{args['vote_store']}' on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.streamline_indices import get_indices_from_json
+from randomised_filtering.sift import (
+    DEFAULT_REMOVE_FRACTION,
+    load_incidence_matrix,
+    sift_subset,
+    write_mrtrix_selection,
+)
+
+
+DESC = dedent(
+    """
+    Run SIFT on subsets of a tractogram, given as index files, using the incidence
+    matrix of `rf_build_incidence_matrix.py` instead of `tcksift`.
+
+    For every index file `<name>.json`, a selection file `<name>_selection.txt` is
+    written in the format of tcksift's -out_selection option, which can be
+    processed further with `rf_streamline_indices_from_mrtrix_selection.py`.
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} incidence.npz output_625000/subset_*.json
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+SUFFIX_SELECTION = "_selection.txt"
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("incidence", help="Incidence matrix (.npz).")
+    p.add_argument("index_files", nargs="+", help="Index files (.json) of subsets.")
+    p.add_argument(
+        "--remove-fraction",
+        type=float,
+        default=DEFAULT_REMOVE_FRACTION,
+        help="Maximal fraction of streamlines removed per iteration "
+        f"(default: {DEFAULT_REMOVE_FRACTION}).",
+    )
+    p.add_argument(
+        "--term-number",
+        type=int,
+        required=False,
+        help="Number of streamlines at which to stop filtering.",
+    )
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+
+    incidence, fd = load_incidence_matrix(args["incidence"])
+
+    for index_file in args["index_files"]:
+        subset = get_indices_from_json(index_file, dtype=int)
+        selection = sift_subset(
+            incidence,
+            fd,
+            subset,
+            remove_fraction=args["remove_fraction"],
+            term_number=args.get("term_number"),
+        )
+        print(f"{index_file}: {selection.sum()} of {len(selection)} streamlines kept")
+        write_mrtrix_selection(
+            os.path.splitext(index_file)[0] + SUFFIX_SELECTION, selection
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from randomised_filtering.streamline_indices import (
     write_list_of_streamline_indices,
     get_list_of_streamline_indices_from_mrtrix,
 )
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = """
@@ -46,6 +47,7 @@ def build_parser():
         " (The script will append 'plausible' or 'implausible' and the .json "
         "file ending.)",
     )
+    add_trace_argument(p)
     return p
 
 
@@ -57,6 +59,8 @@ SUFFIX_FILE = ".json"
 
 if __name__ == "__main__":
     args = vars(build_parser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     idx_implausible, idx_plausible = get_list_of_streamline_indices_from_mrtrix(
         args["selection_file"]
@@ -2,17 +2,23 @@
 
 import os
 import numpy as np
-import cv2
 
 from textwrap import dedent
 from argparse import ArgumentParser, RawTextHelpFormatter
 
-from randomised_filtering.classifier.model import (
-    get_binary_model,
-    get_categorical_model,
+from randomised_filtering.classifier.inference import (
+    CLASS_INCONCLUSIVE,
+    CLASS_NEGATIVE,
+    CLASS_POSITIVE,
 )
+from randomised_filtering.classifier.feature_cache import (
+    get_or_build_feature_cache,
+    load_feature_cache,
+    split_by_label,
+)
+from randomised_filtering.classifier.preprocessing import build_preprocessing_spec
 from randomised_filtering.classifier.streamline_loader import load_data
-from randomised_filtering.classifier.training import training_cv
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 DESC = dedent(
     """
@@ -61,6 +67,12 @@ def build_argparser():
             DEFAULT_POINTS_PER_STREAMLINE
         ),
     )
+    p.add_argument(
+        "--feature-cache",
+        required=False,
+        help="Folder for caching the preprocessed streamlines. Runs with the same "
+        "inputs reuse the cache instead of preprocessing the tractogram again.",
+    )
     p.add_argument(
         "--p-vs-n", action="store_true", help="Run binary experiment (P vs N)."
     )
@@ -89,6 +101,7 @@ def build_argparser():
         type=int,
         help=f"Number of epochs (default: {DEFAULT_EPOCHS}).",
     )
+    add_trace_argument(p)
     return p
 
 
@@ -102,38 +115,36 @@ def print_args(args):
 
 def main():
     args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
     print_args(args)
 
-    pos_streamlines, neg_streamlines, inc_streamlines = load_data(
-        args["tractogram"],
-        args["positive"],
-        args["negative"],
-        normalize=True,
-    )
+    # shape of network input
+    input_shape = (3 * args["points_per_streamline"], 1)
 
-    np.random.shuffle(pos_streamlines)
-    np.random.shuffle(neg_streamlines)
-    np.random.shuffle(inc_streamlines)
-
-    # resize data to fit network input dimensions
-    resampling_shape = (3, args["points_per_streamline"])
-    input_shape = (np.prod(resampling_shape), 1)  # shape of network input
-
-    pos_resized = np.array(
-        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in pos_streamlines]
-    )
-    neg_resized = np.array(
-        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in neg_streamlines]
-    )
-    inc_resized = np.array(
-        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in inc_streamlines]
-    )
+    if args.get("feature_cache"):
+        neg_resized, pos_resized, inc_resized, min_max = load_resized_data_from_cache(
+            args["feature_cache"],
+            args["tractogram"],
+            args["positive"],
+            args["negative"],
+            args["points_per_streamline"],
+        )
+    else:
+        neg_resized, pos_resized, inc_resized, min_max = load_resized_data(
+            args["tractogram"],
+            args["positive"],
+            args["negative"],
+            args["points_per_streamline"],
+        )
 
     common_args = dict(
         input_shape=input_shape,
         batch_size=args["batch_size"],
         epochs=args["epochs"],
-        nb_folds=args["nb_folds"],
+        nb_folds=args["folds"],
+        min_max=min_max,
+        points_per_streamline=args["points_per_streamline"],
     )
 
     if args["p_vs_n"]:
@@ -153,20 +164,83 @@ def main():
         run_multi_class(pos_resized, neg_resized, inc_resized, **common_args)
 
 
+def load_resized_data(trk_path, json_path_pos, json_path_neg, points_per_streamline):
+    """Load, normalize and resample the streamlines of all classes."""
+    import cv2
+
+    pos_streamlines, neg_streamlines, inc_streamlines, min_max = load_data(
+        trk_path,
+        json_path_pos,
+        json_path_neg,
+        normalize=True,
+        return_min_max=True,
+    )
+
+    np.random.shuffle(pos_streamlines)
+    np.random.shuffle(neg_streamlines)
+    np.random.shuffle(inc_streamlines)
+
+    # resize data to fit network input dimensions
+    resampling_shape = (3, points_per_streamline)
+    input_shape = (np.prod(resampling_shape), 1)  # shape of network input
+
+    pos_resized = np.array(
+        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in pos_streamlines]
+    )
+    neg_resized = np.array(
+        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in neg_streamlines]
+    )
+    inc_resized = np.array(
+        [cv2.resize(x, resampling_shape).reshape(input_shape) for x in inc_streamlines]
+    )
+
+    return neg_resized, pos_resized, inc_resized, min_max
+
+
+def load_resized_data_from_cache(
+    cache_dir, trk_path, json_path_pos, json_path_neg, points_per_streamline
+):
+    """Load the preprocessed streamlines of all classes from the feature cache."""
+
+    path_to_cache = get_or_build_feature_cache(
+        cache_dir, trk_path, json_path_pos, json_path_neg, points_per_streamline
+    )
+    features, labels, spec = load_feature_cache(path_to_cache)
+
+    # one lazy selection per class, ordered negative/positive/inconclusive; the
+    #   features are read from the memory-mapped cache batch by batch
+    data = split_by_label(features, labels)
+    for d in data:
+        d.shuffle()
+
+    return (*data, (spec["mincoord"], spec["maxcoord"]))
+
+
 def run_plausible_vs_implausible(
     pos_resized,
     neg_resized,
     input_shape,
+    min_max,
+    points_per_streamline,
     batch_size=50,
     nb_folds=5,
     epochs=5,
     suffix="",
 ):
 
+    # tensorflow is slow to import, load it only when training starts
+    from randomised_filtering.classifier.model import get_binary_model
+    from randomised_filtering.classifier.training import training_cv
+
     # exchange one of these for inc_resized when wanting to train
     #   with inconclusive streamlines
     data = [neg_resized, pos_resized]
     model = get_binary_model(input_shape=input_shape)
+    preprocessing_spec = build_preprocessing_spec(
+        *min_max,
+        points_per_streamline=points_per_streamline,
+        class_order=[CLASS_NEGATIVE, CLASS_POSITIVE],
+    )
 
     # train 5 models in 5-fold cross-validation
     training_cv(
@@ -176,6 +250,7 @@ def run_plausible_vs_implausible(
         batch_size=batch_size,
         epochs=epochs,
         base_path_to_model=f"model_binary{suffix}",
+        preprocessing_spec=preprocessing_spec,
     )
 
 
@@ -184,13 +259,23 @@ def run_multi_class(
     neg_resized,
     inc_resized,
     input_shape,
+    min_max,
+    points_per_streamline,
     batch_size=60,
     nb_folds=5,
     epochs=2,
 ):
 
+    from randomised_filtering.classifier.model import get_categorical_model
+    from randomised_filtering.classifier.training import training_cv
+
     data = [neg_resized, pos_resized, inc_resized]
     model = get_categorical_model(num_classes=len(data), input_shape=input_shape)
+    preprocessing_spec = build_preprocessing_spec(
+        *min_max,
+        points_per_streamline=points_per_streamline,
+        class_order=[CLASS_NEGATIVE, CLASS_POSITIVE, CLASS_INCONCLUSIVE],
+    )
 
     # train 5 models in 5-fold cross-validation
     training_cv(
@@ -200,6 +285,7 @@ def run_multi_class(
         batch_size=batch_size,
         epochs=epochs,
         base_path_to_model="model_cat" + str(len(data)),
+        preprocessing_spec=preprocessing_spec,
     )
 
 
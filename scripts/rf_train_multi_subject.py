@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import os
+import functools
+
+from textwrap import dedent
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+from randomised_filtering.classifier.dataset import MultiSubjectDataset
+from randomised_filtering.classifier.feature_cache import (
+    LABEL_INCONCLUSIVE,
+    LABEL_NEGATIVE,
+    LABEL_POSITIVE,
+    get_or_build_feature_cache,
+)
+from randomised_filtering.classifier.inference import CLASS_NAMES
+from randomised_filtering.classifier.preprocessing import build_preprocessing_spec
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
+
+DESC = dedent(
+    """
+    Train a classifier on several subjects with subject-level cross-validation.
+
+    Every subject is preprocessed once into a feature cache (normalized with its
+    own min/max coordinates); batches are sampled from the memory-mapped caches,
+    balanced over the classes.
+
+    The subject file lists one subject per line:
+      <tractogram.trk> <positive.json> <negative.json>
+"""
+)
+
+EPILOG = dedent(
+    f"""
+    Example call:
+      {os.path.basename(__file__)} subjects.txt --cache-dir cache --p-vs-n
+"""
+)
+
+
+DEFAULT_POINTS_PER_STREAMLINE = 23
+DEFAULT_EPOCHS = 2
+DEFAULT_FOLDS = 5
+DEFAULT_BATCH_SIZE = 60
+DEFAULT_BATCHES_PER_EPOCH = 10000
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+
+    p.add_argument("subjects", help="Text file listing the subjects (see above).")
+    p.add_argument("--cache-dir", required=True, help="Folder for feature caches.")
+    p.add_argument(
+        "--points-per-streamline",
+        type=int,
+        default=DEFAULT_POINTS_PER_STREAMLINE,
+        help="Resample streamlines with given number of points (default: {}).".format(
+            DEFAULT_POINTS_PER_STREAMLINE
+        ),
+    )
+    p.add_argument(
+        "--p-vs-n", action="store_true", help="Run binary experiment (P vs N)."
+    )
+    p.add_argument("--three-class", action="store_true", help="Run 3-class experiment.")
+    p.add_argument(
+        "--batch-size",
+        default=DEFAULT_BATCH_SIZE,
+        type=int,
+        help=f"Batch size (default: {DEFAULT_BATCH_SIZE}).",
+    )
+    p.add_argument(
+        "--batches-per-epoch",
+        default=DEFAULT_BATCHES_PER_EPOCH,
+        type=int,
+        help=f"Batches per epoch (default: {DEFAULT_BATCHES_PER_EPOCH}).",
+    )
+    p.add_argument(
+        "--folds",
+        default=DEFAULT_FOLDS,
+        type=int,
+        help=f"Number of folds (default: {DEFAULT_FOLDS}).",
+    )
+    p.add_argument(
+        "--epochs",
+        default=DEFAULT_EPOCHS,
+        type=int,
+        help=f"Number of epochs (default: {DEFAULT_EPOCHS}).",
+    )
+    add_trace_argument(p)
+    return p
+
+
+def read_subjects(path_to_subject_file):
+    """Reads (tractogram, positive json, negative json) triples from file."""
+    with open(path_to_subject_file, "r") as f:
+        return [tuple(line.split()) for line in f if line.strip()]
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
+
+    # heavy imports only after argument parsing
+    from randomised_filtering.classifier.model import (
+        get_binary_model,
+        get_categorical_model,
+    )
+    from randomised_filtering.classifier.training import training_cv_subjects
+
+    paths_to_caches = [
+        get_or_build_feature_cache(
+            args["cache_dir"], trk, pos, neg, args["points_per_streamline"]
+        )
+        for trk, pos, neg in read_subjects(args["subjects"])
+    ]
+    dataset = MultiSubjectDataset(paths_to_caches)
+    print(f"Loaded {dataset.nb_subjects} subjects.")
+    for label, class_name in enumerate(CLASS_NAMES):
+        print(f" - {class_name}: {dataset.get_nb_streamlines(label)} streamlines")
+
+    common_args = dict(
+        dataset=dataset,
+        batch_size=args["batch_size"],
+        epochs=args["epochs"],
+        nb_folds=args["folds"],
+        batches_per_epoch=args["batches_per_epoch"],
+    )
+
+    experiments = []
+    if args["p_vs_n"]:
+        experiments.append(([LABEL_NEGATIVE, LABEL_POSITIVE], "model_multi_binarypn"))
+    if args["three_class"]:
+        experiments.append(
+            (
+                [LABEL_NEGATIVE, LABEL_POSITIVE, LABEL_INCONCLUSIVE],
+                "model_multi_cat3",
+            )
+        )
+
+    for labels, base_path_to_model in experiments:
+        # every fold trains a new model
+        if len(labels) == 2:
+            build_model = functools.partial(
+                get_binary_model, input_shape=dataset.input_shape
+            )
+        else:
+            build_model = functools.partial(
+                get_categorical_model,
+                num_classes=len(labels),
+                input_shape=dataset.input_shape,
+            )
+
+        # every tractogram is normalized with its own min/max coordinates
+        preprocessing_spec = build_preprocessing_spec(
+            None,
+            None,
+            points_per_streamline=args["points_per_streamline"],
+            class_order=[CLASS_NAMES[label] for label in labels],
+        )
+
+        training_cv_subjects(
+            labels=labels,
+            build_model=build_model,
+            base_path_to_model=base_path_to_model,
+            preprocessing_spec=preprocessing_spec,
+            **common_args,
+        )
+
+
+if __name__ == "__main__":
+    main()
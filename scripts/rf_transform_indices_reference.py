@@ -9,6 +9,7 @@ from tqdm import tqdm
 from typing import Tuple, Any
 
 from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
 
 
 DESC = """
@@ -34,6 +35,7 @@ def build_parser():
     )
     p.add_argument("subset_indices", help="Path to index file with subset indices.")
     p.add_argument("output_indices", help="Path to output index file.")
+    add_trace_argument(p)
     return p
 
 
@@ -60,6 +62,8 @@ def read_index_list_from_file(json_file: str) -> Tuple[Any, Any]:
 
 if __name__ == "__main__":
     args = vars(build_parser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
 
     # load files
     ref_file, ref_idx = read_index_list_from_file(args["subset_indices_ref"])
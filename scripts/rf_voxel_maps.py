@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+import nibabel as nib
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from textwrap import dedent
+
+from randomised_filtering.evaluation import get_acceptance_rates
+from randomised_filtering.voxel_maps import (
+    DEFAULT_CHUNK_SIZE,
+    compute_voxel_maps,
+    save_voxel_maps,
+)
+from randomised_filtering.vote_store import VoteStore
+from randomised_filtering.instrumentation import add_trace_argument, set_trace_path
+
+
+DESC = dedent(
+    """
+    Write voxel maps of the mean acceptance rate, the number of streamlines with
+    votes and the number of votes (only with --vote_store) per voxel.
+
+    The acceptance rates are read from a vote store (all subset sizes, or one
+    output folder with --folder) or from a column of the percentages file of
+    `rf_eval_get_pos_percentages_for_streamlines.py` (computed without
+    --json_path, i.e. for all streamlines).
+"""
+)
+EPILOG = dedent(
+    """
+    example calls:
+
+      {filename} all.trk data.nii.gz maps/all --vote_store vote_store
+      {filename} all.trk data.nii.gz maps/625000 --vote_store vote_store \\
+          --folder output_625000
+      {filename} all.trk data.nii.gz maps/all --percentages percentages_.npy
+    """.format(
+        filename=os.path.basename(__file__)
+    )
+)
+
+
+def build_argparser():
+    p = ArgumentParser(
+        description=DESC, epilog=EPILOG, formatter_class=RawTextHelpFormatter
+    )
+    p.add_argument("tractogram", help="Reference tractogram of the votes.")
+    p.add_argument("reference", help="Image defining the voxel grid (data.nii.gz).")
+    p.add_argument(
+        "output_prefix",
+        help="Prefix of the output maps (<prefix>_<map name>.nii.gz).",
+    )
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument("--vote_store", help="Path to vote store folder.")
+    source.add_argument(
+        "--percentages",
+        help="Path to percentages file (.npy, one row per streamline).",
+    )
+    p.add_argument(
+        "--folder",
+        required=False,
+        help="Output folder of the vote store to use (default: all subset sizes).",
+    )
+    p.add_argument(
+        "--column",
+        type=int,
+        default=0,
+        help="Column of the percentages file to use (default: 0, all subset sizes).",
+    )
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of streamlines voxelized at once "
+        f"(default: {DEFAULT_CHUNK_SIZE}).",
+    )
+    add_trace_argument(p)
+    return p
+
+
+def main():
+    args = vars(build_argparser().parse_args())
+    if args.get("trace"):
+        set_trace_path(args["trace"])
+
+    nb_votes = None
+    if args.get("vote_store"):
+        store = VoteStore(args["vote_store"])
+        if args.get("folder"):
+            counts = store.get_counts(args["folder"])
+        else:
+            counts = store.get_total_counts()
+        acceptance_rates = get_acceptance_rates(counts)
+        nb_votes = counts.sum(axis=1, dtype=np.int32)
+    else:
+        percentages = np.load(args["percentages"], mmap_mode="r")
+        acceptance_rates = np.asarray(percentages[:, args["column"]], np.float32)
+
+    reference_img = nib.load(args["reference"])
+    maps = compute_voxel_maps(
+        args["tractogram"],
+        reference_img,
+        acceptance_rates,
+        nb_votes=nb_votes,
+        chunk_size=args["chunk_size"],
+    )
+    save_voxel_maps(args["output_prefix"], maps, reference_img)
+    print("Maps written:", ", ".join(f"{args['output_prefix']}_{m}" for m in maps))
+
+
+if __name__ == "__main__":
+    main()
@@ -57,18 +57,22 @@ mkdir -p "${PATH_TO_OUTPUT_FOLDER}"
 
 
 #obtain index files
+# (all calls run in one interpreter with 'rf batch', see randomised_filtering.cli)
+BATCH_FILE="${PATH_TO_OUTPUT_FOLDER}/rf_batch.txt"
+: > "${BATCH_FILE}"
 for i in ${BOOTSTRAP_IDS}
 do
   # RANDOMIZED is 1 for randomized indices, 0 for sequential indices
   # --set  only necessary for sequential indices (indicates which batch to use)
-    rf_create_streamline_indices.py \
-        --set "${i}" \
-        --hist "${PATH_TO_OUTPUT_FOLDER}/subset_${i}.png" \
-        "${BASE_PATH}/${TRACTOGRAM_NAME}" \
+    echo "create_streamline_indices" \
+        "--set ${i}" \
+        "--hist '${PATH_TO_OUTPUT_FOLDER}/subset_${i}.png'" \
+        "'${BASE_PATH}/${TRACTOGRAM_NAME}'" \
         "${SAMPLE_SIZE}" \
         "${RANDOMIZED}" \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}.json"
+        "'${PATH_TO_OUTPUT_FOLDER}/subset_${i}.json'" >> "${BATCH_FILE}"
 done
+rf batch "${BATCH_FILE}" || exit 1
 
 # obtain subsets
 running_commands=()
@@ -104,27 +108,29 @@ do
 done
 
 # convert selection files (binary) to index files
+: > "${BATCH_FILE}"
 for selection_file in $(ls ${PATH_TO_OUTPUT_FOLDER}/* | grep selection.txt)
 do
-    rf_streamline_indices_from_mrtrix_selection.py \
-        "${selection_file}" \
-        "${selection_file%_selection.txt}.trk" \
-        "${selection_file%_selection.txt}"
+    echo "streamline_indices_from_mrtrix_selection" \
+        "'${selection_file}'" \
+        "'${selection_file%_selection.txt}.trk'" \
+        "'${selection_file%_selection.txt}'" >> "${BATCH_FILE}"
 done
 
 # transform index files to reference index files
 # (will convert indices from sub-tractogram to indices in the full tractogram
 for i in ${BOOTSTRAP_IDS}
 do
-    rf_transform_indices_reference.py \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}.json" \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}_plausible_indices.json" \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}_plausible_ref.json"
-    rf_transform_indices_reference.py \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}.json" \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}_implausible_indices.json" \
-        "${PATH_TO_OUTPUT_FOLDER}/subset_${i}_implausible_ref.json"
+    for label in plausible implausible
+    do
+        echo "transform_indices_reference" \
+            "'${PATH_TO_OUTPUT_FOLDER}/subset_${i}.json'" \
+            "'${PATH_TO_OUTPUT_FOLDER}/subset_${i}_${label}_indices.json'" \
+            "'${PATH_TO_OUTPUT_FOLDER}/subset_${i}_${label}_ref.json'" >> "${BATCH_FILE}"
+    done
 done
+rf batch "${BATCH_FILE}" || exit 1
+rm "${BATCH_FILE}"
 
 # discard subset tractogram files for efficient use of space
 rm ${PATH_TO_OUTPUT_FOLDER}/*.trk
@@ -20,9 +20,11 @@ setuptools.setup(
     install_requires=[
         "dipy>=1.3.0",
         "nibabel>=3.0.2",
-        "numpy>=1.18.0",
+        "numpy>=1.20.0",  # np.lib.stride_tricks.sliding_window_view
+        "scipy",
         "tqdm",
         "matplotlib",
     ],
     scripts=glob("scripts/*.py"),
+    entry_points={"console_scripts": ["rf=randomised_filtering.cli:main"]},
 )
@@ -0,0 +1,142 @@
+"""
+Adaptive rSIFT sampling.
+
+Instead of drawing every subset uniformly at random, the votes collected so far
+are used to concentrate further subsets on streamlines whose acceptance rate is
+still uncertain. The acceptance rate of every streamline is modelled with a Beta
+posterior (uniform prior) given its positive and negative votes; the width of
+its central credible interval is the uncertainty of the streamline.
+
+Streamlines are drawn without replacement with probability proportional to
+their uncertainty (plus a floor, so that settled streamlines are still seen in
+some subsets and SIFT keeps operating on representative subsets).
+"""
+
+import numpy as np
+
+from typing import List, Optional
+
+
+DEFAULT_CREDIBLE_LEVEL = 0.9
+DEFAULT_TARGET_WIDTH = 0.5
+DEFAULT_MAX_UNCERTAIN_FRACTION = 0.01
+DEFAULT_MIN_WEIGHT = 0.05
+
+
+def get_posterior_width(
+    counts: np.ndarray,
+    level: float = DEFAULT_CREDIBLE_LEVEL,
+    prior: float = 1.0,
+) -> np.ndarray:
+    """Computes the width of the credible interval of every acceptance rate.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+        (see `evaluation.get_vote_counts`)
+    level : float, optional
+        probability mass of the central credible interval
+    prior : float, optional
+        parameters of the symmetric Beta prior (1: uniform)
+
+    Returns
+    -------
+    width of the credible interval per streamline, in [0, 1]
+    """
+    from scipy.stats import beta  # slow to import, only needed in adaptive mode
+
+    # only few distinct vote combinations exist, evaluate the posterior once each
+    combinations, inverse = np.unique(counts, axis=0, return_inverse=True)
+    a = combinations[:, 0] + prior
+    b = combinations[:, 1] + prior
+    tail = (1 - level) / 2
+    widths = beta.ppf(1 - tail, a, b) - beta.ppf(tail, a, b)
+    return widths[inverse.ravel()]
+
+
+def get_uncertain_fraction(widths: np.ndarray, target_width: float) -> float:
+    """Returns the fraction of streamlines with a credible interval wider than
+    the target width."""
+    return float(np.mean(widths > target_width)) if len(widths) else 0.0
+
+
+def is_converged(
+    counts: np.ndarray,
+    target_width: float = DEFAULT_TARGET_WIDTH,
+    max_uncertain_fraction: float = DEFAULT_MAX_UNCERTAIN_FRACTION,
+    level: float = DEFAULT_CREDIBLE_LEVEL,
+) -> bool:
+    """Checks whether (almost) all acceptance rates reached the target confidence.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+    target_width : float, optional
+        maximal width of the credible interval of a settled streamline
+    max_uncertain_fraction : float, optional
+        fraction of streamlines which may remain unsettled
+    level : float, optional
+        probability mass of the credible interval
+
+    Returns
+    -------
+    True if the fraction of unsettled streamlines is small enough
+    """
+    widths = get_posterior_width(counts, level=level)
+    return get_uncertain_fraction(widths, target_width) <= max_uncertain_fraction
+
+
+def weighted_sample_without_replacement(
+    weights: np.ndarray, size: int, rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    """Draws `size` indices without replacement, proportionally to the weights.
+
+    Uses the keys u^(1/w) of Efraimidis and Spirakis (2006), computed in log space,
+    and selects the largest keys in linear time.
+
+    Returns
+    -------
+    sorted array of the drawn indices
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    weights = np.asarray(weights, dtype=np.float64)
+    if size > np.count_nonzero(weights > 0):
+        raise ValueError("Not enough streamlines with positive weight.")
+
+    with np.errstate(divide="ignore"):
+        keys = np.log(rng.random(len(weights))) / weights
+    return np.sort(np.argpartition(keys, len(keys) - size)[len(keys) - size :])
+
+
+def create_adaptive_streamline_indices(
+    counts: np.ndarray,
+    num_streamlines: int,
+    min_weight: float = DEFAULT_MIN_WEIGHT,
+    level: float = DEFAULT_CREDIBLE_LEVEL,
+    rng: Optional[np.random.Generator] = None,
+) -> List[int]:
+    """Creates the streamline indices of one subset, favouring uncertain streamlines.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+    num_streamlines : int
+        number of streamlines in the subset
+    min_weight : float, optional
+        lower bound of the sampling weight of settled streamlines
+    level : float, optional
+        probability mass of the credible interval
+    rng : np.random.Generator, optional
+        random generator
+
+    Returns
+    -------
+    list of streamline indices
+    """
+    weights = np.maximum(get_posterior_width(counts, level=level), min_weight)
+    return weighted_sample_without_replacement(weights, num_streamlines, rng).tolist()
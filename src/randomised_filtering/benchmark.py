@@ -0,0 +1,373 @@
+"""
+Benchmarks of the evaluation and training data paths on synthetic data.
+
+A benchmark data folder contains a random tractogram (`all.trk`), experiment
+output folders with random votes (`output_<subset size>/subset_*_ref.json`)
+and a random plausible/implausible split (for `load_data`); it is created by
+`save_benchmark_data` at a configurable scale.
+
+Every benchmark prepares its inputs and measures one stage with `measure`. The
+stage is run `repeat` times for the wall time (minimum is reported) and once
+more with `tracemalloc` for the peak memory allocated by the stage. Results are
+stored as JSON and compared against a saved baseline to detect regressions.
+"""
+
+import os
+import json
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+from randomised_filtering.synthetic import (
+    save_synthetic_tractogram,
+    save_synthetic_vote_folder,
+)
+
+
+DATA_SPEC_FILENAME = "benchmark_data.json"
+TRACTOGRAM_FILENAME = "all.trk"
+PLAUSIBLE_FILENAME = "plausible.json"
+IMPLAUSIBLE_FILENAME = "implausible.json"
+
+DEFAULT_NB_STREAMLINES = 100000
+DEFAULT_SUBSET_SIZES = (5000, 10000, 20000)
+DEFAULT_NB_SUBSETS = 20
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+
+# number of points per streamline after resampling (input of the shipped models)
+POINTS_PER_STREAMLINE = 22
+
+
+def save_benchmark_data(
+    path_to_folder: str,
+    nb_streamlines: int = DEFAULT_NB_STREAMLINES,
+    subset_sizes: Sequence[int] = DEFAULT_SUBSET_SIZES,
+    nb_subsets: int = DEFAULT_NB_SUBSETS,
+    seed: int = 0,
+) -> dict:
+    """Creates a benchmark data folder, unless one with the same spec exists.
+
+    Returns
+    -------
+    spec of the data folder (also stored in the folder)
+    """
+    spec = {
+        "nb_streamlines": nb_streamlines,
+        "subset_sizes": list(subset_sizes),
+        "nb_subsets": nb_subsets,
+        "seed": seed,
+    }
+    path_to_spec = os.path.join(path_to_folder, DATA_SPEC_FILENAME)
+    if os.path.exists(path_to_spec):
+        with open(path_to_spec, "r") as f:
+            if json.load(f) == spec:
+                print("Using existing benchmark data in", path_to_folder)
+                return spec
+        shutil.rmtree(path_to_folder)
+
+    os.makedirs(path_to_folder, exist_ok=True)
+    path_to_tractogram = os.path.join(path_to_folder, TRACTOGRAM_FILENAME)
+    print(f"Writing tractogram with {nb_streamlines} streamlines")
+    save_synthetic_tractogram(path_to_tractogram, nb_streamlines, seed=seed)
+
+    # acceptance rates shared by all subset sizes, mostly close to 0 or 1
+    rng = np.random.default_rng(seed)
+    acceptance_rates = rng.beta(0.5, 0.5, size=nb_streamlines)
+    for i, subset_size in enumerate(subset_sizes):
+        print(f"Writing {nb_subsets} subsets of {subset_size} streamlines")
+        save_synthetic_vote_folder(
+            os.path.join(path_to_folder, f"output_{subset_size}"),
+            path_to_tractogram,
+            nb_streamlines,
+            min(subset_size, nb_streamlines),
+            nb_subsets,
+            acceptance_rates=acceptance_rates,
+            seed=seed + i + 1,
+        )
+
+    labels = rng.integers(0, 3, size=nb_streamlines)
+    for label, filename in [(1, PLAUSIBLE_FILENAME), (0, IMPLAUSIBLE_FILENAME)]:
+        write_list_of_streamline_indices(
+            os.path.join(path_to_folder, filename),
+            np.where(labels == label)[0].tolist(),
+            path_to_tractogram,
+        )
+
+    # written last, marks complete data
+    with open(path_to_spec, "w") as f:
+        json.dump(spec, f)
+    return spec
+
+
+class Measurement:
+    """Measures one stage of a benchmark, see `measure`."""
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.seconds: Optional[float] = None
+        self.peak_bytes: Optional[int] = None
+        self.items = 0
+
+    @contextmanager
+    def measure(self, nb_items: int = 0):
+        """Measures the enclosed code, which processes `nb_items` items."""
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.items = nb_items
+            if self.trace_memory:
+                self.peak_bytes = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+
+def _get_folder(path_to_data: str, spec: dict, index: int = 0) -> str:
+    return os.path.join(path_to_data, f"output_{spec['subset_sizes'][index]}")
+
+
+def _nb_votes(spec: dict, folders: int = 1) -> int:
+    return sum(
+        min(size, spec["nb_streamlines"]) * spec["nb_subsets"]
+        for size in spec["subset_sizes"][:folders]
+    )
+
+
+def bench_process_subsets(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import process_subsets
+
+    with m.measure(nb_items=_nb_votes(spec)):
+        process_subsets(_get_folder(path_to_data, spec))
+
+
+def bench_get_vote_counts(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import get_vote_counts
+
+    with m.measure(nb_items=_nb_votes(spec)):
+        get_vote_counts(_get_folder(path_to_data, spec), spec["nb_streamlines"])
+
+
+def bench_evaluate_subsets(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import evaluate_subsets, process_subsets
+
+    streamline_index = process_subsets(_get_folder(path_to_data, spec))
+    with m.measure(nb_items=spec["nb_streamlines"]):
+        evaluate_subsets(streamline_index, spec["nb_subsets"], "bench", output_dir)
+
+
+def bench_evaluate_vote_counts(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import evaluate_vote_counts, get_vote_counts
+
+    counts = get_vote_counts(_get_folder(path_to_data, spec), spec["nb_streamlines"])
+    with m.measure(nb_items=spec["nb_streamlines"]):
+        evaluate_vote_counts(counts, spec["nb_subsets"], "bench", output_dir)
+
+
+def bench_get_meta_vote_counts(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import get_meta_vote_counts
+
+    folders = [f"output_{size}" for size in spec["subset_sizes"]]
+    with m.measure(nb_items=_nb_votes(spec, len(folders))):
+        get_meta_vote_counts(folders, path_to_data, spec["nb_streamlines"])
+
+
+def bench_get_conditional_sets_from_folder(path_to_data, spec, m, output_dir):
+    from randomised_filtering.evaluation import get_conditional_sets_from_folder
+
+    with m.measure(nb_items=_nb_votes(spec)):
+        get_conditional_sets_from_folder(_get_folder(path_to_data, spec), 100)
+
+
+def bench_read_tractogram(path_to_data, spec, m, output_dir):
+    from randomised_filtering.classifier.streamline_loader import (
+        iter_streamline_chunks,
+    )
+
+    path = os.path.join(path_to_data, TRACTOGRAM_FILENAME)
+    with m.measure(nb_items=spec["nb_streamlines"]):
+        for _ in iter_streamline_chunks(path, 100000):
+            pass
+
+
+def bench_load_data(path_to_data, spec, m, output_dir):
+    from randomised_filtering.classifier.streamline_loader import load_data
+
+    with m.measure(nb_items=spec["nb_streamlines"]):
+        load_data(
+            os.path.join(path_to_data, TRACTOGRAM_FILENAME),
+            os.path.join(path_to_data, PLAUSIBLE_FILENAME),
+            os.path.join(path_to_data, IMPLAUSIBLE_FILENAME),
+            normalize=True,
+        )
+
+
+def _load_streamlines(path_to_data, nb_streamlines):
+    from randomised_filtering.classifier.streamline_loader import (
+        iter_streamline_chunks,
+    )
+
+    path = os.path.join(path_to_data, TRACTOGRAM_FILENAME)
+    return next(iter_streamline_chunks(path, nb_streamlines))
+
+
+def bench_preprocess_streamlines(path_to_data, spec, m, output_dir):
+    from randomised_filtering.classifier.preprocessing import preprocess_streamlines
+
+    streamlines = _load_streamlines(path_to_data, spec["nb_streamlines"])
+    with m.measure(nb_items=len(streamlines)):
+        preprocess_streamlines(streamlines, [0] * 3, [100] * 3, POINTS_PER_STREAMLINE)
+
+
+def bench_balanced_data_gen(path_to_data, spec, m, output_dir):
+    from randomised_filtering.classifier.generator import BalancedDataGen
+
+    rng = np.random.default_rng(spec["seed"])
+    shape = (spec["nb_streamlines"] // 2, 3 * POINTS_PER_STREAMLINE, 1)
+    data = [rng.uniform(-1, 1, size=shape).astype(np.float32) for _ in range(2)]
+    generator = BalancedDataGen(data, [1, 1], batch_size=1000)
+    with m.measure(nb_items=len(generator) * 1000):
+        for i in range(len(generator)):
+            generator[i]
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    "process_subsets": bench_process_subsets,
+    "get_vote_counts": bench_get_vote_counts,
+    "evaluate_subsets": bench_evaluate_subsets,
+    "evaluate_vote_counts": bench_evaluate_vote_counts,
+    "get_meta_vote_counts": bench_get_meta_vote_counts,
+    "get_conditional_sets_from_folder": bench_get_conditional_sets_from_folder,
+    "read_tractogram": bench_read_tractogram,
+    "load_data": bench_load_data,
+    "preprocess_streamlines": bench_preprocess_streamlines,
+    "balanced_data_gen": bench_balanced_data_gen,
+}
+
+
+def run_benchmark(
+    name: str, path_to_data: str, spec: dict, repeat: int = DEFAULT_REPEAT
+) -> dict:
+    """Runs one benchmark, returns its result (or the error it raised)."""
+    benchmark = BENCHMARKS[name]
+    seconds: List[float] = []
+    output_dir = tempfile.mkdtemp(prefix="rf_benchmark_")
+    try:
+        for _ in range(repeat):
+            m = Measurement(trace_memory=False)
+            benchmark(path_to_data, spec, m, output_dir)
+            if m.seconds is None:
+                raise RuntimeError(f"Benchmark '{name}' did not measure anything.")
+            seconds.append(m.seconds)
+        m = Measurement(trace_memory=True)
+        benchmark(path_to_data, spec, m, output_dir)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    best = min(seconds)
+    return {
+        "seconds": best,
+        "peak_mb": None if m.peak_bytes is None else m.peak_bytes / 2**20,
+        "items": m.items,
+        "items_per_second": m.items / best if best > 0 else None,
+    }
+
+
+def run_benchmarks(
+    path_to_data: str,
+    spec: dict,
+    names: Optional[Sequence[str]] = None,
+    repeat: int = DEFAULT_REPEAT,
+) -> dict:
+    """Runs the given benchmarks (default: all) on a benchmark data folder.
+
+    Returns
+    -------
+    dictionary with the data spec, environment and results per benchmark
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(
+            f"Unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}."
+        )
+
+    results = {}
+    for name in names:
+        print(f"Running benchmark {name}")
+        results[name] = run_benchmark(name, path_to_data, spec, repeat)
+        print(format_result(name, results[name]))
+
+    return {
+        "data": spec,
+        "environment": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    if "error" in result:
+        return f"{name};failed;{result['error']}"
+    rate = result["items_per_second"]
+    return (
+        f"{name};{result['seconds']:.3f}s;{result['peak_mb']:.1f}MB;"
+        f"{result['items']} items;{round(rate) if rate else '-'} items/s"
+    )
+
+
+def compare_to_baseline(
+    results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> List[dict]:
+    """Lists the regressions of the results relative to a baseline.
+
+    A benchmark regresses if its time or peak memory exceeds the baseline by more
+    than `tolerance` (relative), or if it fails while it ran in the baseline.
+    Benchmarks missing from either run are skipped.
+
+    Returns
+    -------
+    list of dictionaries with benchmark, metric, baseline and current value
+    """
+    if results["data"] != baseline["data"]:
+        print("Warning: results and baseline were measured on different data.")
+
+    regressions = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or "error" in reference:
+            continue
+        if "error" in result:
+            regressions.append(
+                {"benchmark": name, "metric": "error", "baseline": None, "current": 1}
+            )
+            continue
+        for metric in ["seconds", "peak_mb"]:
+            if result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(
+                    {
+                        "benchmark": name,
+                        "metric": metric,
+                        "baseline": reference[metric],
+                        "current": result[metric],
+                    }
+                )
+    return regressions
@@ -0,0 +1,126 @@
+"""
+Cascade of a cheap binary model and a second model for uncertain streamlines.
+
+The binary model (negative vs. positive, e.g. `data/models/model_negative_positive`)
+scores every streamline. Only streamlines whose probability of being positive
+lies inside the uncertainty band are passed to the second model (e.g. the
+three-class model `model_negative_positive_inconclusive`), whose prediction
+replaces the binary one. The probabilities of both stages are merged into the
+class order `inference.CLASS_NAMES`.
+"""
+
+import time
+import numpy as np
+
+from collections import defaultdict
+from typing import DefaultDict, Sequence, Tuple
+
+from .inference import (
+    CLASS_NAMES,
+    CLASS_NEGATIVE,
+    CLASS_POSITIVE,
+    get_class_probabilities,
+)
+
+# probability of the positive class for which the second model is asked
+DEFAULT_UNCERTAINTY_BAND = (0.2, 0.8)
+
+STAGE_FIRST = "first stage"
+STAGE_SECOND = "second stage"
+
+
+class CascadeModel:
+    """Binary first stage, second stage for streamlines in the uncertainty band.
+
+    Parameters
+    ----------
+    first_model
+        binary model (keras or numpy, see `inference.load_model`)
+    first_class_order : sequence of str
+        class order of the first model, must consist of negative and positive
+    second_model
+        model for uncertain streamlines, same input as the first model
+    second_class_order : sequence of str
+        class order of the second model (classes of `inference.CLASS_NAMES`)
+    band : tuple of float, optional
+        lower and upper (inclusive) probability of the positive class of the
+        first model for which a streamline is passed on
+
+    `predict_on_batch` returns probabilities in the order of `CLASS_NAMES`. The
+    number of streamlines and the time spent per stage are collected in `items`
+    and `seconds`.
+    """
+
+    def __init__(
+        self,
+        first_model,
+        first_class_order: Sequence[str],
+        second_model,
+        second_class_order: Sequence[str],
+        band: Tuple[float, float] = DEFAULT_UNCERTAINTY_BAND,
+    ):
+        assert sorted(first_class_order) == sorted(
+            [CLASS_NEGATIVE, CLASS_POSITIVE]
+        ), "First stage must be a negative vs. positive model."
+        assert all(c in CLASS_NAMES for c in second_class_order), "Unknown class."
+        assert (
+            first_model.input_shape[1:] == second_model.input_shape[1:]
+        ), "Models differ in input shape."
+        assert band[0] <= band[1], "Invalid uncertainty band."
+
+        self.first_model = first_model
+        self.second_model = second_model
+        self.band = band
+        self._positive = list(first_class_order).index(CLASS_POSITIVE)
+        self._first_columns = [CLASS_NAMES.index(c) for c in first_class_order]
+        self._second_columns = [CLASS_NAMES.index(c) for c in second_class_order]
+
+        self.input_shape = first_model.input_shape
+        self.output_shape = (None, len(CLASS_NAMES))
+        self.items: DefaultDict[str, int] = defaultdict(int)
+        self.seconds: DefaultDict[str, float] = defaultdict(float)
+
+    def predict_on_batch(self, x: np.ndarray) -> np.ndarray:
+        start = time.perf_counter()
+        first = get_class_probabilities(self.first_model.predict_on_batch(x))
+        self.seconds[STAGE_FIRST] += time.perf_counter() - start
+        self.items[STAGE_FIRST] += len(x)
+
+        probabilities = np.zeros((len(x), len(CLASS_NAMES)), dtype=np.float32)
+        probabilities[:, self._first_columns] = first
+
+        positive = first[:, self._positive]
+        uncertain = np.where((positive >= self.band[0]) & (positive <= self.band[1]))[0]
+        if len(uncertain) > 0:
+            start = time.perf_counter()
+            second = get_class_probabilities(
+                self.second_model.predict_on_batch(x[uncertain])
+            )
+            self.seconds[STAGE_SECOND] += time.perf_counter() - start
+            self.items[STAGE_SECOND] += len(uncertain)
+
+            probabilities[uncertain] = 0
+            probabilities[uncertain[:, None], self._second_columns] = second
+        return probabilities
+
+    def get_speedup(self) -> float:
+        """Estimated speedup over running the second model on all streamlines.
+
+        Returns NaN if no streamline reached the second stage.
+        """
+        if self.items[STAGE_SECOND] == 0:
+            return np.nan
+        seconds_per_item = self.seconds[STAGE_SECOND] / self.items[STAGE_SECOND]
+        baseline = seconds_per_item * self.items[STAGE_FIRST]
+        return baseline / (self.seconds[STAGE_FIRST] + self.seconds[STAGE_SECOND])
+
+    def report(self) -> str:
+        nb_streamlines = self.items[STAGE_FIRST]
+        lines = ["stage;streamlines;% of streamlines;seconds;streamlines/s"]
+        for stage in [STAGE_FIRST, STAGE_SECOND]:
+            items, seconds = self.items[stage], self.seconds[stage]
+            percentage = 100 * items / nb_streamlines if nb_streamlines > 0 else 0
+            rate = round(items / seconds) if seconds > 0 and items > 0 else "-"
+            lines.append(f"{stage};{items};{percentage:.2f};{seconds:.2f};{rate}")
+        lines.append(f"speedup over second model only;{self.get_speedup():.2f}")
+        return "\n".join(lines)
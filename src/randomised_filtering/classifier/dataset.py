@@ -0,0 +1,127 @@
+"""
+Training data of several subjects, backed by memory-mapped feature caches
+(see `feature_cache`), so that only the sampled streamlines are held in memory.
+"""
+
+import numpy as np
+
+from typing import List, Optional, Sequence, Tuple
+
+from .feature_cache import load_feature_cache
+from .inference import CLASS_NAMES
+
+
+class MultiSubjectDataset:
+    """Preprocessed streamlines of several subjects.
+
+    Every subject is stored in its own feature cache and was normalized with its
+    own min/max coordinates when the cache was built.
+
+    Parameters
+    ----------
+    paths_to_caches : sequence of str
+        one feature cache per subject
+    """
+
+    def __init__(self, paths_to_caches: Sequence[str]):
+        self._paths = list(paths_to_caches)
+        self._features = []
+        self._class_indices = []
+
+        input_lengths = set()
+        for path in self._paths:
+            features, labels, _ = load_feature_cache(path)
+            input_lengths.add(features.shape[1])
+            self._features.append(features)
+            self._class_indices.append(
+                [
+                    np.where(labels == label)[0].astype(np.int32)
+                    for label in range(len(CLASS_NAMES))
+                ]
+            )
+
+        if len(input_lengths) > 1:
+            raise ValueError("All subjects must use the same points per streamline.")
+
+        self._input_length = input_lengths.pop() if input_lengths else 0
+
+        # number of streamlines per subject (rows) and class (columns)
+        self._class_counts = np.array(
+            [[len(idx) for idx in indices] for indices in self._class_indices],
+            dtype=np.int64,
+        ).reshape((len(self._paths), len(CLASS_NAMES)))
+
+    @property
+    def nb_subjects(self) -> int:
+        return len(self._paths)
+
+    @property
+    def input_shape(self) -> Tuple[int, int]:
+        return self._input_length, 1
+
+    def get_nb_streamlines(self, label: int) -> int:
+        """Returns the number of streamlines of the given class over all subjects."""
+        return int(self._class_counts[:, label].sum())
+
+    def subset(self, subject_ids: Sequence[int]) -> "MultiSubjectDataset":
+        """Returns a dataset restricted to the given subjects."""
+        return MultiSubjectDataset([self._paths[i] for i in subject_ids])
+
+    def sample(
+        self, label: int, nb_samples: int, rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        """Draws random streamlines (with replacement) of one class.
+
+        Subjects are drawn proportionally to their number of streamlines of the
+        class, i.e. every streamline of the class is equally likely.
+
+        Returns
+        -------
+        array of shape (nb_samples, 3 * points_per_streamline, 1)
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        counts = self._class_counts[:, label]
+        if counts.sum() == 0:
+            raise ValueError(
+                f"No streamlines of class '{CLASS_NAMES[label]}' in the subjects "
+                f"{self._paths}."
+            )
+        subjects = rng.choice(
+            self.nb_subjects, size=nb_samples, p=counts / counts.sum()
+        )
+
+        x = np.empty((nb_samples,) + self.input_shape, dtype=np.float32)
+        for subject in np.unique(subjects):
+            mask = subjects == subject
+            rows = rng.choice(self._class_indices[subject][label], size=mask.sum())
+            # sorted reads are considerably faster on memory-mapped data
+            x[mask] = self._features[subject][np.sort(rows)]
+        return x
+
+    def iter_class(self, label: int, chunk_size: int = 100000):
+        """Yields all streamlines of one class, subject by subject and in chunks."""
+        for features, indices in zip(self._features, self._class_indices):
+            idx = indices[label]
+            for start in range(0, len(idx), chunk_size):
+                yield np.asarray(features[idx[start : start + chunk_size]])
+
+
+def get_subject_folds(
+    nb_subjects: int, nb_folds: int
+) -> List[Tuple[List[int], List[int]]]:
+    """Splits subjects into folds for cross-validation.
+
+    Returns
+    -------
+    list with one tuple (train subject ids, test subject ids) per fold
+    """
+    if nb_folds > nb_subjects:
+        raise ValueError("Need at least as many subjects as folds.")
+
+    subject_ids = np.arange(nb_subjects)
+    return [
+        (np.setdiff1d(subject_ids, test_ids).tolist(), test_ids.tolist())
+        for test_ids in np.array_split(subject_ids, nb_folds)
+    ]
@@ -0,0 +1,197 @@
+"""
+Ensemble of cross-validation models (e.g. `model_binarypn_0` ... `_4` written by
+`training.training_cv`), evaluated in a single pass.
+
+The weights of all members are stacked: the first convolution, which sees the
+same input for every member, becomes one convolution with the output channels
+of all members; later convolutions and the dense layer become batched matrix
+products with one weight matrix per member. A batch of streamlines therefore
+goes through the ensemble with as many NumPy calls as through a single model.
+"""
+
+import numpy as np
+
+from typing import List, Sequence
+
+from .inference import get_class_order, get_num_classes
+from .numpy_model import NumpyModel, conv1d_same, load_numpy_model, max_pool1d
+from .preprocessing import load_preprocessing_spec
+
+
+def _grouped_conv1d_same(x: np.ndarray, kernels: np.ndarray) -> np.ndarray:
+    """Convolves every member's channels with that member's kernel (no bias).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        input of shape (batch, length, members, in channels)
+    kernels : np.ndarray
+        kernels of shape (members, kernel size, in channels, out channels)
+    """
+    nb_members, kernel_size, in_channels, out_channels = kernels.shape
+    batch, length = x.shape[:2]
+    padding = ((0, 0), ((kernel_size - 1) // 2, kernel_size // 2), (0, 0), (0, 0))
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.pad(x, padding), kernel_size, axis=1
+    )  # (batch, length, members, in channels, kernel size)
+    columns = windows.reshape(batch * length, nb_members, in_channels * kernel_size)
+    weights = kernels.transpose(0, 2, 1, 3).reshape(nb_members, -1, out_channels)
+    out = np.matmul(columns.transpose(1, 0, 2), weights)
+    return out.transpose(1, 0, 2).reshape(batch, length, nb_members, out_channels)
+
+
+class EnsembleModel:
+    """Mean prediction and disagreement of models with the same architecture.
+
+    Parameters
+    ----------
+    members : list of NumpyModel
+        models of the ensemble (same layers and input length)
+
+    `predict_on_batch` returns the mean class probabilities of the members and,
+    as last column, their disagreement: the standard deviation across members of
+    the probability of the class predicted by the ensemble.
+    """
+
+    def __init__(self, members: List[NumpyModel]):
+        assert len(members) > 0, "Need at least one model."
+        shapes = [[w.shape for w in m.get_weights()] for m in members]
+        assert all(s == shapes[0] for s in shapes), "Models differ in architecture."
+        assert all(
+            m.input_shape == members[0].input_shape for m in members
+        ), "Models differ in input length."
+
+        self.nb_members = len(members)
+        first = [m.convolutions[0] for m in members]
+        self.first_kernel = np.concatenate([k for k, _ in first], axis=2)
+        self.first_bias = np.concatenate([b for _, b in first])
+        self.convolutions = [
+            (
+                np.stack([m.convolutions[i][0] for m in members]),
+                np.stack([m.convolutions[i][1] for m in members]),
+            )
+            for i in range(1, len(members[0].convolutions))
+        ]
+        self.dense_kernel = np.stack([m.dense_kernel for m in members])
+        self.dense_bias = np.stack([m.dense_bias for m in members])
+
+        # binary (sigmoid) members are reported with two class columns
+        self.num_classes = max(self.dense_kernel.shape[2], 2)
+        self.input_shape = members[0].input_shape
+        self.output_shape = (None, self.num_classes + 1)
+
+    def predict_members(self, x: np.ndarray) -> np.ndarray:
+        """Returns the class probabilities of every member.
+
+        Returns
+        -------
+        array of shape (batch, members, classes)
+        """
+        x = np.asarray(x, dtype=np.float32).reshape(len(x), -1, 1)
+        # bias and relu are applied after max pooling as in `NumpyModel`
+        x = max_pool1d(conv1d_same(x, self.first_kernel)) + self.first_bias
+        x = np.maximum(x, 0).reshape(len(x), x.shape[1], self.nb_members, -1)
+        for kernels, biases in self.convolutions:
+            x = _grouped_conv1d_same(x, kernels)
+            x = max_pool1d(x.reshape(len(x), x.shape[1], -1)).reshape(
+                len(x), x.shape[1] // 2, self.nb_members, -1
+            )
+            x = np.maximum(x + biases, 0)
+
+        # flatten every member's features in keras order (length, channels)
+        features = x.transpose(2, 0, 1, 3).reshape(self.nb_members, len(x), -1)
+        logits = np.matmul(features, self.dense_kernel) + self.dense_bias[:, None, :]
+        logits = logits.transpose(1, 0, 2)
+
+        if logits.shape[2] == 1:
+            positive = 1 / (1 + np.exp(-logits))
+            return np.concatenate([1 - positive, positive], axis=2)
+        logits -= logits.max(axis=2, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=2, keepdims=True)
+
+    def predict_on_batch(self, x: np.ndarray) -> np.ndarray:
+        """Returns mean class probabilities and disagreement (last column)."""
+        probabilities = self.predict_members(x)
+        mean = probabilities.mean(axis=1)
+        predicted = np.argmax(mean, axis=1)
+        disagreement = probabilities[np.arange(len(mean)), :, predicted].std(axis=1)
+        return np.concatenate([mean, disagreement[:, None]], axis=1)
+
+
+def load_ensemble(paths_to_models: Sequence[str]) -> EnsembleModel:
+    """Loads the models (SavedModels or .npz, see `numpy_model`) as an ensemble.
+
+    The outputs of the members are averaged, so all members must have the same
+    input length, class order and preprocessing spec (see
+    `preprocessing.load_preprocessing_spec`); a ValueError is raised otherwise.
+    """
+    members = [load_numpy_model(path) for path in paths_to_models]
+    specs = [load_preprocessing_spec(path) for path in paths_to_models]
+    class_orders = [
+        spec["class_order"] if spec else get_class_order(path, get_num_classes(m))
+        for path, m, spec in zip(paths_to_models, members, specs)
+    ]
+
+    for path, m, spec, class_order in zip(
+        paths_to_models, members, specs, class_orders
+    ):
+        if m.input_shape != members[0].input_shape:
+            raise ValueError(
+                f"Input length of '{path}' ({m.input_shape[1]}) differs from "
+                f"'{paths_to_models[0]}' ({members[0].input_shape[1]})."
+            )
+        if class_order != class_orders[0]:
+            raise ValueError(
+                f"Class order of '{path}' ({class_order}) differs from "
+                f"'{paths_to_models[0]}' ({class_orders[0]})."
+            )
+        if spec != specs[0]:
+            raise ValueError(
+                f"Preprocessing spec of '{path}' differs from '{paths_to_models[0]}'."
+            )
+    return EnsembleModel(members)
+
+
+def split_ensemble_output(
+    output: np.ndarray,
+    path_to_probabilities: str,
+    path_to_disagreement: str,
+    chunk_size: int,
+):
+    """Writes the ensemble output to separate probability and disagreement files.
+
+    Returns
+    -------
+    memory-mapped probabilities (nb_streamlines, classes) and disagreement
+    (nb_streamlines,)
+    """
+    probabilities = np.lib.format.open_memmap(
+        path_to_probabilities,
+        mode="w+",
+        dtype=output.dtype,
+        shape=(len(output), output.shape[1] - 1),
+    )
+    disagreement = np.lib.format.open_memmap(
+        path_to_disagreement, mode="w+", dtype=output.dtype, shape=(len(output),)
+    )
+    for start in range(0, len(output), chunk_size):
+        chunk = output[start : start + chunk_size]
+        probabilities[start : start + len(chunk)] = chunk[:, :-1]
+        disagreement[start : start + len(chunk)] = chunk[:, -1]
+    probabilities.flush()
+    disagreement.flush()
+    return probabilities, disagreement
+
+
+def get_uncertain_indices(
+    disagreement: np.ndarray, max_disagreement: float, chunk_size: int
+) -> List[int]:
+    """Returns indices of streamlines whose disagreement exceeds the limit."""
+    indices = [
+        np.where(disagreement[start : start + chunk_size] > max_disagreement)[0] + start
+        for start in range(0, len(disagreement), chunk_size)
+    ]
+    if not indices:
+        return []
+    return np.concatenate(indices).tolist()
@@ -0,0 +1,289 @@
+"""
+Helper functions for caching preprocessed (normalized and resampled) streamlines
+of one subject on disk, so that repeated training runs do not have to load and
+preprocess the full tractogram again.
+
+A cache is a folder containing
+  - features.npy : (nb_streamlines, 3 * points_per_streamline) float32
+  - labels.npy   : (nb_streamlines,) int8, index into the class order of the spec
+  - spec.json    : preprocessing spec and the inputs the cache was built from
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from typing import List, Tuple
+
+from .inference import CLASS_NAMES, CLASS_NEGATIVE, CLASS_POSITIVE, CLASS_INCONCLUSIVE
+from .preprocessing import (
+    build_preprocessing_spec,
+    concatenate_streamlines,
+    resample_points,
+)
+from .streamline_loader import (
+    get_indices_from_json,
+    get_nb_streamlines,
+    iter_streamline_chunks,
+)
+
+
+FEATURES_FILENAME = "features.npy"
+LABELS_FILENAME = "labels.npy"
+SPEC_FILENAME = "spec.json"
+
+# labels are indices into CLASS_NAMES
+LABEL_NEGATIVE = CLASS_NAMES.index(CLASS_NEGATIVE)
+LABEL_POSITIVE = CLASS_NAMES.index(CLASS_POSITIVE)
+LABEL_INCONCLUSIVE = CLASS_NAMES.index(CLASS_INCONCLUSIVE)
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# increase if the cache layout changes, invalidates all existing caches
+_CACHE_VERSION = 1
+
+
+def get_feature_cache_key(
+    trk_path: str, json_path_pos: str, json_path_neg: str, points_per_streamline: int
+) -> str:
+    """Computes the key of a feature cache from its inputs.
+
+    The key changes if any input file is modified (size, modification time) or
+    if the preprocessing parameters change.
+    """
+    h = hashlib.sha1()
+    for path in [trk_path, json_path_pos, json_path_neg]:
+        stat = os.stat(path)
+        h.update(f"{os.path.abspath(path)};{stat.st_size};{stat.st_mtime_ns};".encode())
+    h.update(f"{points_per_streamline};{_CACHE_VERSION}".encode())
+    return h.hexdigest()
+
+
+def is_feature_cache(path_to_cache: str) -> bool:
+    """Checks whether a (complete) feature cache exists at the given path."""
+    # spec is written last and thus marks a complete cache
+    return os.path.exists(os.path.join(path_to_cache, SPEC_FILENAME))
+
+
+def build_feature_cache(
+    path_to_cache: str,
+    trk_path: str,
+    json_path_pos: str,
+    json_path_neg: str,
+    points_per_streamline: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """Preprocesses all streamlines of a subject and writes them to a feature cache.
+
+    The tractogram is read once, chunk by chunk: streamlines are resampled while
+    the min/max coordinates are collected, and the resampled streamlines are
+    normalized in place afterwards. (Normalization is an affine map per
+    coordinate and thus commutes with the linear resampling.)
+
+    Parameters
+    ----------
+    path_to_cache : str
+        folder to write the cache to (created if necessary)
+    trk_path : str
+        Path to tractogram file (.trk)
+    json_path_pos : str
+        Path to file with indices of streamlines which should count into plausible set
+    json_path_neg : str
+        Path to file with indices of streamlines which should count into implausible set
+    points_per_streamline : int
+        number of points after resampling
+    chunk_size : int, optional
+        number of streamlines processed at once
+    """
+    print("Building feature cache for", trk_path)
+
+    # every streamline has a single label in the cache
+    pos_indices = get_indices_from_json(json_path_pos, dtype=np.int64)
+    neg_indices = get_indices_from_json(json_path_neg, dtype=np.int64)
+    nb_overlapping = len(np.intersect1d(pos_indices, neg_indices))
+    if nb_overlapping > 0:
+        raise ValueError(
+            f"{nb_overlapping} streamlines are both in '{json_path_pos}' and in "
+            f"'{json_path_neg}'."
+        )
+
+    os.makedirs(path_to_cache, exist_ok=True)
+    nb_streamlines = get_nb_streamlines(trk_path)
+    features = np.lib.format.open_memmap(
+        os.path.join(path_to_cache, FEATURES_FILENAME),
+        mode="w+",
+        dtype=np.float32,
+        shape=(nb_streamlines, 3 * points_per_streamline),
+    )
+
+    mincoord = np.full(3, np.inf, dtype=np.float32)
+    maxcoord = np.full(3, -np.inf, dtype=np.float32)
+
+    start = 0
+    for chunk in iter_streamline_chunks(trk_path, chunk_size):
+        points, offsets, lengths = concatenate_streamlines(chunk)
+        mincoord = np.minimum(mincoord, points.min(axis=0))
+        maxcoord = np.maximum(maxcoord, points.max(axis=0))
+
+        resampled = resample_points(points, offsets, lengths, points_per_streamline)
+        features[start : start + len(chunk)] = resampled.reshape((len(chunk), -1))
+        start += len(chunk)
+        print(f"resampled {start}/{nb_streamlines} streamlines")
+
+    print("normalizing streamlines")
+    print("min", mincoord)
+    print("max", maxcoord)
+    # coordinates are interleaved (x, y, z, x, y, z, ...) after resampling
+    tiled_min = np.tile(mincoord, points_per_streamline)
+    tiled_max = np.tile(maxcoord, points_per_streamline)
+    for start in range(0, nb_streamlines, chunk_size):
+        block = features[start : start + chunk_size]
+        features[start : start + chunk_size] = (
+            (block - tiled_min) / (tiled_max - tiled_min)
+        ) * 2 - 1
+    features.flush()
+    del features
+
+    # labels from pseudo ground truth, all other streamlines are inconclusive
+    labels = np.full(nb_streamlines, LABEL_INCONCLUSIVE, dtype=np.int8)
+    labels[pos_indices] = LABEL_POSITIVE
+    labels[neg_indices] = LABEL_NEGATIVE
+    np.save(os.path.join(path_to_cache, LABELS_FILENAME), labels)
+
+    spec = build_preprocessing_spec(
+        mincoord, maxcoord, points_per_streamline, class_order=CLASS_NAMES
+    )
+    spec["inputs"] = {
+        "tractogram": os.path.abspath(trk_path),
+        "positive": os.path.abspath(json_path_pos),
+        "negative": os.path.abspath(json_path_neg),
+    }
+    with open(os.path.join(path_to_cache, SPEC_FILENAME), "w") as f:
+        json.dump(spec, f, indent=2)
+
+    print("Feature cache written to", path_to_cache)
+
+
+def get_or_build_feature_cache(
+    cache_dir: str,
+    trk_path: str,
+    json_path_pos: str,
+    json_path_neg: str,
+    points_per_streamline: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> str:
+    """Returns the path to the feature cache for the given inputs.
+
+    The cache is a sub-folder of `cache_dir` named by its key (see
+    `get_feature_cache_key`) and is built if it does not exist yet.
+    """
+    key = get_feature_cache_key(
+        trk_path, json_path_pos, json_path_neg, points_per_streamline
+    )
+    path_to_cache = os.path.join(cache_dir, key)
+
+    if is_feature_cache(path_to_cache):
+        print("Using feature cache", path_to_cache)
+    else:
+        build_feature_cache(
+            path_to_cache,
+            trk_path,
+            json_path_pos,
+            json_path_neg,
+            points_per_streamline,
+            chunk_size=chunk_size,
+        )
+    return path_to_cache
+
+
+def load_feature_cache(path_to_cache: str) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """Opens a feature cache (memory-mapped, read-only).
+
+    Returns
+    -------
+    features : np.ndarray
+        preprocessed streamlines, shape (nb_streamlines, 3 * points_per_streamline, 1)
+    labels : np.ndarray
+        class label of every streamline (index into spec["class_order"])
+    spec : dict
+        preprocessing spec (see `preprocessing.build_preprocessing_spec`)
+    """
+    if not is_feature_cache(path_to_cache):
+        raise ValueError(f"No complete feature cache found at '{path_to_cache}'.")
+
+    features = np.load(os.path.join(path_to_cache, FEATURES_FILENAME), mmap_mode="r")
+    labels = np.load(os.path.join(path_to_cache, LABELS_FILENAME), mmap_mode="r")
+    with open(os.path.join(path_to_cache, SPEC_FILENAME), "r") as f:
+        spec = json.load(f)
+
+    return features[..., None], labels, spec
+
+
+def _read_rows(features: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Reads the given rows of memory-mapped features into memory (in given order)."""
+    # sorted reads are considerably faster on memory-mapped data
+    order = np.argsort(rows, kind="stable")
+    x = np.empty((len(rows),) + features.shape[1:], dtype=features.dtype)
+    x[order] = features[rows[order]]
+    return x
+
+
+class CachedClassFeatures:
+    """Preprocessed streamlines of one class of a feature cache.
+
+    Only the row indices of the streamlines are held in memory, the features are
+    read from the memory-mapped cache on access. Selecting with a boolean mask or
+    an index array (e.g. a cross-validation fold) returns another selection,
+    whereas slices and single indices (e.g. a batch) return the features.
+    `copy` and `shuffle` only copy and permute the row indices.
+
+    Parameters
+    ----------
+    features : np.ndarray
+        memory-mapped features of all streamlines (see `load_feature_cache`)
+    rows : array-like
+        indices of the streamlines of the class
+    """
+
+    def __init__(self, features: np.ndarray, rows):
+        self._features = features
+        self._rows = np.asarray(rows, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (len(self._rows),) + self._features.shape[1:]
+
+    def __getitem__(self, key):
+        if isinstance(key, (np.ndarray, list)):
+            return CachedClassFeatures(self._features, self._rows[key])
+        rows = self._rows[key]
+        if np.ndim(rows) == 0:
+            return np.asarray(self._features[rows])
+        return _read_rows(self._features, rows)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        x = _read_rows(self._features, self._rows)
+        return x if dtype is None else x.astype(dtype, copy=False)
+
+    def copy(self) -> "CachedClassFeatures":
+        return CachedClassFeatures(self._features, self._rows.copy())
+
+    def shuffle(self) -> None:
+        np.random.shuffle(self._rows)
+
+
+def split_by_label(
+    features: np.ndarray, labels: np.ndarray
+) -> List[CachedClassFeatures]:
+    """Splits the (memory-mapped) features by class, ordered by label.
+
+    The features are not loaded into memory, see `CachedClassFeatures`.
+    """
+    return [
+        CachedClassFeatures(features, np.where(labels == label)[0])
+        for label in range(len(CLASS_NAMES))
+    ]
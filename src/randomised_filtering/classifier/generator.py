@@ -4,6 +4,18 @@ import tensorflow.keras as keras
 import tensorflow as tf
 
 
+def _shuffle(data):
+    """Shuffles the streamlines of one class in place.
+
+    Lazy selections of a feature cache (`feature_cache.CachedClassFeatures`)
+    shuffle their row indices only.
+    """
+    if isinstance(data, np.ndarray):
+        np.random.shuffle(data)
+    else:
+        data.shuffle()
+
+
 class BalancedDataGen(keras.utils.Sequence):
     def __init__(self, data, weights, batch_size, categorical=False):
 
@@ -30,7 +42,7 @@ class BalancedDataGen(keras.utils.Sequence):
 
     def on_epoch_end(self):
         for d in self._data:
-            np.random.shuffle(d)
+            _shuffle(d)
 
     def _get_subbatch(self, class_idx, idx):
         # class_idx is the index for the class. so self._data[class_idx] will be used
@@ -48,7 +60,7 @@ class BalancedDataGen(keras.utils.Sequence):
         # shuffle the data-subset if epoch is not over but data is exhausted
         #   (for under-represented subsets)
         if data_idx == self._batches[class_idx] - 1:
-            np.random.shuffle(self._data[class_idx])
+            _shuffle(self._data[class_idx])
 
         return x, y, w
 
@@ -78,3 +90,69 @@ class BalancedDataGen(keras.utils.Sequence):
 
     def __len__(self):
         return max(self._batches)
+
+
+class MultiSubjectBalancedDataGen(keras.utils.Sequence):
+    """Balanced batches sampled across the subjects of a `MultiSubjectDataset`.
+
+    Every batch contains the same number of streamlines of each class. Streamlines
+    are drawn at random (with replacement) from all subjects, so only the current
+    batch is held in memory.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        labels,
+        weights,
+        batch_size,
+        batches_per_epoch,
+        categorical=False,
+        seed=None,
+    ):
+
+        # labels of the dataset which are used as classes 0, 1, ... of the model
+        self._dataset = dataset
+        self._labels = labels
+        self._num_classes = len(labels)
+
+        if len(weights) != self._num_classes:
+            raise ValueError("Please provide weight for each class")
+
+        self._weights = weights
+
+        if batch_size % self._num_classes != 0:
+            raise ValueError("Please make batch size dividable by number of classes")
+
+        self._batch_size = batch_size
+        self._subbatch_size = batch_size // self._num_classes
+        self._batches_per_epoch = batches_per_epoch
+
+        self._categorical = categorical
+        self._rng = np.random.default_rng(seed)
+
+    def __getitem__(self, idx):
+
+        x = []
+        y = []
+        w = []
+
+        # compile parts of batch from all streamline classes
+        for i, label in enumerate(self._labels):
+            x.append(self._dataset.sample(label, self._subbatch_size, rng=self._rng))
+            y.append(np.full(self._subbatch_size, i))
+            w.append(np.full(self._subbatch_size, self._weights[i]))
+
+        x = np.concatenate(x, axis=0)
+        y = np.concatenate(y, axis=0)
+        w = np.concatenate(w, axis=0)
+
+        if self._categorical:
+            y = tf.keras.utils.to_categorical(
+                y, num_classes=self._num_classes, dtype="float32"
+            )
+
+        return x, y, w
+
+    def __len__(self):
+        return self._batches_per_epoch
@@ -0,0 +1,368 @@
+"""
+Helper functions for applying trained classifiers to whole tractograms.
+"""
+
+import os
+import threading
+import time
+import numpy as np
+
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from queue import Empty, Full, Queue
+from typing import List, Optional
+
+from .preprocessing import apply_preprocessing_spec
+from .streamline_loader import get_nb_streamlines, iter_streamline_chunks
+
+
+# class names in the order used by `rf_train_model.py`
+CLASS_NEGATIVE = "negative"
+CLASS_POSITIVE = "positive"
+CLASS_INCONCLUSIVE = "inconclusive"
+CLASS_NAMES = (CLASS_NEGATIVE, CLASS_POSITIVE, CLASS_INCONCLUSIVE)
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_NUM_WORKERS = 4
+
+# inference backends (see `load_model`)
+BACKEND_TENSORFLOW = "tensorflow"
+BACKEND_NUMPY = "numpy"
+BACKENDS = (BACKEND_TENSORFLOW, BACKEND_NUMPY)
+
+# marks the end of the chunk stream of the reader thread
+_END_OF_STREAM = None
+# interval in which the reader thread checks whether the consumer stopped
+_QUEUE_TIMEOUT = 0.1
+
+
+class StageTimer:
+    """Thread-safe accumulator of wall time and item counts per pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.items = defaultdict(int)
+
+    @contextmanager
+    def measure(self, stage: str, nb_items: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.items[stage] += nb_items
+
+    def add_items(self, stage: str, nb_items: int):
+        with self._lock:
+            self.items[stage] += nb_items
+
+    def report(self) -> str:
+        lines = ["stage;seconds;items;items/s"]
+        for stage, seconds in self.seconds.items():
+            items = self.items[stage]
+            rate = round(items / seconds) if seconds > 0 and items > 0 else "-"
+            lines.append(f"{stage};{seconds:.2f};{items};{rate}")
+        return "\n".join(lines)
+
+
+def load_model(path_to_model: str, backend: str = BACKEND_TENSORFLOW):
+    """Loads a trained model.
+
+    With the tensorflow backend, a keras model is loaded (imports tensorflow on
+    first use). With the numpy backend, the weights are loaded into a
+    `NumpyModel`, which does not need tensorflow. Exported .npz files are always
+    loaded with the numpy backend.
+    """
+    if backend == BACKEND_NUMPY or path_to_model.endswith(".npz"):
+        from .numpy_model import load_numpy_model
+
+        return load_numpy_model(path_to_model)
+    if backend != BACKEND_TENSORFLOW:
+        raise ValueError(f"Unknown backend '{backend}', choose from {BACKENDS}.")
+
+    import tensorflow.keras as keras
+
+    return keras.models.load_model(path_to_model, compile=False)
+
+
+def get_points_per_streamline(model) -> int:
+    """Derives the number of points per streamline from the model input shape."""
+    input_length = model.input_shape[1]
+    assert input_length % 3 == 0, "Invalid input shape."
+    return input_length // 3
+
+
+def get_num_classes(model) -> int:
+    """Returns the number of classes of a model (2 for binary models)."""
+    return max(model.output_shape[-1], 2)
+
+
+def get_class_order(path_to_model: str, num_classes: int) -> List[str]:
+    """Determines the class order of a model.
+
+    Models in `data/models` are named after their classes in output order,
+    e.g. `model_negative_positive`. For other models, the class order used by
+    `rf_train_model.py` is assumed.
+    """
+    name = os.path.basename(os.path.normpath(path_to_model))
+    parts = name.split("_")[1:]
+    if len(parts) == num_classes and all(p in CLASS_NAMES for p in parts):
+        return parts
+    return list(CLASS_NAMES[:num_classes])
+
+
+def get_class_probabilities(prediction: np.ndarray) -> np.ndarray:
+    """Converts model output to one probability column per class.
+
+    Binary (sigmoid) models output the probability of class 1 only; the
+    probability of class 0 is added as first column.
+    """
+    prediction = np.asarray(prediction, dtype=np.float32)
+    if prediction.shape[1] == 1:
+        return np.concatenate([1 - prediction, prediction], axis=1)
+    return prediction
+
+
+def predict_batches(model, x: np.ndarray, batch_size: int) -> np.ndarray:
+    """Runs the model on `x` in batches and returns class probabilities."""
+    return np.concatenate(
+        [
+            get_class_probabilities(model.predict_on_batch(x[i : i + batch_size]))
+            for i in range(0, len(x), batch_size)
+        ],
+        axis=0,
+    )
+
+
+def _put(queue: Queue, item, stop: threading.Event) -> bool:
+    """Puts an item into the bounded queue, gives up once `stop` is set."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=_QUEUE_TIMEOUT)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _read_chunks(
+    trk_path: str,
+    chunk_size: int,
+    queue: Queue,
+    timer: StageTimer,
+    stop: threading.Event,
+):
+    """Reader thread: decodes streamline chunks into the (bounded) queue.
+
+    Stops early if `stop` is set, e.g. because the consumer failed.
+    """
+    try:
+        chunks = iter_streamline_chunks(trk_path, chunk_size)
+        while not stop.is_set():
+            with timer.measure("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            timer.add_items("read", len(chunk))
+            with timer.measure("read (waiting for queue)"):
+                if not _put(queue, chunk, stop):
+                    return
+    except Exception as e:
+        _put(queue, e, stop)
+        return
+    _put(queue, _END_OF_STREAM, stop)
+
+
+def _preprocess_chunk(chunk, spec: dict, timer: StageTimer) -> np.ndarray:
+    """Worker: normalizes and resamples one chunk."""
+    with timer.measure("preprocess", nb_items=len(chunk)):
+        return apply_preprocessing_spec(chunk, spec)
+
+
+def _classify_chunk(model, chunk, spec: dict, batch_size: int) -> np.ndarray:
+    """Worker process: preprocesses one chunk and runs the model on it."""
+    x = apply_preprocessing_spec(chunk, spec)
+    return predict_batches(model, x, batch_size)
+
+
+def predict_tractogram(
+    model,
+    trk_path: str,
+    path_to_output: str,
+    spec: dict,
+    num_classes: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    timer: Optional[StageTimer] = None,
+    num_processes: int = 0,
+) -> np.ndarray:
+    """Classifies all streamlines of a tractogram, chunk by chunk.
+
+    Streamlines are normalized and resampled as described by the preprocessing
+    spec of the model (see `preprocessing.apply_preprocessing_spec`) and the class
+    probabilities are written to a memory-mapped .npy file, so that memory usage
+    is bounded by the chunk size.
+
+    Reading, preprocessing and prediction run as a pipeline: a reader thread
+    decodes chunks into a bounded queue, a pool of workers preprocesses them and
+    the calling thread runs the model on the preprocessed chunks in tractogram
+    order. The output is therefore independent of `num_workers`.
+
+    With `num_processes` > 0, preprocessing and prediction of every chunk both run
+    in a pool of worker processes instead, which requires a model that can be
+    sent to other processes (a `NumpyModel`, see `load_model`).
+
+    Parameters
+    ----------
+    model
+        trained keras model
+    trk_path : str
+        path to tractogram file
+    path_to_output : str
+        path to output .npy file, shape (nb_streamlines, nb_classes)
+    spec : dict
+        preprocessing spec with normalization bounds (see
+        `preprocessing.build_preprocessing_spec`)
+    num_classes : int
+        number of classes (2 for binary models)
+    chunk_size : int, optional
+        number of streamlines loaded and preprocessed at once
+    batch_size : int, optional
+        number of streamlines per call to the model
+    num_workers : int, optional
+        number of preprocessing workers
+    timer : StageTimer, optional
+        collects the time spent per pipeline stage, if given
+    num_processes : int, optional
+        number of worker processes that classify chunks (default: 0, classify in
+        the calling process)
+
+    Returns
+    -------
+    memory-mapped array of class probabilities
+    """
+    assert num_workers > 0, "Need at least one preprocessing worker."
+
+    if timer is None:
+        timer = StageTimer()
+
+    nb_streamlines = get_nb_streamlines(trk_path)
+    probabilities = np.lib.format.open_memmap(
+        path_to_output,
+        mode="w+",
+        dtype=np.float32,
+        shape=(nb_streamlines, num_classes),
+    )
+
+    # at most `num_workers` chunks are queued for reading and for preprocessing each
+    queue: Queue = Queue(maxsize=num_workers)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_chunks,
+        args=(trk_path, chunk_size, queue, timer, stop),
+        daemon=True,
+    )
+    reader.start()
+
+    start = 0
+    pending: deque = deque()
+
+    def predict_next_chunk():
+        nonlocal start
+        future = pending.popleft()
+        if num_processes > 0:
+            with timer.measure("classify (waiting for processes)"):
+                prediction = future.result()
+            timer.add_items("classify (waiting for processes)", len(prediction))
+        else:
+            with timer.measure("predict (waiting for preprocessing)"):
+                x = future.result()
+            with timer.measure("predict", nb_items=len(x)):
+                prediction = predict_batches(model, x, batch_size)
+        probabilities[start : start + len(prediction)] = prediction
+        start += len(prediction)
+        print(f"classified {start}/{nb_streamlines} streamlines")
+
+    pool: Executor
+    if num_processes > 0:
+        num_workers = num_processes
+        pool = ProcessPoolExecutor(max_workers=num_processes)
+    else:
+        pool = ThreadPoolExecutor(max_workers=num_workers)
+
+    try:
+        with pool:
+            while True:
+                with timer.measure("predict (waiting for reader)"):
+                    chunk = queue.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if chunk is _END_OF_STREAM:
+                    break
+                if num_processes > 0:
+                    future = pool.submit(
+                        _classify_chunk, model, chunk, spec, batch_size
+                    )
+                else:
+                    future = pool.submit(_preprocess_chunk, chunk, spec, timer)
+                pending.append(future)
+                if len(pending) > num_workers:
+                    predict_next_chunk()
+
+            while pending:
+                predict_next_chunk()
+    finally:
+        # unblock the reader thread if the loop above failed
+        stop.set()
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                break
+        reader.join()
+    probabilities.flush()
+    return probabilities
+
+
+def get_indices_of_class(
+    probabilities: np.ndarray,
+    class_idx: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> List[int]:
+    """Returns indices of streamlines whose most probable class is `class_idx`.
+
+    The (memory-mapped) probabilities are processed chunk by chunk.
+    """
+    indices = []
+    for start in range(0, len(probabilities), chunk_size):
+        labels = np.argmax(probabilities[start : start + chunk_size], axis=1)
+        indices.append(np.where(labels == class_idx)[0] + start)
+
+    if not indices:
+        return []
+    return np.concatenate(indices).tolist()
+
+
+def write_class_labels(
+    probabilities: np.ndarray,
+    path_to_output: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> np.ndarray:
+    """Writes the index of the most probable class of every streamline (int8).
+
+    The (memory-mapped) probabilities are processed chunk by chunk.
+    """
+    labels = np.lib.format.open_memmap(
+        path_to_output, mode="w+", dtype=np.int8, shape=(len(probabilities),)
+    )
+    for start in range(0, len(probabilities), chunk_size):
+        chunk = probabilities[start : start + chunk_size]
+        labels[start : start + len(chunk)] = np.argmax(chunk, axis=1)
+    labels.flush()
+    return labels
@@ -0,0 +1,289 @@
+"""
+Inference with the Conv1D classifiers of `model.py` in plain NumPy.
+
+The networks are small (Conv1D -> max pooling -> Conv1D -> max pooling -> Dense),
+so the forward pass is a handful of matrix products. Weights are read from the
+checkpoint of a SavedModel (`variables/variables.index`, parsed without
+tensorflow) or from an .npz file written by `save_numpy_model`, which keeps
+tensorflow out of the process entirely.
+
+A `NumpyModel` provides `input_shape`, `output_shape` and `predict_on_batch`
+like a keras model, so it can be used wherever `inference.py` expects one.
+"""
+
+import os
+import re
+import struct
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# key of the weights of layer i in the object-based checkpoint of a SavedModel
+CHECKPOINT_KEY = "layer_with_weights-{}/{}/.ATTRIBUTES/VARIABLE_VALUE"
+
+# tensorflow DataType enum -> numpy dtype
+_CHECKPOINT_DTYPES = {1: np.float32, 2: np.float64, 3: np.int32, 9: np.int64}
+
+# input shape of the InputLayer in the keras metadata of a SavedModel
+_INPUT_SHAPE_PATTERN = re.compile(
+    rb'"batch_input_shape": \{"class_name": "__tuple__", "items": \[null, (\d+)'
+)
+
+_TABLE_MAGIC = 0xDB4775248B80FB57
+_TABLE_FOOTER_SIZE = 48
+
+
+def _read_varint(buffer: bytes, pos: int) -> Tuple[int, int]:
+    """Decodes a base 128 varint, returns (value, position after the varint)."""
+    value, shift = 0, 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _parse_protobuf(buffer: bytes) -> Dict[int, list]:
+    """Parses the fields of a protobuf message, {field number: [raw values]}."""
+    fields: Dict[int, list] = {}
+    pos = 0
+    while pos < len(buffer):
+        key, pos = _read_varint(buffer, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buffer, pos)
+            fields.setdefault(number, []).append(value)
+            continue
+
+        # all other wire types hold a number of raw bytes
+        if wire_type == 1:
+            length = 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buffer, pos)
+        elif wire_type == 5:
+            length = 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}.")
+        payload, pos = buffer[pos : pos + length], pos + length
+        fields.setdefault(number, []).append(payload)
+    return fields
+
+
+def _read_table_block(data: bytes, handle: bytes) -> List[Tuple[bytes, bytes]]:
+    """Returns the (key, value) entries of an (uncompressed) table block."""
+    offset, pos = _read_varint(handle, 0)
+    size, _ = _read_varint(handle, pos)
+    if data[offset + size] != 0:
+        raise ValueError("Compressed checkpoint tables are not supported.")
+    block = data[offset : offset + size]
+
+    (nb_restarts,) = struct.unpack("<I", block[-4:])
+    end = len(block) - 4 * (nb_restarts + 1)
+
+    entries = []
+    key, pos = b"", 0
+    while pos < end:
+        shared, pos = _read_varint(block, pos)
+        non_shared, pos = _read_varint(block, pos)
+        value_length, pos = _read_varint(block, pos)
+        key = key[:shared] + block[pos : pos + non_shared]
+        pos += non_shared
+        entries.append((key, block[pos : pos + value_length]))
+        pos += value_length
+    return entries
+
+
+def read_checkpoint(path_to_variables: str) -> Dict[str, np.ndarray]:
+    """Reads all tensors of a tensorflow checkpoint without importing tensorflow.
+
+    Parameters
+    ----------
+    path_to_variables : str
+        checkpoint prefix, e.g. `<SavedModel>/variables/variables`
+
+    Returns
+    -------
+    dictionary of tensor name -> array
+    """
+    with open(path_to_variables + ".index", "rb") as f:
+        index = f.read()
+
+    footer = index[-_TABLE_FOOTER_SIZE:]
+    (magic,) = struct.unpack("<Q", footer[-8:])
+    if magic != _TABLE_MAGIC:
+        raise ValueError(f"'{path_to_variables}.index' is not a checkpoint index.")
+    _, pos = _read_varint(footer, _read_varint(footer, 0)[1])  # skip metaindex
+    index_handle = footer[pos:]
+
+    entries = {}
+    for _, handle in _read_table_block(index, index_handle):
+        for key, value in _read_table_block(index, handle):
+            entries[key.decode()] = value
+
+    # the entry with empty key is the header of the bundle
+    nb_shards = _parse_protobuf(entries.pop(""))[1][0]
+    shards = {}
+    tensors = {}
+    for name, value in entries.items():
+        fields = _parse_protobuf(value)
+        dtype = _CHECKPOINT_DTYPES.get(fields.get(1, [0])[0])
+        if dtype is None:
+            continue  # e.g. strings of the object graph
+
+        shape = []
+        if 2 in fields:
+            for dim in _parse_protobuf(fields[2][0]).get(2, []):
+                shape.append(_parse_protobuf(dim).get(1, [0])[0])
+        shard = fields.get(3, [0])[0]
+        offset = fields.get(4, [0])[0]
+        size = fields.get(5, [0])[0]
+
+        if shard not in shards:
+            path = f"{path_to_variables}.data-{shard:05d}-of-{nb_shards:05d}"
+            shards[shard] = np.memmap(path, dtype=np.uint8, mode="r")
+        raw = np.asarray(shards[shard][offset : offset + size])
+        tensors[name] = raw.view(dtype).reshape(shape).copy()
+    return tensors
+
+
+def get_weights_from_checkpoint(path_to_model: str) -> List[np.ndarray]:
+    """Returns kernels and biases (in layer order) of a SavedModel."""
+    tensors = read_checkpoint(os.path.join(path_to_model, "variables", "variables"))
+    weights = []
+    layer = 0
+    while CHECKPOINT_KEY.format(layer, "kernel") in tensors:
+        weights.append(tensors[CHECKPOINT_KEY.format(layer, "kernel")])
+        weights.append(tensors[CHECKPOINT_KEY.format(layer, "bias")])
+        layer += 1
+    if not weights:
+        raise ValueError(f"No layer weights found in checkpoint of '{path_to_model}'.")
+    return weights
+
+
+def get_input_length_from_metadata(path_to_model: str) -> Optional[int]:
+    """Reads the input length from the keras metadata of a SavedModel (or None)."""
+    path = os.path.join(path_to_model, "keras_metadata.pb")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        match = _INPUT_SHAPE_PATTERN.search(f.read())
+    return int(match.group(1)) if match else None
+
+
+def conv1d_same(
+    x: np.ndarray, kernel: np.ndarray, bias: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """1D convolution with zero "same" padding as keras.layers.Conv1D (im2col).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        input of shape (batch, length, in channels)
+    kernel : np.ndarray
+        kernel of shape (kernel size, in channels, out channels)
+    bias : np.ndarray, optional
+        bias of shape (out channels,)
+    """
+    kernel_size = kernel.shape[0]
+    # keras pads the bigger half at the end for even kernel sizes
+    padding = ((0, 0), ((kernel_size - 1) // 2, kernel_size // 2), (0, 0))
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.pad(x, padding), kernel_size, axis=1
+    )  # (batch, length, in channels, kernel size)
+    columns = windows.reshape(-1, kernel.shape[1] * kernel_size)
+    weights = kernel.transpose(1, 0, 2).reshape(-1, kernel.shape[2])
+    out = columns @ weights
+    if bias is not None:
+        out += bias
+    return out.reshape(x.shape[0], x.shape[1], kernel.shape[2])
+
+
+def max_pool1d(x: np.ndarray, pool_size: int = 2) -> np.ndarray:
+    """Max pooling without padding as keras.layers.MaxPooling1D."""
+    length = x.shape[1] // pool_size
+    x = x[:, : length * pool_size]
+    return x.reshape(x.shape[0], length, pool_size, x.shape[2]).max(axis=2)
+
+
+class NumpyModel:
+    """Forward pass of a Conv1D classifier of `model.py` in NumPy.
+
+    Parameters
+    ----------
+    weights : list of np.ndarray
+        kernel and bias of every convolution and of the final dense layer, in
+        layer order (as `keras.Model.get_weights()`)
+    input_length : int, optional
+        number of input values per streamline (default: smallest length that fits
+        the dense layer, assuming max pooling of size 2 after every convolution)
+    """
+
+    def __init__(self, weights: List[np.ndarray], input_length: Optional[int] = None):
+        assert len(weights) >= 2 and len(weights) % 2 == 0, "Invalid weights."
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.convolutions = list(zip(weights[:-2:2], weights[1:-2:2]))
+        self.dense_kernel, self.dense_bias = weights[-2:]
+
+        if input_length is None:
+            channels = self.convolutions[-1][0].shape[2]
+            length = self.dense_kernel.shape[0] // channels
+            input_length = length * 2 ** len(self.convolutions)
+        self.input_shape = (None, input_length, 1)
+        self.output_shape = (None, self.dense_kernel.shape[1])
+
+    def get_weights(self) -> List[np.ndarray]:
+        weights = []
+        for kernel, bias in self.convolutions:
+            weights += [kernel, bias]
+        return weights + [self.dense_kernel, self.dense_bias]
+
+    def predict_on_batch(self, x: np.ndarray) -> np.ndarray:
+        """Returns the model output (softmax, or sigmoid for one unit)."""
+        x = np.asarray(x, dtype=np.float32).reshape(len(x), -1, 1)
+        for kernel, bias in self.convolutions:
+            # bias and relu commute with max pooling, apply them to fewer values
+            x = np.maximum(max_pool1d(conv1d_same(x, kernel)) + bias, 0)
+
+        logits = x.reshape(len(x), -1) @ self.dense_kernel + self.dense_bias
+        if logits.shape[1] == 1:
+            return 1 / (1 + np.exp(-logits))
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def is_numpy_model(path_to_model: str) -> bool:
+    """Checks whether the path refers to weights exported by `save_numpy_model`."""
+    return path_to_model.endswith(".npz")
+
+
+def load_numpy_model(path_to_model: str) -> NumpyModel:
+    """Loads a classifier from an .npz file or from the checkpoint of a SavedModel.
+
+    Parameters
+    ----------
+    path_to_model : str
+        .npz file written by `save_numpy_model` or SavedModel folder
+        (e.g. in data/models)
+    """
+    if is_numpy_model(path_to_model):
+        with np.load(path_to_model) as f:
+            nb_weights = len([key for key in f.files if key.startswith("weight_")])
+            weights = [f[f"weight_{i}"] for i in range(nb_weights)]
+            return NumpyModel(weights, input_length=int(f["input_length"]))
+    return NumpyModel(
+        get_weights_from_checkpoint(path_to_model),
+        input_length=get_input_length_from_metadata(path_to_model),
+    )
+
+
+def save_numpy_model(path_to_npz: str, model: NumpyModel) -> None:
+    """Writes the weights of a model to an .npz file."""
+    # typed as Any: mypy would match the arrays against the flags of np.savez
+    arrays: Dict[str, Any] = {"input_length": np.array(model.input_shape[1])}
+    for i, w in enumerate(model.get_weights()):
+        arrays[f"weight_{i}"] = w
+    np.savez(path_to_npz, **arrays)
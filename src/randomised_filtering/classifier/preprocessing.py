@@ -0,0 +1,226 @@
+"""
+Helper functions for streamline preprocessing (normalization, resampling) which
+operate on whole chunks of streamlines at once.
+"""
+
+import os
+import json
+import numpy as np
+
+from typing import Optional, Sequence, Tuple
+
+
+# file name of the preprocessing spec stored beside a trained model
+PREPROCESSING_SPEC_FILENAME = "preprocessing.json"
+
+# resampling method of `resample_points` (equivalent to cv2.resize, INTER_LINEAR)
+RESAMPLING_LINEAR = "linear"
+
+
+def concatenate_streamlines(
+    streamlines: Sequence[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Concatenate streamlines into one flat point buffer.
+
+    Parameters
+    ----------
+    streamlines : sequence of arrays
+        streamlines, each of shape (nb_points, 3)
+
+    Returns
+    -------
+    points : np.ndarray
+        all points of all streamlines, shape (total_nb_points, 3)
+    offsets : np.ndarray
+        index of the first point of every streamline in `points`
+    lengths : np.ndarray
+        number of points of every streamline
+    """
+    lengths = np.fromiter((len(s) for s in streamlines), dtype=np.int64)
+    offsets = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+
+    if len(streamlines) == 0:
+        return np.zeros((0, 3), dtype=np.float32), offsets, lengths
+
+    points = np.concatenate(streamlines, axis=0).astype(np.float32, copy=False)
+    return points, offsets, lengths
+
+
+def normalize_points(points: np.ndarray, mincoord, maxcoord) -> np.ndarray:
+    """Map point coordinates from [mincoord, maxcoord] to [-1, 1].
+
+    Same mapping as `streamline_loader.normalize_streamlines`, but applied to a
+    flat point buffer in one step.
+    """
+    mincoord = np.asarray(mincoord, dtype=np.float32)
+    maxcoord = np.asarray(maxcoord, dtype=np.float32)
+    return ((points - mincoord) / (maxcoord - mincoord)) * 2 - 1
+
+
+def resample_points(
+    points: np.ndarray,
+    offsets: np.ndarray,
+    lengths: np.ndarray,
+    points_per_streamline: int,
+) -> np.ndarray:
+    """Resample streamlines given as flat point buffer to a fixed number of points.
+
+    This is a vectorized equivalent of calling
+    `cv2.resize(s, (3, points_per_streamline))` (linear interpolation along the
+    streamline, pixel-center aligned) for every streamline `s`, as done before
+    network training.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        flat point buffer, shape (total_nb_points, 3)
+    offsets : np.ndarray
+        index of the first point of every streamline in `points`
+    lengths : np.ndarray
+        number of points of every streamline
+    points_per_streamline : int
+        number of points after resampling
+
+    Returns
+    -------
+    array of shape (nb_streamlines, points_per_streamline, 3)
+    """
+    lengths = lengths[:, None]
+
+    # position of the target points in the source streamline (cf. cv2 INTER_LINEAR)
+    scale = lengths / points_per_streamline
+    src = (np.arange(points_per_streamline)[None, :] + 0.5) * scale - 0.5
+
+    idx_0 = np.floor(src).astype(np.int64)
+    frac = (src - idx_0).astype(np.float32)
+
+    # clamp at the streamline ends
+    frac[idx_0 < 0] = 0
+    idx_0 = np.maximum(idx_0, 0)
+    frac[idx_0 >= lengths - 1] = 0
+    idx_0 = np.minimum(idx_0, lengths - 1)
+    idx_1 = np.minimum(idx_0 + 1, lengths - 1)
+
+    offsets = offsets[:, None]
+    frac = frac[..., None]
+    return points[offsets + idx_0] * (1 - frac) + points[offsets + idx_1] * frac
+
+
+def preprocess_streamlines(
+    streamlines: Sequence[np.ndarray], mincoord, maxcoord, points_per_streamline: int
+) -> np.ndarray:
+    """Normalize and resample a chunk of streamlines to network input format.
+
+    Parameters
+    ----------
+    streamlines : sequence of arrays
+        streamlines, each of shape (nb_points, 3)
+    mincoord : array-like
+        minimum coordinate of the tractogram (per dimension)
+    maxcoord : array-like
+        maximum coordinate of the tractogram (per dimension)
+    points_per_streamline : int
+        number of points after resampling
+
+    Returns
+    -------
+    array of shape (nb_streamlines, 3 * points_per_streamline, 1), float32
+    """
+    points, offsets, lengths = concatenate_streamlines(streamlines)
+    points = normalize_points(points, mincoord, maxcoord)
+    resampled = resample_points(points, offsets, lengths, points_per_streamline)
+    return resampled.reshape((len(lengths), 3 * points_per_streamline, 1)).astype(
+        np.float32, copy=False
+    )
+
+
+def build_preprocessing_spec(
+    mincoord, maxcoord, points_per_streamline: int, class_order: Sequence[str]
+) -> dict:
+    """Collects all parameters needed to reproduce the training preprocessing.
+
+    Parameters
+    ----------
+    mincoord : array-like or None
+        minimum coordinate used for normalization (None if every tractogram is
+        normalized with its own min/max, e.g. for models trained on several
+        subjects)
+    maxcoord : array-like or None
+        maximum coordinate used for normalization (see `mincoord`)
+    points_per_streamline : int
+        number of points after resampling
+    class_order : sequence of str
+        class names in the order of the model output
+
+    Returns
+    -------
+    dictionary with the preprocessing parameters (json serializable)
+    """
+    if mincoord is not None:
+        mincoord = np.asarray(mincoord, dtype=float).tolist()
+    if maxcoord is not None:
+        maxcoord = np.asarray(maxcoord, dtype=float).tolist()
+
+    return {
+        "mincoord": mincoord,
+        "maxcoord": maxcoord,
+        "points_per_streamline": int(points_per_streamline),
+        "resampling": RESAMPLING_LINEAR,
+        "class_order": list(class_order),
+    }
+
+
+def get_preprocessing_spec_path(path_to_model: str) -> str:
+    """Returns the path of the preprocessing spec belonging to a model.
+
+    For models in SavedModel format (a folder), the spec is stored inside the
+    folder. Otherwise, it is stored beside the model file.
+    """
+    if os.path.isdir(path_to_model):
+        return os.path.join(path_to_model, PREPROCESSING_SPEC_FILENAME)
+    base_path, _ = os.path.splitext(path_to_model)
+    return f"{base_path}_{PREPROCESSING_SPEC_FILENAME}"
+
+
+def save_preprocessing_spec(path_to_model: str, spec: dict) -> None:
+    """Writes the preprocessing spec beside the (already saved) model."""
+    path_to_spec = get_preprocessing_spec_path(path_to_model)
+    with open(path_to_spec, "w") as f:
+        json.dump(spec, f, indent=2)
+    print(f"Preprocessing spec saved to '{path_to_spec}'.")
+
+
+def load_preprocessing_spec(path_to_model: str) -> Optional[dict]:
+    """Reads the preprocessing spec of a model, None if the model has none."""
+    path_to_spec = get_preprocessing_spec_path(path_to_model)
+    if not os.path.exists(path_to_spec):
+        return None
+
+    with open(path_to_spec, "r") as f:
+        spec = json.load(f)
+
+    if spec["resampling"] != RESAMPLING_LINEAR:
+        raise ValueError(f"Unknown resampling method '{spec['resampling']}'.")
+    return spec
+
+
+def apply_preprocessing_spec(
+    streamlines: Sequence[np.ndarray], spec: dict
+) -> np.ndarray:
+    """Normalizes and resamples streamlines as described by a preprocessing spec.
+
+    Returns
+    -------
+    array of shape (nb_streamlines, 3 * points_per_streamline, 1), float32
+    """
+    if spec["mincoord"] is None or spec["maxcoord"] is None:
+        raise ValueError(
+            "Spec has no normalization bounds, use the min/max of the tractogram."
+        )
+    return preprocess_streamlines(
+        streamlines,
+        mincoord=spec["mincoord"],
+        maxcoord=spec["maxcoord"],
+        points_per_streamline=spec["points_per_streamline"],
+    )
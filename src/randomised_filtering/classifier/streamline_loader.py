@@ -5,41 +5,71 @@ Helper functions for network training/testing, specifically data loading.
 """
 
 import nibabel as nib
-import json
 import numpy as np
 
-from typing import Optional
+from typing import Iterator, List, Optional
 
+from randomised_filtering.instrumentation import current_span, traced
+from randomised_filtering.streamline_indices import get_indices_from_json  # noqa: F401
 
-def get_indices_from_json(filepath: str, dtype=None):
-    """Loads streamline indices from a json file
 
-    Parameters
-    ----------
-    filepath : str
-        path/name of file with the indices
-    dtype : numpy dtype, optional
-        if given, indices are converted to given data type
+def get_streamlines_from_trk(filepath: str):
+    """Loads trk and returns streamline array."""
+    return np.asarray(nib.streamlines.trk.TrkFile.load(filepath).tractogram.streamlines)
 
-    Returns
-    -------
-    array of the streamline indices
-    """
 
-    with open(filepath, "r") as f:
-        data = json.loads(f.readline())
-        ind_key = data["filenames"][0]
-        ind = data[ind_key]
+def get_nb_streamlines(filepath: str) -> int:
+    """Returns the number of streamlines of a tractogram.
 
-    if dtype:
-        ind = np.array(ind, dtype=dtype)
+    The number is taken from the header; if the header does not know it (missing
+    or 0), the streamlines are counted.
+    """
+    tractogram_file = nib.streamlines.load(filepath, lazy_load=True)
+    nb_streamlines = tractogram_file.header.get(nib.streamlines.Field.NB_STREAMLINES)
+    if nb_streamlines and int(nb_streamlines) > 0:
+        return int(nb_streamlines)
+    return sum(1 for _ in tractogram_file.streamlines)
 
-    return ind
 
+def iter_streamline_chunks(
+    filepath: str, chunk_size: int
+) -> Iterator[List[np.ndarray]]:
+    """Lazily loads a tractogram and yields its streamlines in chunks.
 
-def get_streamlines_from_trk(filepath: str):
-    """Loads trk and returns streamline array."""
-    return np.asarray(nib.streamlines.trk.TrkFile.load(filepath).tractogram.streamlines)
+    Parameters
+    ----------
+    filepath : str
+        path to tractogram file
+    chunk_size : int
+        (maximum) number of streamlines per chunk
+
+    Yields
+    ------
+    list of streamlines (each of shape (nb_points, 3)), in tractogram order
+    """
+    streamlines = nib.streamlines.load(filepath, lazy_load=True).streamlines
+
+    chunk = []
+    for s in streamlines:
+        chunk.append(s)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_min_max_from_trk(filepath: str, chunk_size: int = 100000):
+    """Determines min/max of coordinates in every dimension, chunk by chunk."""
+
+    print("getting min/max coordinates from", filepath)
+    mincoord = np.full(3, np.inf, dtype=np.float32)
+    maxcoord = np.full(3, -np.inf, dtype=np.float32)
+    for chunk in iter_streamline_chunks(filepath, chunk_size):
+        points = np.concatenate(chunk, axis=0)
+        mincoord = np.minimum(mincoord, points.min(axis=0))
+        maxcoord = np.maximum(maxcoord, points.max(axis=0))
+    return mincoord, maxcoord
 
 
 def get_min_max(streamlines):
@@ -55,6 +85,7 @@ def get_min_max(streamlines):
     return mincoord, maxcoord
 
 
+@traced()
 def normalize_streamlines(
     streamlines, mincoord: Optional[int] = None, maxcoord: Optional[int] = None
 ) -> np.ndarray:
@@ -78,6 +109,8 @@ def normalize_streamlines(
         pass
 
     print("normalizing streamlines")
+    current_span().set(unit="streamlines")
+    current_span().add_items(len(streamlines))
     print("min", mincoord)
     print("max", maxcoord)
     return np.asarray(
@@ -85,8 +118,13 @@ def normalize_streamlines(
     )
 
 
+@traced()
 def load_data(
-    trk_path: str, json_path_pos: str, json_path_neg: str, normalize: bool = False
+    trk_path: str,
+    json_path_pos: str,
+    json_path_neg: str,
+    normalize: bool = False,
+    return_min_max: bool = False,
 ):
     """Loads streamline data for one subject, optional normalization.
 
@@ -100,6 +138,9 @@ def load_data(
         Path to file with indices of streamlines which should count into implausible set
     normalize : bool, optional
         whether streamlines should be normalized or not (default: False)
+    return_min_max : bool, optional
+        whether to additionally return the min/max coordinates used for
+        normalization (default: False)
 
     Returns
     -------
@@ -109,15 +150,22 @@ def load_data(
         Set of negative/implausible streamlines
     o_streamlines
         Set of other/inconclusive streamlines
+    min_max
+        Tuple of min/max coordinates (None if not normalized), only returned if
+        `return_min_max` is set
     """
 
     print("Loading data from", trk_path)
 
     # load streamlines
     all_streamlines = get_streamlines_from_trk(trk_path)
+    current_span().set(tractogram=trk_path, unit="streamlines")
+    current_span().add_items(len(all_streamlines))
 
+    mincoord, maxcoord = None, None
     if normalize:
-        all_streamlines = normalize_streamlines(all_streamlines)
+        mincoord, maxcoord = get_min_max(all_streamlines)
+        all_streamlines = normalize_streamlines(all_streamlines, mincoord, maxcoord)
 
     # get indices from pseudo ground truth
     pos_indices = get_indices_from_json(json_path_pos)
@@ -133,4 +181,6 @@ def load_data(
     ]
     o_streamlines = all_streamlines[o_indices]
 
+    if return_min_max:
+        return pos_streamlines, neg_streamlines, o_streamlines, (mincoord, maxcoord)
     return pos_streamlines, neg_streamlines, o_streamlines
@@ -1,13 +1,25 @@
 import os
 import numpy as np
 
-from .generator import BalancedDataGen
-
-
-def training_cv(data, model, nb_folds, batch_size, epochs, base_path_to_model=None):
+from .generator import BalancedDataGen, MultiSubjectBalancedDataGen
+from .dataset import get_subject_folds
+from .preprocessing import save_preprocessing_spec
+from ..instrumentation import span
+
+
+def training_cv(
+    data,
+    model,
+    nb_folds,
+    batch_size,
+    epochs,
+    base_path_to_model=None,
+    preprocessing_spec=None,
+):
     """Train and test model on given, separated datasets in cross validation manner.
 
-    Results are reported and model weights are dumped if path is given.
+    Results are reported and model weights are dumped if path is given, together
+    with the preprocessing spec (see `preprocessing.build_preprocessing_spec`).
     """
 
     fold_len = [int(len(d) / nb_folds) for d in data]
@@ -32,20 +44,32 @@ def training_cv(data, model, nb_folds, batch_size, epochs, base_path_to_model=No
 
         print(f"Working on model {str(fold)}...")
 
-        train_model(
-            data_train=[_data[_mask] for _data, _mask in zip(data, train_mask)],
-            data_test=[_data[_mask] for _data, _mask in zip(data, test_mask)],
-            model=model,
-            batch_size=batch_size,
-            epochs=epochs,
-            path_to_model=path_to_model,
-        )
-
-
-def train_model(data_train, data_test, model, batch_size, epochs, path_to_model=None):
+        nb_train = sum(int(np.sum(m)) for m in train_mask)
+        with span("training_cv fold", items=nb_train, fold=fold, unit="streamlines"):
+            train_model(
+                data_train=[_data[_mask] for _data, _mask in zip(data, train_mask)],
+                data_test=[_data[_mask] for _data, _mask in zip(data, test_mask)],
+                model=model,
+                batch_size=batch_size,
+                epochs=epochs,
+                path_to_model=path_to_model,
+                preprocessing_spec=preprocessing_spec,
+            )
+
+
+def train_model(
+    data_train,
+    data_test,
+    model,
+    batch_size,
+    epochs,
+    path_to_model=None,
+    preprocessing_spec=None,
+):
     """Train and test model on given, separated datasets and report results.
 
-    Model weights are dumped if path is given.
+    Model weights are dumped if path is given, together with the preprocessing
+    spec if given.
     """
 
     assert len(data_train) == len(
@@ -68,7 +92,8 @@ def train_model(data_train, data_test, model, batch_size, epochs, path_to_model=
 
     # print results
     for i, _data in enumerate(data_test):
-        correct_predictions = 1 - np.sum(np.round(model.predict(_data))) / len(_data)
+        x = np.asarray(_data)  # reads lazy selections of a feature cache
+        correct_predictions = 1 - np.sum(np.round(model.predict(x))) / len(_data)
         print(f"Class {i}")
         print(f" - Correct predictions: {correct_predictions}")
         print(f" - Nb. of streamlines: {len(_data)}")
@@ -78,3 +103,84 @@ def train_model(data_train, data_test, model, batch_size, epochs, path_to_model=
     if path_to_model:
         model.save(path_to_model)
         print(f"Model saved to '{path_to_model}'.")
+
+        if preprocessing_spec:
+            save_preprocessing_spec(path_to_model, preprocessing_spec)
+
+
+def training_cv_subjects(
+    dataset,
+    labels,
+    build_model,
+    nb_folds,
+    batch_size,
+    epochs,
+    batches_per_epoch,
+    base_path_to_model=None,
+    preprocessing_spec=None,
+):
+    """Train and test model on a multi-subject dataset in cross validation manner.
+
+    Folds are formed by subjects, i.e. no subject contributes to both training and
+    testing of a model. `build_model` is called without arguments and returns a
+    new compiled model, so that every fold starts from untrained weights. Results
+    are reported and model weights are dumped if path is given, together with the
+    preprocessing spec if given.
+    """
+
+    categorical = len(labels) > 2
+
+    for fold, (train_ids, test_ids) in enumerate(
+        get_subject_folds(dataset.nb_subjects, nb_folds)
+    ):
+
+        print(f"Working on model {str(fold)} (test subjects: {test_ids})...")
+        train_set = dataset.subset(train_ids)
+        test_set = dataset.subset(test_ids)
+        for ids, subset in [(train_ids, train_set), (test_ids, test_set)]:
+            missing = [c for c in labels if subset.get_nb_streamlines(c) == 0]
+            if missing:
+                raise ValueError(
+                    f"Fold {fold}: subjects {ids} have no streamlines of the "
+                    f"labels {missing}, use fewer folds."
+                )
+        model = build_model()
+
+        with span(
+            "training_cv_subjects fold",
+            items=epochs * batches_per_epoch * batch_size,
+            fold=fold,
+            test_subjects=test_ids,
+            unit="samples",
+        ):
+            traingen = MultiSubjectBalancedDataGen(
+                dataset=train_set,
+                labels=labels,
+                weights=[1] * len(labels),
+                batch_size=batch_size,
+                batches_per_epoch=batches_per_epoch,
+                categorical=categorical,
+            )
+            testgen = MultiSubjectBalancedDataGen(
+                dataset=test_set,
+                labels=labels,
+                weights=[1] * len(labels),
+                batch_size=batch_size,
+                batches_per_epoch=max(batches_per_epoch // nb_folds, 1),
+                categorical=categorical,
+                seed=fold,
+            )
+
+            # fit and evaluate model
+            model.fit(traingen, epochs=epochs, verbose=1)
+            model.evaluate(testgen, verbose=1)
+
+            # store model weights if requested
+            if base_path_to_model:
+                base_path, ext = os.path.splitext(base_path_to_model)
+                path_to_model = f"{base_path}_{str(fold)}{ext}"
+                model.save(path_to_model)
+                print(f"Model saved to '{path_to_model}'.")
+
+                if preprocessing_spec:
+                    save_preprocessing_spec(path_to_model, preprocessing_spec)
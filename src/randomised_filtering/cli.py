@@ -0,0 +1,202 @@
+"""
+Single `rf` command that runs the `rf_*.py` scripts as subcommands.
+
+`rf eval_one_subset_size --folder_path output_500` runs `rf_eval_one_subset_size.py`
+in the current interpreter, so only the modules of that script are imported.
+`rf batch <file>` runs one subcommand invocation per line of the file (or of
+stdin for `-`) in a single interpreter: modules imported by the first command are
+reused by all later ones, which saves the start-up time of a new process per call.
+
+Batch files contain shell-like lines; empty lines and lines starting with `#` are
+skipped:
+
+    create_streamline_indices --set 1 all.trk 500000 1 out/subset_1.json
+    create_streamline_indices --set 2 all.trk 500000 1 out/subset_2.json
+"""
+
+import os
+import sys
+import shlex
+import runpy
+import sysconfig
+import time
+import traceback
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from glob import glob
+from textwrap import dedent
+from typing import Dict, List, Optional, Sequence
+
+from randomised_filtering.instrumentation import (
+    TRACE_PATH_VARIABLE,
+    set_trace_path,
+    span,
+)
+
+
+SCRIPT_PREFIX = "rf_"
+SCRIPT_SUFFIX = ".py"
+BATCH_COMMAND = "batch"
+
+# scripts of a source checkout (not installed, or installed in editable mode)
+_CHECKOUT_SCRIPTS_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "scripts"
+)
+
+
+def get_scripts() -> Dict[str, str]:
+    """Returns the available subcommands, {name: path to script}.
+
+    Scripts are looked up in the `scripts` folder of a source checkout and in the
+    folder in which pip installs scripts (the checkout takes precedence).
+    """
+    scripts = {}
+    for folder in [sysconfig.get_path("scripts"), _CHECKOUT_SCRIPTS_DIR]:
+        for path in glob(os.path.join(folder, SCRIPT_PREFIX + "*" + SCRIPT_SUFFIX)):
+            name = os.path.basename(path)[len(SCRIPT_PREFIX) : -len(SCRIPT_SUFFIX)]
+            scripts[name] = os.path.abspath(path)
+    return scripts
+
+
+def run_command(argv: Sequence[str], scripts: Optional[Dict[str, str]] = None) -> int:
+    """Runs one subcommand in the current interpreter.
+
+    Parameters
+    ----------
+    argv : sequence of str
+        name of the subcommand (with or without `rf_` and `.py`, `-` and `_` are
+        interchangeable) followed by its arguments
+    scripts : dict, optional
+        available subcommands (default: `get_scripts()`)
+
+    Returns
+    -------
+    exit status of the script (1 if it raised an exception)
+    """
+    scripts = get_scripts() if scripts is None else scripts
+    name = argv[0].replace("-", "_")
+    if name.startswith(SCRIPT_PREFIX):
+        name = name[len(SCRIPT_PREFIX) :]
+    if name.endswith(SCRIPT_SUFFIX):
+        name = name[: -len(SCRIPT_SUFFIX)]
+    if name not in scripts:
+        print(f"rf: unknown command '{argv[0]}' (see 'rf --help').", file=sys.stderr)
+        return 2
+
+    saved_argv = sys.argv
+    sys.argv = [scripts[name]] + list(argv[1:])
+    try:
+        with span(f"rf {name}"):
+            runpy.run_path(scripts[name], run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        # a failing script must not end the whole batch
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = saved_argv
+        # --trace of one command must not leak into the next one of a batch
+        set_trace_path(os.environ.get(TRACE_PATH_VARIABLE) or None)
+    return 0
+
+
+def read_batch_file(path: str) -> List[List[str]]:
+    """Returns the commands of a batch file ('-' for stdin), split as by a shell."""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()
+    return [
+        shlex.split(line)
+        for line in lines
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+
+
+def run_batch(commands: List[List[str]], keep_going: bool = False) -> int:
+    """Runs the commands one after another in the current interpreter.
+
+    Returns
+    -------
+    0 if all commands succeeded, otherwise the exit status of the first failed one
+    """
+    scripts = get_scripts()
+    status = 0
+    for i, argv in enumerate(commands):
+        print(f"[{i + 1}/{len(commands)}] rf {shlex.join(argv)}")
+        start = time.perf_counter()
+        code = run_command(argv, scripts)
+        seconds = time.perf_counter() - start
+        print(f"[{i + 1}/{len(commands)}] exit status {code} ({seconds:.2f}s)")
+        if code != 0:
+            status = status or code
+            if not keep_going:
+                break
+    return status
+
+
+DESC = dedent(
+    """
+    Run the randomised filtering scripts as subcommands of one command.
+
+    rf <command> [arguments]
+        runs the script rf_<command>.py with the given arguments
+        (e.g. 'rf eval_one_subset_size --folder_path output_500',
+        'rf <command> -h' shows the help of the script)
+
+    rf batch <file> [--keep-going]
+        runs one command per line of the file ('-' for stdin) in one interpreter
+        (lines as '<command> [arguments]', '#' starts a comment line)
+    """
+)
+
+
+def build_argparser(scripts: Dict[str, str]):
+    p = ArgumentParser(
+        prog="rf",
+        description=DESC,
+        epilog="commands:\n  " + "\n  ".join([BATCH_COMMAND] + sorted(scripts)),
+        formatter_class=RawTextHelpFormatter,
+    )
+    p.add_argument("command", help="Name of the command.")
+    return p
+
+
+def build_batch_argparser():
+    p = ArgumentParser(
+        prog=f"rf {BATCH_COMMAND}",
+        description="Run many commands in one interpreter.",
+        formatter_class=RawTextHelpFormatter,
+    )
+    p.add_argument("batch_file", help="Path to file with one command per line.")
+    p.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="Continue with the next command if a command fails.",
+    )
+    return p
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    scripts = get_scripts()
+
+    # everything after the command belongs to the command
+    if not argv or argv[0].startswith("-"):
+        build_argparser(scripts).parse_args(argv[:1])
+
+    if argv[0] == BATCH_COMMAND:
+        args = vars(build_batch_argparser().parse_args(argv[1:]))
+        commands = read_batch_file(args["batch_file"])
+        sys.exit(run_batch(commands, keep_going=args["keep_going"]))
+
+    sys.exit(run_command(argv, scripts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Streamline compression of whole tractograms (Dipy `compress_streamlines`).
+
+The input tractogram is read chunk by chunk, the chunks are compressed in a pool
+of worker processes and written to the output in their original order, so that
+streamline indices (and all index files referring to the tractogram) stay valid.
+Chunks are sent to the workers as flat point buffers, which are cheaper to
+transfer than lists of arrays.
+"""
+
+import os
+import time
+import numpy as np
+import nibabel as nib
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
+
+from dipy.tracking.streamlinespeed import compress_streamlines
+
+from randomised_filtering.classifier.preprocessing import concatenate_streamlines
+from randomised_filtering.classifier.streamline_loader import (
+    get_nb_streamlines,
+    iter_streamline_chunks,
+)
+from randomised_filtering.instrumentation import current_span, traced
+
+
+# maximal distance (mm) of removed points to the compressed streamline, as
+#   recommended for the experiments (see README)
+DEFAULT_TOL_ERROR = 0.35
+# maximal length (mm) of a segment of the compressed streamline (Dipy default)
+DEFAULT_MAX_SEGMENT_LENGTH = 10.0
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def _compress_chunk(
+    points: np.ndarray,
+    lengths: np.ndarray,
+    tol_error: float,
+    max_segment_length: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Worker process: compresses the streamlines of a flat point buffer.
+
+    Returns
+    -------
+    points and number of points per streamline of the compressed streamlines
+    """
+    streamlines = np.split(points, np.cumsum(lengths)[:-1])
+    compressed = compress_streamlines(
+        streamlines, tol_error=tol_error, max_segment_length=max_segment_length
+    )
+    compressed_points, _, compressed_lengths = concatenate_streamlines(compressed)
+    return compressed_points, compressed_lengths
+
+
+def iter_compressed_chunks(
+    path_to_tractogram: str,
+    tol_error: float = DEFAULT_TOL_ERROR,
+    max_segment_length: float = DEFAULT_MAX_SEGMENT_LENGTH,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    num_processes: int = 1,
+    stats: Optional[Dict] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Compresses a tractogram chunk by chunk, yields the chunks in order.
+
+    Parameters
+    ----------
+    path_to_tractogram : str
+        path to tractogram file
+    tol_error : float, optional
+        tolerance error in mm (see `dipy.tracking.streamline.compress_streamlines`)
+    max_segment_length : float, optional
+        maximal segment length in mm of the compressed streamlines
+    chunk_size : int, optional
+        number of streamlines compressed at once
+    num_processes : int, optional
+        number of worker processes (chunks in flight: twice the number)
+    stats : dict, optional
+        if given, the numbers of streamlines and of points before and after
+        compression are accumulated in it
+
+    Yields
+    ------
+    points and number of points per streamline of the compressed chunk
+    """
+    assert num_processes > 0, "Need at least one worker process."
+    if stats is None:
+        stats = {}
+    for key in ["streamlines", "points_in", "points_out"]:
+        stats.setdefault(key, 0)
+
+    pending: deque = deque()
+
+    def next_chunk():
+        points, lengths = pending.popleft().result()
+        stats["streamlines"] += len(lengths)
+        stats["points_out"] += len(points)
+        return points, lengths
+
+    with ProcessPoolExecutor(max_workers=num_processes) as pool:
+        for chunk in iter_streamline_chunks(path_to_tractogram, chunk_size):
+            points, _, lengths = concatenate_streamlines(chunk)
+            stats["points_in"] += len(points)
+            pending.append(
+                pool.submit(
+                    _compress_chunk, points, lengths, tol_error, max_segment_length
+                )
+            )
+            # keep every worker busy, but bound the number of chunks in memory
+            if len(pending) >= 2 * num_processes:
+                yield next_chunk()
+        while pending:
+            yield next_chunk()
+
+
+@traced()
+def compress_tractogram(
+    path_to_tractogram: str,
+    path_to_output: str,
+    tol_error: float = DEFAULT_TOL_ERROR,
+    max_segment_length: float = DEFAULT_MAX_SEGMENT_LENGTH,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    num_processes: int = 1,
+) -> Dict:
+    """Compresses all streamlines of a tractogram into a new tractogram file.
+
+    The streamlines keep their order. If input and output have the same format,
+    the header (e.g. the reference space of a .trk file) is copied.
+
+    Parameters
+    ----------
+    path_to_tractogram : str
+        path to input tractogram file
+    path_to_output : str
+        path to output tractogram file (format given by the file extension)
+    tol_error, max_segment_length, chunk_size, num_processes
+        see `iter_compressed_chunks`
+
+    Returns
+    -------
+    dictionary with the numbers of streamlines and points (before and after),
+    compression ratio (points before / after), seconds and streamlines per second
+    """
+    current_span().set(unit="streamlines")
+    nb_streamlines = get_nb_streamlines(path_to_tractogram)
+    header = None
+    if os.path.splitext(path_to_tractogram)[1] == os.path.splitext(path_to_output)[1]:
+        header = nib.streamlines.load(path_to_tractogram, lazy_load=True).header
+
+    stats: Dict = {}
+    start = time.perf_counter()
+
+    def iter_streamlines():
+        for points, lengths in iter_compressed_chunks(
+            path_to_tractogram,
+            tol_error=tol_error,
+            max_segment_length=max_segment_length,
+            chunk_size=chunk_size,
+            num_processes=num_processes,
+            stats=stats,
+        ):
+            yield from np.split(points, np.cumsum(lengths)[:-1])
+            print(f"compressed {stats['streamlines']}/{nb_streamlines} streamlines")
+
+    tractogram = nib.streamlines.LazyTractogram(
+        iter_streamlines, affine_to_rasmm=np.eye(4)
+    )
+    nib.streamlines.save(tractogram, path_to_output, header=header)
+
+    seconds = time.perf_counter() - start
+    stats["ratio"] = stats["points_in"] / max(stats["points_out"], 1)
+    stats["seconds"] = seconds
+    stats["streamlines_per_s"] = stats["streamlines"] / seconds if seconds > 0 else 0
+    current_span().add_items(stats["streamlines"])
+    return stats
@@ -0,0 +1,192 @@
+"""
+Convergence monitoring of rSIFT experiments.
+
+The monitor accumulates the votes of the subsets of one experiment (one output
+folder) as they are completed, and tracks after every subset
+  - the number of plausible streamlines (acceptance rate >= positive limit),
+  - the number of implausible streamlines (acceptance rate <= negative limit),
+  - the share of streamlines whose label changed with the subset,
+with the limits as in `rf_eval_intersect_streamlines.py`. The experiment is
+considered converged once these statistics stayed within a tolerance for a
+number of consecutive subsets.
+"""
+
+import os
+import numpy as np
+
+from typing import Dict, List, Sequence
+
+from randomised_filtering.streamline_indices import get_indices_from_json
+
+
+# labels of streamlines w.r.t. the acceptance rate limits
+LABEL_OTHER = -1  # not seen, or acceptance rate between the limits
+LABEL_IMPLAUSIBLE = 0
+LABEL_PLAUSIBLE = 1
+
+DEFAULT_POSITIVE_LIMIT = 100
+DEFAULT_NEGATIVE_LIMIT = 0
+DEFAULT_TOLERANCE = 0.001
+DEFAULT_PATIENCE = 3
+
+HISTORY_COLUMNS = (
+    "subsets",
+    "plausible",
+    "implausible",
+    "changed",
+    "change_plausible",
+    "change_implausible",
+)
+
+
+class ConvergenceMonitor:
+    """Tracks the P/N class sizes of an experiment subset by subset.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        number of streamlines in the reference tractogram
+    positive_limit : float, optional
+        minimal acceptance rate (in %) of plausible streamlines
+    negative_limit : float, optional
+        maximal acceptance rate (in %) of implausible streamlines
+    tolerance : float, optional
+        maximal share of changed labels and maximal relative change of the P/N
+        class sizes per subset
+    patience : int, optional
+        number of consecutive subsets which need to stay within the tolerance
+    """
+
+    def __init__(
+        self,
+        nb_streamlines: int,
+        positive_limit: float = DEFAULT_POSITIVE_LIMIT,
+        negative_limit: float = DEFAULT_NEGATIVE_LIMIT,
+        tolerance: float = DEFAULT_TOLERANCE,
+        patience: int = DEFAULT_PATIENCE,
+    ):
+        self.nb_streamlines = nb_streamlines
+        self.positive_limit = positive_limit
+        self.negative_limit = negative_limit
+        self.tolerance = tolerance
+        self.patience = patience
+
+        self.counts = np.zeros((nb_streamlines, 2), dtype=np.int32)
+        self.labels = np.full(nb_streamlines, LABEL_OTHER, dtype=np.int8)
+        self.history: List[Dict[str, float]] = []
+
+    @property
+    def nb_subsets(self) -> int:
+        return len(self.history)
+
+    def _get_labels(self, counts: np.ndarray) -> np.ndarray:
+        votes = counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ar = counts[:, 0] * 100 / votes
+        labels = np.full(len(counts), LABEL_OTHER, dtype=np.int8)
+        labels[(votes > 0) & (ar >= self.positive_limit)] = LABEL_PLAUSIBLE
+        labels[(votes > 0) & (ar <= self.negative_limit)] = LABEL_IMPLAUSIBLE
+        return labels
+
+    def add_subset(
+        self, plausible_indices: Sequence[int], implausible_indices: Sequence[int]
+    ) -> Dict[str, float]:
+        """Adds the votes of one subset (indices w.r.t. the reference tractogram).
+
+        Returns
+        -------
+        statistics after the subset (one row of the history)
+        """
+        plausible = np.asarray(plausible_indices, dtype=np.int64)
+        implausible = np.asarray(implausible_indices, dtype=np.int64)
+
+        # labels can only change for streamlines of the subset
+        seen = np.concatenate([plausible, implausible])
+        self.counts[plausible, 0] += 1
+        self.counts[implausible, 1] += 1
+        new_labels = self._get_labels(self.counts[seen])
+        changed = int(np.count_nonzero(new_labels != self.labels[seen]))
+        self.labels[seen] = new_labels
+
+        nb_plausible = int(np.count_nonzero(self.labels == LABEL_PLAUSIBLE))
+        nb_implausible = int(np.count_nonzero(self.labels == LABEL_IMPLAUSIBLE))
+        previous = self.history[-1] if self.history else None
+
+        def relative_change(key, value):
+            if previous is None:
+                return 1.0
+            if previous[key] == 0:
+                return 0.0 if value == 0 else 1.0
+            return abs(value - previous[key]) / previous[key]
+
+        stats = {
+            "subsets": len(self.history) + 1,
+            "plausible": nb_plausible,
+            "implausible": nb_implausible,
+            "changed": changed / self.nb_streamlines,
+            "change_plausible": relative_change("plausible", nb_plausible),
+            "change_implausible": relative_change("implausible", nb_implausible),
+        }
+        self.history.append(stats)
+        return stats
+
+    def add_subset_from_folder(self, path_to_output_folder: str, subset: int) -> None:
+        """Adds the votes of one subset from its reference index files."""
+        base = os.path.join(path_to_output_folder, f"subset_{subset}")
+        stats = self.add_subset(
+            get_indices_from_json(base + "_plausible_ref.json", dtype=np.int64),
+            get_indices_from_json(base + "_implausible_ref.json", dtype=np.int64),
+        )
+        print(
+            "subset {subsets}: P {plausible}, N {implausible}, "
+            "changed {changed:.4%}".format(**stats)
+        )
+
+    def is_converged(self) -> bool:
+        """Checks whether the last `patience` subsets stayed within the tolerance."""
+        if len(self.history) < self.patience:
+            return False
+        return all(
+            stats["changed"] <= self.tolerance
+            and stats["change_plausible"] <= self.tolerance
+            and stats["change_implausible"] <= self.tolerance
+            for stats in self.history[-self.patience :]
+        )
+
+    def write_history(self, path: str) -> None:
+        """Writes the statistics after every subset to a csv file."""
+        with open(path, "w") as f:
+            f.write(";".join(HISTORY_COLUMNS) + "\n")
+            for stats in self.history:
+                f.write(";".join(str(stats[c]) for c in HISTORY_COLUMNS) + "\n")
+
+
+def monitor_output_folder(
+    path_to_output_folder: str, nb_streamlines: int, **kwargs
+) -> ConvergenceMonitor:
+    """Replays all complete subsets of an output folder (in order) in a monitor.
+
+    Parameters
+    ----------
+    path_to_output_folder : str
+        output folder of an experiment
+    nb_streamlines : int
+        number of streamlines in the reference tractogram
+    kwargs
+        passed on to `ConvergenceMonitor`
+
+    Returns
+    -------
+    monitor holding the votes of subsets 1, 2, ... up to the first incomplete one
+    """
+    monitor = ConvergenceMonitor(nb_streamlines, **kwargs)
+    subset = 1
+    while all(
+        os.path.exists(
+            os.path.join(path_to_output_folder, f"subset_{subset}_{name}_ref.json")
+        )
+        for name in ["plausible", "implausible"]
+    ):
+        monitor.add_subset_from_folder(path_to_output_folder, subset)
+        subset += 1
+    return monitor
@@ -3,9 +3,15 @@ Utilities script for various streamline vote evaluations and index file analyses
 """
 
 import os
+import json
 import numpy as np
 
-from randomised_filtering.classifier.streamline_loader import get_indices_from_json
+from randomised_filtering.instrumentation import current_span, traced
+from randomised_filtering.streamline_indices import get_indices_from_json
+
+
+# number of streamlines per chunk in out-of-core evaluations
+DEFAULT_CHUNK_SIZE = 10000000
 
 
 def intersect(sl_first_subset, intersect_with_1, intersect_with_2):
@@ -15,26 +21,74 @@ def intersect(sl_first_subset, intersect_with_1, intersect_with_2):
     return intersection_tmp, ar_limit_not_fulfilled_tmp, intersection_other_votes
 
 
-def build_streamline_index():
+def get_nb_subsets_from_folder(filepath):
+    """Get the number of subsets of an output folder (reference index files)."""
+    return sum([x[-19:] == "_plausible_ref.json" for x in os.listdir(filepath)])
+
+
+def get_nb_streamlines_from_folder(filepath):
+    """Get the number of streamlines of the reference tractogram of an output folder.
+
+    The reference tractogram is taken from the first reference index file
+    (`subset_1_plausible_ref.json`) and looked up as given in the file, or next to
+    the output folder.
+
+    Parameters
+    ----------
+    filepath : str
+        path to output folder of an experiment
+
+    Returns
+    -------
+    number of streamlines in the reference tractogram
+    """
+    with open(os.path.join(filepath, "subset_1_plausible_ref.json"), "r") as f:
+        path_to_reference = json.loads(f.readline())["filenames"][0]
+
+    candidates = [
+        path_to_reference,
+        os.path.join(filepath, os.pardir, os.path.basename(path_to_reference)),
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            # nibabel is only needed here, keep it out of the import of this module
+            from randomised_filtering.classifier.streamline_loader import (
+                get_nb_streamlines,
+            )
+
+            return get_nb_streamlines(candidate)
+
+    raise ValueError(
+        f"Reference tractogram '{path_to_reference}' of '{filepath}' not found, "
+        "the number of streamlines has to be given."
+    )
+
+
+def build_streamline_index(nb_streamlines):
     """Prepare nested list for storing streamline indices.
 
-    Prepares nested list with one entry for every of the 10M streamlines, for one
-      subset size run of rSIFT:
+    Prepares nested list with one entry for every streamline of the tractogram,
+      for one subset size run of rSIFT:
         Each streamline entry l will contain:
           l[0]: list of subsets where the streamline was accepted by SIFT
           l[1]: list of subsets where the streamline was rejected by SIFT
           l[2]: index of the streamline
     The list still need to be filled - l[0] and l[1] will be empty for each l
 
+    Parameters
+    ----------
+    nb_streamlines : int
+        number of streamlines in the reference tractogram
+
     Returns
     -------
-    streamline_index : nested list of length 10 million
+    streamline_index : nested list of length nb_streamlines
     """
-    streamline_index = [[[], [], i] for i in range(10000000)]
+    streamline_index = [[[], [], i] for i in range(nb_streamlines)]
     return streamline_index
 
 
-def get_meta_streamline_index(folders, base_path=None):
+def get_meta_streamline_index(folders, base_path=None, nb_streamlines=None):
     """
 
     Prepares streamline index and fills it with votes for every streamline
@@ -48,18 +102,26 @@ def get_meta_streamline_index(folders, base_path=None):
         folders relevant for the evaluation
     base_path : str, optional
         path where folders are based
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram (default: read from the
+          reference tractogram of the first folder)
 
     Returns
     -------
     array of indices
     """
 
-    # get empty streamline index
-    meta_streamline_index = build_streamline_index()
-
     if base_path is None:
         base_path = os.getcwd()
 
+    if nb_streamlines is None:
+        nb_streamlines = get_nb_streamlines_from_folder(
+            os.path.join(base_path, folders[0])
+        )
+
+    # get empty streamline index
+    meta_streamline_index = build_streamline_index(nb_streamlines)
+
     # log positive and negative votes for streamlines across all subset sizes
     for folder in folders:
         path = os.path.join(base_path, folder)
@@ -146,7 +208,8 @@ def unify_all_sets_in_list(setlist):
     return unify_all
 
 
-def process_subsets(filepath, streamline_index=None):
+@traced()
+def process_subsets(filepath, streamline_index=None, nb_streamlines=None):
     """Process subsets.
 
     Read result files of plausible/implausible streamlines for one rSIFT
@@ -159,6 +222,9 @@ def process_subsets(filepath, streamline_index=None):
     streamline_index : list of lists, optional
         nested list with entry for each streamline, and it's positive and negative votes
           (see `build_streamline_index`), will be created if not given
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram, only needed if no
+          streamline index is given (default: read from the reference tractogram)
 
     Returns
     -------
@@ -170,10 +236,13 @@ def process_subsets(filepath, streamline_index=None):
     folder_contents = os.listdir(filepath)
     subsets = sum([x[-19:] == "_plausible_ref.json" for x in folder_contents])
     print("Found data for " + str(subsets) + " subsets.")
+    current_span().set(folder=filepath, subsets=subsets, unit="files")
     print("\nPreparing streamline array...")
 
     if streamline_index is None:
-        streamline_index = build_streamline_index()
+        if nb_streamlines is None:
+            nb_streamlines = get_nb_streamlines_from_folder(filepath)
+        streamline_index = build_streamline_index(nb_streamlines)
 
     filename_plausible = "subset_%s_plausible_ref.json"
     filename_implausible = "subset_%s_implausible_ref.json"
@@ -191,10 +260,157 @@ def process_subsets(filepath, streamline_index=None):
         for i in ind:
             streamline_index[i][1].append(subset)
 
+        current_span().add_items(2)
+
     return streamline_index
 
 
-def evaluate_subsets(streamline_index, subsets, name):
+@traced()
+def get_vote_counts(filepath, nb_streamlines=None, out=None):
+    """Count the votes of all subsets in one folder per streamline.
+
+    Array counterpart of `process_subsets`, which only keeps the number of
+    positive and negative votes per streamline instead of the subset numbers.
+
+    Parameters
+    ----------
+    filepath : str
+        path to look for subsets
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram (default: read from the
+          reference tractogram), ignored if `out` is given
+    out : np.ndarray, optional
+        array of shape (nb_streamlines, 2) to add the votes to, e.g. a memory-mapped
+          array created by `open_vote_counts`
+
+    Returns
+    -------
+    array of shape (nb_streamlines, 2) with the number of positive (column 0) and
+      negative (column 1) votes of every streamline
+    """
+    folder_contents = os.listdir(filepath)
+    subsets = sum([x[-19:] == "_plausible_ref.json" for x in folder_contents])
+    current_span().set(folder=filepath, subsets=subsets, unit="files")
+
+    counts = out
+    if counts is None:
+        if nb_streamlines is None:
+            nb_streamlines = get_nb_streamlines_from_folder(filepath)
+        counts = np.zeros((nb_streamlines, 2), dtype=np.int32)
+
+    # only the indices of one file are held in memory at a time
+    for subset in range(1, subsets + 1):
+        for column, name in enumerate(["plausible", "implausible"]):
+            ind = get_indices_from_json(
+                os.path.join(filepath, f"subset_{subset}_{name}_ref.json"),
+                dtype=np.int64,
+            )
+            np.add.at(counts[:, column], ind, 1)
+            current_span().add_items(1)
+
+    return counts
+
+
+def open_vote_counts(path_to_counts, nb_streamlines):
+    """Create a memory-mapped array of vote counts (.npy) for out-of-core evaluations.
+
+    Parameters
+    ----------
+    path_to_counts : str
+        path to .npy file
+    nb_streamlines : int
+        number of streamlines in the reference tractogram
+
+    Returns
+    -------
+    zero-initialised array of shape (nb_streamlines, 2), see `get_vote_counts`
+    """
+    return np.lib.format.open_memmap(
+        path_to_counts, mode="w+", dtype=np.int32, shape=(nb_streamlines, 2)
+    )
+
+
+def get_meta_vote_counts(folders, base_path=None, nb_streamlines=None, out=None):
+    """Count the votes of every streamline across ALL experiment instances/subset
+    sizes (array counterpart of `get_meta_streamline_index`).
+
+    Parameters
+    ----------
+    folders : list of folders
+        folders relevant for the evaluation
+    base_path : str, optional
+        path where folders are based
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram (default: read from the
+          reference tractogram of the first folder), ignored if `out` is given
+    out : np.ndarray, optional
+        array to add the votes to (see `get_vote_counts`)
+
+    Returns
+    -------
+    array of shape (nb_streamlines, 2) with positive and negative votes
+    """
+    if base_path is None:
+        base_path = os.getcwd()
+
+    counts = out
+    if counts is None:
+        if nb_streamlines is None:
+            nb_streamlines = get_nb_streamlines_from_folder(
+                os.path.join(base_path, folders[0])
+            )
+        counts = np.zeros((nb_streamlines, 2), dtype=np.int32)
+
+    for folder in folders:
+        path = os.path.join(base_path, folder)
+        print("\nCounting votes for", path)
+        get_vote_counts(path, out=counts)
+
+    return counts
+
+
+def build_vote_combination_dict_from_counts(
+    counts, subsets, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """Array counterpart of `build_vote_combination_dict`.
+
+    Processes the vote counts in chunks of streamlines, so that memory-mapped
+    counts of arbitrarily large tractograms can be evaluated with bounded memory.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+    subsets : int
+        amount of subsets in the experiment
+    chunk_size : int, optional
+        number of streamlines processed at once
+
+    Returns
+    -------
+    dictionary containing all combinations of P/N votes with P+N <= subsets
+      as keys (p,n). dict values are amount of streamlines with exactly p positive
+      and n negative votes.
+    """
+    # every combination (p, n) is encoded as p * (subsets + 1) + n
+    combinations = np.zeros((subsets + 1) ** 2, dtype=np.int64)
+    for start in range(0, len(counts), chunk_size):
+        chunk = np.asarray(counts[start : start + chunk_size], dtype=np.int64)
+        if np.any(chunk.sum(axis=1) > subsets):
+            raise ValueError(f"Streamlines with more than {subsets} votes found.")
+        combinations += np.bincount(
+            chunk[:, 0] * (subsets + 1) + chunk[:, 1], minlength=len(combinations)
+        )
+
+    return {
+        (p, n): int(combinations[p * (subsets + 1) + n])
+        for p in range(subsets + 1)
+        for n in range(subsets + 1 - p)
+    }
+
+
+@traced()
+def evaluate_subsets(streamline_index, subsets, name, output_dir=None):
     """Evaluate subsets.
 
     Evaluates vote distributions for all streamlines in streamline_index
@@ -209,13 +425,68 @@ def evaluate_subsets(streamline_index, subsets, name):
         amount of subsets in the experiment
     name : str
         name of the output file
+    output_dir : str, optional
+        folder to write the output file to (default: current working directory)
     """
 
     print("\nEvaluating...")
+    current_span().set(output=name, unit="streamlines")
+    current_span().add_items(len(streamline_index))
 
     # get combinations of P/N votes and respective streamline counts
     statsdict = build_vote_combination_dict(streamline_index, subsets)
 
+    write_vote_statistics(statsdict, subsets, len(streamline_index), name, output_dir)
+
+
+@traced()
+def evaluate_vote_counts(
+    counts, subsets, name, output_dir=None, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """Array counterpart of `evaluate_subsets` for (memory-mapped) vote counts.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+          (see `get_vote_counts`)
+    subsets : int
+        amount of subsets in the experiment
+    name : str
+        name of the output file
+    output_dir : str, optional
+        folder to write the output file to (default: current working directory)
+    chunk_size : int, optional
+        number of streamlines processed at once
+    """
+
+    print("\nEvaluating...")
+    current_span().set(output=name, unit="streamlines")
+    current_span().add_items(len(counts))
+
+    statsdict = build_vote_combination_dict_from_counts(counts, subsets, chunk_size)
+
+    write_vote_statistics(statsdict, subsets, len(counts), name, output_dir)
+
+
+def write_vote_statistics(statsdict, subsets, num_streamlines, name, output_dir=None):
+    """Write vote distributions to file.
+
+    Parameters
+    ----------
+    statsdict : dict
+        amount of streamlines per combination of P/N votes
+          (see `build_vote_combination_dict`)
+    subsets : int
+        amount of subsets in the experiment
+    num_streamlines : int
+        number of evaluated streamlines
+    name : str
+        name of the output file
+    output_dir : str, optional
+        folder to write the output file to (default: current working directory)
+    """
+
     print("Writing distribution by amount of votes...")
 
     if name is None:
@@ -223,11 +494,12 @@ def evaluate_subsets(streamline_index, subsets, name):
     else:
         outputfilename = "results_" + name + ".csv"
 
+    if output_dir is not None:
+        outputfilename = os.path.join(output_dir, outputfilename)
+
     with open(outputfilename, "w") as f:
         f.write("\n\nDistribution by amount of votes\n-----")
 
-        num_streamlines = len(streamline_index)
-
         # go through streamlines with a total of 0 votes, 1 vote, 2 votes, ...
         for votesum in range(subsets + 1):
             # first, get total # of streamlines with this amount of votes
@@ -297,6 +569,157 @@ def evaluate_subsets(streamline_index, subsets, name):
             )
 
 
+# acceptance rate bins of the vote statistics (lower bound excl, upper bound incl),
+#   with extra bins for EXACTLY 0% / 100%
+ACCEPTANCE_RATE_BINS = [
+    (0, 0),
+    (0, 20),
+    (20, 40),
+    (40, 60),
+    (60, 80),
+    (80, 100),
+    (100, 100),
+]
+
+
+def get_cohort_vote_combinations(counts, cohorts, subsets):
+    """Compute the P/N vote combinations of many cohorts of streamlines at once.
+
+    Cohorts may overlap. Their memberships are given as (cohort, streamline)
+    pairs, and the histograms of all cohorts are obtained with one `bincount`
+    over the combined keys cohort * nb_combinations + combination.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+          (see `get_vote_counts`)
+    cohorts : list of np.ndarray
+        streamline indices of every cohort
+    subsets : int
+        amount of subsets in the experiment (maximal number of votes)
+
+    Returns
+    -------
+    array of shape (nb_cohorts, subsets + 1, subsets + 1): number of streamlines of
+      every cohort with p positive and n negative votes at index [cohort, p, n]
+    """
+    nb_combinations = (subsets + 1) ** 2
+    cohort_ids = np.repeat(np.arange(len(cohorts)), [len(c) for c in cohorts])
+    streamline_ids = np.concatenate(
+        [np.asarray(c, dtype=np.int64) for c in cohorts] + [np.empty(0, np.int64)]
+    )
+
+    # read the vote counts of the members in index order (faster if memory-mapped)
+    order = np.argsort(streamline_ids, kind="stable")
+    member_counts = np.empty((len(streamline_ids), 2), dtype=np.int64)
+    member_counts[order] = counts[streamline_ids[order]]
+    if np.any(member_counts.sum(axis=1) > subsets):
+        raise ValueError(f"Streamlines with more than {subsets} votes found.")
+
+    keys = (
+        cohort_ids * nb_combinations
+        + member_counts[:, 0] * (subsets + 1)
+        + member_counts[:, 1]
+    )
+    histograms = np.bincount(keys, minlength=len(cohorts) * nb_combinations)
+    return histograms.reshape((len(cohorts), subsets + 1, subsets + 1))
+
+
+def get_acceptance_rate_distribution(histograms):
+    """Count streamlines per acceptance rate bin (see `ACCEPTANCE_RATE_BINS`).
+
+    Parameters
+    ----------
+    histograms : np.ndarray
+        P/N vote combinations, shape (..., subsets + 1, subsets + 1)
+          (see `get_cohort_vote_combinations`)
+
+    Returns
+    -------
+    array of shape (..., len(ACCEPTANCE_RATE_BINS)); streamlines without votes are
+      not counted
+    """
+    p, n = np.indices(histograms.shape[-2:])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ar = np.where(p + n > 0, p * 100 / (p + n), np.nan)
+
+    distribution = []
+    for lower, upper in ACCEPTANCE_RATE_BINS:
+        if lower == upper:
+            in_bin = ar == lower
+        else:
+            in_bin = (lower < ar) & (ar <= upper)
+        distribution.append((histograms * in_bin).sum(axis=(-2, -1)))
+    return np.stack(distribution, axis=-1)
+
+
+def evaluate_cohorts(
+    counts, paths_to_cohorts, subsets, name, output_dir=None, names=None
+):
+    """Evaluate vote statistics of many cohorts (index files) in one pass.
+
+    Writes one report with the acceptance rate distribution of every cohort and
+    the numbers of streamlines per P/N vote combination of all cohorts.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+    paths_to_cohorts : list of str
+        json files with the streamline indices of the cohorts
+    subsets : int
+        amount of subsets in the experiment
+    name : str
+        name of the output file
+    output_dir : str, optional
+        folder to write the output file to (default: current working directory)
+    names : list of str, optional
+        names of the cohorts (default: file names without extension)
+    """
+    print(f"\nEvaluating {len(paths_to_cohorts)} cohorts...")
+
+    if names is None:
+        names = [os.path.splitext(os.path.basename(p))[0] for p in paths_to_cohorts]
+    cohorts = [get_indices_from_json(p, dtype=np.int64) for p in paths_to_cohorts]
+
+    histograms = get_cohort_vote_combinations(counts, cohorts, subsets)
+    distribution = get_acceptance_rate_distribution(histograms)
+
+    if name is None:
+        outputfilename = "results_cohorts.csv"
+    else:
+        outputfilename = "results_" + name + "_cohorts.csv"
+    if output_dir is not None:
+        outputfilename = os.path.join(output_dir, outputfilename)
+
+    bins = [f"{lower}-{upper}%" for lower, upper in ACCEPTANCE_RATE_BINS]
+    with open(outputfilename, "w") as f:
+        f.write("Percentage of P votes -- amount of streamlines\n-----\n")
+        f.write(
+            "cohort;streamlines;streamlines with >= 1 vote;"
+            + ";".join(bins)
+            + ";"
+            + ";".join(f"{b} (% of streamlines with >= 1 vote)" for b in bins)
+            + "\n"
+        )
+        for cohort, cohort_name in enumerate(names):
+            nb_seen = histograms[cohort].sum() - histograms[cohort, 0, 0]
+            percentages = 100 * distribution[cohort] / max(nb_seen, 1)
+            f.write(
+                f"{cohort_name};{len(cohorts[cohort])};{nb_seen};"
+                + ";".join(str(c) for c in distribution[cohort])
+                + ";"
+                + ";".join(f"{round(c, 2)}%" for c in percentages)
+                + "\n"
+            )
+
+        f.write("\n\nDistribution by amount of votes\n-----\n")
+        f.write("cohort;P;N;streamlines\n")
+        for cohort, p, n in np.argwhere(histograms > 0):
+            f.write(f"{names[cohort]};{p};{n};{histograms[cohort, p, n]}\n")
+
+
 def get_acceptance_rate(streamline_stats):
     """Compute acceptance rate.
 
@@ -324,6 +747,106 @@ def get_acceptance_rate(streamline_stats):
     return ar
 
 
+def get_acceptance_rates(counts, chunk_size=DEFAULT_CHUNK_SIZE, unseen=-1):
+    """Compute the acceptance rate of every streamline from its vote counts.
+
+    Array counterpart of `get_acceptance_rate`.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        positive and negative votes per streamline, shape (nb_streamlines, 2)
+          (see `get_vote_counts`)
+    chunk_size : int, optional
+        number of streamlines processed at once
+    unseen : float, optional
+        value for streamlines without votes (default: -1, as `get_acceptance_rate`)
+
+    Returns
+    -------
+    float32 array with the acceptance rate (percentage of positive votes) of every
+      streamline
+    """
+    ar = np.empty(len(counts), dtype=np.float32)
+    for start in range(0, len(counts), chunk_size):
+        chunk = np.asarray(counts[start : start + chunk_size], dtype=np.float64)
+        votes = chunk.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ar[start : start + chunk_size] = np.where(
+                votes > 0, chunk[:, 0] * 100 / votes, unseen
+            )
+    return ar
+
+
+def _count_at_least(sorted_values, thresholds):
+    """Number of values >= each threshold (values sorted ascending)."""
+    return len(sorted_values) - np.searchsorted(sorted_values, thresholds, side="left")
+
+
+def _count_at_most(sorted_values, thresholds):
+    """Number of values <= each threshold (values sorted ascending)."""
+    return np.searchsorted(sorted_values, thresholds, side="right")
+
+
+def sweep_intersections(acceptance_rates, thresholds, plausible=True):
+    """Evaluate the intersections of `rf_eval_intersect_streamlines.py` for many
+    acceptance rate limits at once.
+
+    The first folder defines the set F of streamlines with AR >= limit (plausible)
+    or AR <= limit (implausible; as in the single limit evaluation, this includes
+    streamlines without votes, AR -1). For every further folder, the sizes of the
+    intersections with F are counts of minima (plausible) or maxima (implausible)
+    of acceptance rates beyond the limit, so each is obtained for all limits from
+    one sorted array.
+
+    Parameters
+    ----------
+    acceptance_rates : list of np.ndarray
+        acceptance rates per folder (see `get_acceptance_rates`), first folder
+          defines the set which is intersected
+    thresholds : sequence of float
+        acceptance rate limits (percentages)
+    plausible : bool, optional
+        whether to intersect plausible or implausible streamlines
+
+    Returns
+    -------
+    nb_first : np.ndarray
+        size of F per limit, shape (nb_thresholds,)
+    rows : list of dict
+        per further folder, arrays (per limit) with the number of streamlines of F
+          "intersection": fulfilling the limit in the folder,
+          "not_fulfilled": not fulfilling the limit in the folder,
+          "other_votes": with other votes in the folder (includes not seen),
+          "not_seen": without votes in the folder,
+          "left": fulfilling the limit in all folders up to this one
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    count = _count_at_least if plausible else _count_at_most
+    combine = np.minimum if plausible else np.maximum
+
+    first = acceptance_rates[0]
+    nb_first = count(np.sort(first), thresholds)
+
+    rows = []
+    combined_all = first
+    for ar in acceptance_rates[1:]:
+        intersection = count(np.sort(combine(first, ar)), thresholds)
+        not_seen = count(np.sort(first[ar == -1]), thresholds)
+        combined_all = combine(combined_all, ar)
+        rows.append(
+            {
+                "intersection": intersection,
+                "not_fulfilled": nb_first - intersection,
+                "other_votes": nb_first - intersection,
+                "not_seen": not_seen,
+                "left": count(np.sort(combined_all), thresholds),
+            }
+        )
+
+    return nb_first, rows
+
+
 def get_output_folders(path, folder_name):
     """
     Returns list of folders in path whose name starts with folder_name, sorts them.
@@ -0,0 +1,192 @@
+"""
+Per-stage timing and memory instrumentation.
+
+Stages are marked as spans, either with the context manager `span` or the
+decorator `traced`:
+
+    with span("evaluate", subset_size=500) as s:
+        ...
+        s.add_items(len(counts))
+
+When tracing is enabled, every span writes one JSON line with wall time, CPU
+time (of the whole process), peak resident memory of the process so far, the
+number of processed items and items per second, its parent span and its
+attributes. Tracing is enabled by setting the environment variable
+`RF_TRACE_PATH` to the output file, or with `set_trace_path` (`--trace` of the
+scripts). When it is disabled, `span` returns a shared no-op object, so spans
+cost about one function call.
+"""
+
+import os
+import sys
+import json
+import threading
+import time
+
+from functools import wraps
+from types import ModuleType
+from typing import Callable, Optional
+
+resource: Optional[ModuleType]
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+TRACE_PATH_VARIABLE = "RF_TRACE_PATH"
+
+_trace_path: Optional[str] = os.environ.get(TRACE_PATH_VARIABLE) or None
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+def set_trace_path(path: Optional[str]) -> None:
+    """Writes spans to the given JSON lines file (appending); None disables tracing."""
+    global _trace_path
+    _trace_path = path
+
+
+def is_tracing() -> bool:
+    return _trace_path is not None
+
+
+def add_trace_argument(parser) -> None:
+    """Adds the --trace option to the argument parser of a script."""
+    parser.add_argument(
+        "--trace",
+        required=False,
+        help="Path to .jsonl file to which the time and memory per processing "
+        f"stage are appended. (default: ${TRACE_PATH_VARIABLE}, if set)",
+    )
+
+
+def _get_max_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def _get_stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class _NullSpan:
+    """Span used while tracing is disabled; ignores everything."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_items(self, nb_items: int) -> None:
+        pass
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Measures one stage and writes it to the trace file on exit."""
+
+    def __init__(self, name: str, items: int = 0, **attributes):
+        self.name = name
+        self.items = items
+        self.attributes = attributes
+
+    def add_items(self, nb_items: int) -> None:
+        self.items += nb_items
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = _get_stack()
+        self._parent = stack[-1].name if stack else None
+        self._depth = len(stack)
+        stack.append(self)
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _get_stack().pop()
+
+        record = {
+            "name": self.name,
+            "parent": self._parent,
+            "depth": self._depth,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "start": round(self._start, 6),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "max_rss_mb": _get_max_rss_mb(),
+            "items": self.items,
+            "items_per_s": round(self.items / wall, 1) if wall > 0 else None,
+        }
+        record.update(self.attributes)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+
+        path = _trace_path
+        if path is not None:
+            line = json.dumps(record, default=str) + "\n"
+            with _write_lock, open(path, "a") as f:
+                f.write(line)
+        return False
+
+
+def span(name: str, items: int = 0, **attributes):
+    """Returns a span for the given stage (a no-op if tracing is disabled).
+
+    Parameters
+    ----------
+    name : str
+        name of the stage
+    items : int, optional
+        number of items processed (can be increased with `add_items`)
+    attributes
+        additional values written with the span (must be JSON serializable)
+    """
+    if _trace_path is None:
+        return _NULL_SPAN
+    return Span(name, items, **attributes)
+
+
+def current_span():
+    """Returns the innermost open span of this thread (no-op if there is none)."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else _NULL_SPAN
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator that runs every call of the function in a span.
+
+    The function can count its items with `current_span().add_items(...)`.
+    """
+
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return function(*args, **kwargs)
+            with Span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
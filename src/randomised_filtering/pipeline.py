@@ -0,0 +1,649 @@
+"""
+Orchestration of rSIFT experiments.
+
+Python counterpart of `sift_experiment.sh`/`main.sh`: the stages of every subset
+(index creation, extraction, conversion, SIFT, transformation of the selection
+to reference indices) are modelled as tasks with dependencies and scheduled on a
+pool of workers within a CPU budget. Subsets whose reference index files already
+exist are skipped, so that half-finished output folders can be resumed.
+`run_experiment_in_rounds` runs the subsets of one experiment in rounds and
+stops early once the votes are settled (adaptive sampling) or the P/N class
+sizes converged (convergence monitor).
+"""
+
+import os
+import json
+import subprocess
+import functools
+import numpy as np
+import nibabel as nib
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+
+from randomised_filtering.classifier.streamline_loader import (
+    get_indices_from_json,
+    get_nb_streamlines,
+)
+from randomised_filtering.adaptive import (
+    DEFAULT_MAX_UNCERTAIN_FRACTION,
+    DEFAULT_MIN_WEIGHT,
+    DEFAULT_TARGET_WIDTH,
+    create_adaptive_streamline_indices,
+    get_posterior_width,
+    get_uncertain_fraction,
+)
+from randomised_filtering.convergence import ConvergenceMonitor
+from randomised_filtering.evaluation import evaluate_vote_counts, get_vote_counts
+from randomised_filtering.streamline_indices import (
+    create_streamline_indices,
+    get_list_of_streamline_indices_from_mrtrix,
+    write_list_of_streamline_indices,
+)
+from randomised_filtering.vote_archive import write_vote_archive
+
+
+# constants (as in `sift_experiment.sh` and `main.sh`)
+TRACTOGRAM_NAME = "all.trk"
+FOD_NAME = "WM_FODs.mif"
+SUBSET_SIZES = (10000000, 5000000, 2500000, 1250000, 625000, 500000, 250000)
+VOTES_PER_STREAMLINE = 5
+DEFAULT_TCKSIFT = "tcksift"
+CONVERGENCE_FILENAME = "convergence.csv"
+
+# resources of the scheduler
+RESOURCE_CPU = "cpu"
+RESOURCE_TRACTOGRAM = "tractogram"  # full tractograms loaded at the same time
+
+
+class Task:
+    """One step of an experiment.
+
+    Parameters
+    ----------
+    name : str
+        unique name of the task
+    func : callable
+        function to execute (without arguments)
+    deps : sequence of str, optional
+        names of the tasks which need to be finished before this task can start
+    resources : dict, optional
+        resources occupied while running, e.g. {"cpu": 4} (default: one cpu)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], None],
+        deps: Sequence[str] = (),
+        resources: Optional[Dict[str, int]] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.resources = resources if resources is not None else {RESOURCE_CPU: 1}
+
+    def __repr__(self):
+        return f"Task({self.name})"
+
+
+def run_tasks(tasks: Sequence[Task], budget: Dict[str, int]) -> None:
+    """Runs tasks in parallel, respecting their dependencies and a resource budget.
+
+    Tasks are started in the given order as soon as their dependencies are
+    finished and their resources are available. If a task fails, no further
+    tasks are started and the first error is raised once all running tasks
+    have finished.
+
+    Parameters
+    ----------
+    tasks : sequence of Task
+        tasks to run
+    budget : dict
+        available amount of every resource, e.g. {"cpu": 16, "tractogram": 1}
+    """
+    names = {t.name for t in tasks}
+    for task in tasks:
+        missing = [d for d in task.deps if d not in names]
+        if missing:
+            raise ValueError(f"{task} depends on unknown tasks {missing}.")
+        # tasks asking for more than available get everything there is
+        task.resources = {
+            k: min(v, budget.get(k, v)) for k, v in task.resources.items()
+        }
+
+    pending = {t.name: t for t in tasks}
+    done = set()
+    available = dict(budget)
+    running: Dict[Future, Task] = {}
+    error = None
+
+    def fits(task):
+        return all(available.get(k, v) >= v for k, v in task.resources.items())
+
+    with ThreadPoolExecutor(max_workers=max(budget.get(RESOURCE_CPU, 1), 1)) as pool:
+        while running or (pending and error is None):
+            if error is None:
+                for name, task in list(pending.items()):
+                    if all(d in done for d in task.deps) and fits(task):
+                        for k, v in task.resources.items():
+                            available[k] = available.get(k, v) - v
+                        running[pool.submit(task.func)] = task
+                        del pending[name]
+
+            if not running:
+                raise RuntimeError(
+                    f"Tasks cannot be scheduled with budget {budget}: {pending}"
+                )
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                for k, v in task.resources.items():
+                    available[k] += v
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Task {task.name} failed: {e}")
+                    error = error or e
+                else:
+                    done.add(task.name)
+                    print(f"Task {task.name} finished.")
+
+    if error is not None:
+        raise error
+
+
+def get_subset_paths(path_to_output_folder: str, subset: int) -> Dict[str, str]:
+    """Returns the paths of all files belonging to one subset (cf. sift_experiment)."""
+    base = os.path.join(path_to_output_folder, f"subset_{subset}")
+    return {
+        "indices": base + ".json",
+        "trk": base + ".trk",
+        "tck": base + ".tck",
+        "sift": base + "_sift.tck",
+        "selection": base + "_selection.txt",
+        "plausible_indices": base + "_plausible_indices.json",
+        "implausible_indices": base + "_implausible_indices.json",
+        "plausible_ref": base + "_plausible_ref.json",
+        "implausible_ref": base + "_implausible_ref.json",
+    }
+
+
+def is_subset_complete(path_to_output_folder: str, subset: int) -> bool:
+    """Checks whether the reference index files of a subset exist."""
+    paths = get_subset_paths(path_to_output_folder, subset)
+    return os.path.exists(paths["plausible_ref"]) and os.path.exists(
+        paths["implausible_ref"]
+    )
+
+
+def create_indices(
+    path_to_tractogram: str,
+    nb_streamlines: int,
+    sample_size: int,
+    randomized: bool,
+    subset: int,
+    path_to_indices: str,
+    seed: Optional[int] = None,
+) -> None:
+    """Stage 1: write streamline indices of one subset
+    (rf_create_streamline_indices)."""
+    rng = None if seed is None else np.random.default_rng([seed, sample_size, subset])
+    idx_list = create_streamline_indices(
+        nb_streamlines, sample_size, randomized, set_id=subset, rng=rng
+    )
+    write_list_of_streamline_indices(path_to_indices, idx_list, path_to_tractogram)
+
+
+def extract_subsets(
+    path_to_tractogram: str,
+    paths_to_indices: Sequence[str],
+    paths_to_trk: Sequence[str],
+) -> None:
+    """Stage 2: write the streamlines of several subsets to .trk files
+    (rf_obtain_subsets_from_tractogram), loading the tractogram only once."""
+    trk = nib.streamlines.load(path_to_tractogram)
+    t = trk.tractogram.to_world()  # bring to RASmm
+
+    for path_to_indices, path_to_trk in zip(paths_to_indices, paths_to_trk):
+        t_new = nib.streamlines.Tractogram(
+            streamlines=t.streamlines[get_indices_from_json(path_to_indices)],
+            # NOTE: expected to be eye(4) at this point.
+            affine_to_rasmm=t.affine_to_rasmm,
+        )
+        nib.streamlines.save(tractogram=t_new, filename=path_to_trk, header=trk.header)
+
+
+def convert_to_tck(path_to_trk: str, path_to_tck: str) -> None:
+    """Stage 3: convert a subset to .tck (needed to run SIFT).
+
+    Both formats store streamlines in RASmm once loaded by nibabel, so this is
+    equivalent to `scil_convert_tractogram.py` with the subject's reference image.
+    """
+    nib.streamlines.save(nib.streamlines.load(path_to_trk).tractogram, path_to_tck)
+
+
+def run_tcksift(
+    tcksift: str,
+    path_to_tck: str,
+    path_to_fod: str,
+    path_to_sift: str,
+    path_to_selection: str,
+    nthreads: int,
+) -> None:
+    """Stage 4: run SIFT on one subset."""
+    subprocess.run(
+        [
+            tcksift,
+            path_to_tck,
+            path_to_fod,
+            path_to_sift,
+            "-out_selection",
+            path_to_selection,
+            "-nthreads",
+            str(nthreads),
+            # overwrite outputs of interrupted runs
+            "-force",
+        ],
+        check=True,
+    )
+
+
+def selection_to_reference_indices(paths: Dict[str, str]) -> None:
+    """Stage 5: convert the SIFT selection into index files w.r.t. the subset and
+    the reference tractogram (rf_streamline_indices_from_mrtrix_selection,
+    rf_transform_indices_reference) and remove the subset tractograms."""
+    idx_implausible, idx_plausible = get_list_of_streamline_indices_from_mrtrix(
+        paths["selection"]
+    )
+
+    with open(paths["indices"], "r") as f:
+        json_content = json.load(f)
+    ref_file = json_content["filenames"][0]
+    ref_idx = np.array(json_content[ref_file], dtype=np.int64)
+
+    for name, idx_list in [
+        ("plausible", idx_plausible),
+        ("implausible", idx_implausible),
+    ]:
+        write_list_of_streamline_indices(
+            paths[f"{name}_indices"], idx_list, paths["trk"]
+        )
+        # reference file is written last, it marks the subset as complete
+        write_list_of_streamline_indices(
+            paths[f"{name}_ref"], ref_idx[idx_list].tolist(), ref_file
+        )
+
+    # discard subset tractogram files for efficient use of space
+    for key in ["trk", "tck", "sift"]:
+        if os.path.exists(paths[key]):
+            os.remove(paths[key])
+
+
+def evaluate_output_folder(path_to_output_folder: str, subsets: int) -> None:
+    """Stage 6: accumulate the votes of all subsets and write the vote statistics."""
+    evaluate_vote_counts(
+        get_vote_counts(path_to_output_folder),
+        subsets,
+        os.path.basename(os.path.normpath(path_to_output_folder)),
+        output_dir=path_to_output_folder,
+    )
+
+
+def build_experiment_tasks(
+    base_path: str,
+    randomized: bool,
+    num_realisations: int,
+    sample_size: int,
+    output_folder: str,
+    tcksift: str = DEFAULT_TCKSIFT,
+    sift_threads: int = 1,
+    seed: Optional[int] = None,
+    evaluate: bool = False,
+    archive: bool = False,
+    tractogram_name: str = TRACTOGRAM_NAME,
+    fod_name: str = FOD_NAME,
+) -> List[Task]:
+    """Builds the tasks of one rSIFT experiment (cf. `sift_experiment.sh`).
+
+    Parameters
+    ----------
+    base_path : str
+        path to folder with subject data
+    randomized : bool
+        True for randomized (rSIFT), False for sequential subsets
+    num_realisations : int
+        number of repetitions (amount of subsets)
+    sample_size : int
+        size of each subset
+    output_folder : str
+        name of folder for results, created as sub-folder of the base path
+    tcksift : str, optional
+        SIFT executable (default: tcksift)
+    sift_threads : int, optional
+        number of threads of every SIFT run (default: 1)
+    seed : int, optional
+        seed for the random subsets (default: not reproducible)
+    evaluate : bool, optional
+        whether to accumulate the votes and write the vote statistics at the end
+    archive : bool, optional
+        whether to write the packed vote archive (see `vote_archive`) at the end
+    tractogram_name : str, optional
+        file name of the tractogram in the base path
+    fod_name : str, optional
+        file name of the FODs in the base path
+
+    Returns
+    -------
+    list of tasks; empty if all subsets are complete and neither evaluation nor
+    archive are requested
+    """
+    path_to_tractogram = os.path.join(base_path, tractogram_name)
+    path_to_fod = os.path.join(base_path, fod_name)
+    path_to_output_folder = os.path.join(base_path, output_folder)
+    os.makedirs(path_to_output_folder, exist_ok=True)
+
+    subsets = range(1, num_realisations + 1)
+    todo = [i for i in subsets if not is_subset_complete(path_to_output_folder, i)]
+    print(
+        f"{output_folder}: {num_realisations - len(todo)} of {num_realisations} "
+        "subsets complete."
+    )
+
+    nb_streamlines = get_nb_streamlines(path_to_tractogram)
+
+    def name(stage, subset=None):
+        return f"{output_folder}/{stage}" + ("" if subset is None else f"_{subset}")
+
+    tasks = []
+    paths = {i: get_subset_paths(path_to_output_folder, i) for i in todo}
+
+    for i in todo:
+        # keep existing indices of interrupted runs
+        if os.path.exists(paths[i]["indices"]):
+            continue
+        tasks.append(
+            Task(
+                name("indices", i),
+                functools.partial(
+                    create_indices,
+                    path_to_tractogram,
+                    nb_streamlines,
+                    sample_size,
+                    randomized,
+                    i,
+                    paths[i]["indices"],
+                    seed=seed,
+                ),
+            )
+        )
+
+    if todo:
+        tasks.append(
+            Task(
+                name("extract"),
+                functools.partial(
+                    extract_subsets,
+                    path_to_tractogram,
+                    [paths[i]["indices"] for i in todo],
+                    [paths[i]["trk"] for i in todo],
+                ),
+                deps=[t.name for t in tasks],
+                resources={RESOURCE_CPU: 1, RESOURCE_TRACTOGRAM: 1},
+            )
+        )
+
+    for i in todo:
+        tasks.append(
+            Task(
+                name("convert", i),
+                functools.partial(convert_to_tck, paths[i]["trk"], paths[i]["tck"]),
+                deps=[name("extract")],
+            )
+        )
+        tasks.append(
+            Task(
+                name("sift", i),
+                functools.partial(
+                    run_tcksift,
+                    tcksift,
+                    paths[i]["tck"],
+                    path_to_fod,
+                    paths[i]["sift"],
+                    paths[i]["selection"],
+                    sift_threads,
+                ),
+                deps=[name("convert", i)],
+                resources={RESOURCE_CPU: sift_threads},
+            )
+        )
+        tasks.append(
+            Task(
+                name("reference", i),
+                functools.partial(selection_to_reference_indices, paths[i]),
+                deps=[name("sift", i)],
+            )
+        )
+
+    if evaluate:
+        tasks.append(
+            Task(
+                name("evaluate"),
+                functools.partial(
+                    evaluate_output_folder, path_to_output_folder, num_realisations
+                ),
+                deps=[name("reference", i) for i in todo],
+                resources={RESOURCE_CPU: 1, RESOURCE_TRACTOGRAM: 1},
+            )
+        )
+
+    if archive:
+        tasks.append(
+            Task(
+                name("archive"),
+                functools.partial(
+                    write_vote_archive, path_to_output_folder, nb_streamlines
+                ),
+                deps=[name("reference", i) for i in todo],
+            )
+        )
+
+    return tasks
+
+
+def build_rsift_tasks(
+    base_path: str,
+    randomized: bool,
+    subset_sizes: Sequence[int] = SUBSET_SIZES,
+    num_streamlines: Optional[int] = None,
+    **kwargs,
+) -> List[Task]:
+    """Builds the tasks of all experiments of one subject (cf. `main.sh`).
+
+    Parameters
+    ----------
+    base_path : str
+        path to folder with subject data
+    randomized : bool
+        True for randomized (rSIFT), False for sequential subsets
+    subset_sizes : sequence of int, optional
+        subset sizes, one experiment (output_<size>) per size
+    num_streamlines : int, optional
+        total number of streamlines evaluated per subset size (default:
+        VOTES_PER_STREAMLINE times the size of the tractogram if randomized,
+        otherwise the size of the tractogram)
+    kwargs
+        passed on to `build_experiment_tasks`
+
+    Returns
+    -------
+    list of tasks of all experiments
+    """
+    if num_streamlines is None:
+        path_to_tractogram = os.path.join(
+            base_path, kwargs.get("tractogram_name", TRACTOGRAM_NAME)
+        )
+        num_streamlines = get_nb_streamlines(path_to_tractogram)
+        if randomized:
+            num_streamlines *= VOTES_PER_STREAMLINE
+
+    tasks = []
+    for size in subset_sizes:
+        tasks += build_experiment_tasks(
+            base_path,
+            randomized,
+            num_realisations=num_streamlines // size,
+            sample_size=size,
+            output_folder=f"output_{size}",
+            **kwargs,
+        )
+    return tasks
+
+
+def run_experiment_in_rounds(
+    base_path: str,
+    randomized: bool,
+    sample_size: int,
+    subsets_per_round: int,
+    max_subsets: int,
+    output_folder: str,
+    budget: Dict[str, int],
+    adaptive: bool = False,
+    target_width: float = DEFAULT_TARGET_WIDTH,
+    max_uncertain_fraction: float = DEFAULT_MAX_UNCERTAIN_FRACTION,
+    min_weight: float = DEFAULT_MIN_WEIGHT,
+    monitor: Optional[ConvergenceMonitor] = None,
+    seed: Optional[int] = None,
+    evaluate: bool = False,
+    archive: bool = False,
+    **kwargs,
+) -> int:
+    """Runs one rSIFT experiment in rounds of subsets, until it can be stopped.
+
+    After every round, the experiment stops early if
+      - adaptive: the acceptance rates of (almost) all streamlines are settled
+        (see `adaptive`); further rounds are drawn with extra weight on
+        streamlines whose acceptance rate is still uncertain,
+      - monitor given: the P/N class sizes converged (see `convergence`).
+    Complete subsets of an existing output folder are counted as previous rounds.
+
+    Parameters
+    ----------
+    base_path : str
+        path to folder with subject data
+    randomized : bool
+        True for randomized (rSIFT), False for sequential subsets
+    sample_size : int
+        size of each subset
+    subsets_per_round : int
+        number of subsets drawn (and filtered in parallel) per round
+    max_subsets : int
+        maximal number of subsets
+    output_folder : str
+        name of folder for results, created as sub-folder of the base path
+    budget : dict
+        resource budget of every round (see `run_tasks`)
+    adaptive : bool, optional
+        whether to draw subsets adaptively and stop once the acceptance rates
+        are settled (only randomized)
+    target_width : float, optional
+        maximal width of the credible interval of a settled streamline
+    max_uncertain_fraction : float, optional
+        fraction of streamlines which may remain unsettled
+    min_weight : float, optional
+        lower bound of the sampling weight of settled streamlines
+    monitor : ConvergenceMonitor, optional
+        empty monitor; stop once it is converged (its history is written to
+        `convergence.csv` in the output folder)
+    seed : int, optional
+        seed for the random subsets (default: not reproducible)
+    evaluate : bool, optional
+        whether to write the vote statistics at the end
+    archive : bool, optional
+        whether to write the packed vote archive at the end
+    kwargs
+        passed on to `build_experiment_tasks`
+
+    Returns
+    -------
+    number of subsets of the experiment
+    """
+    if adaptive and not randomized:
+        raise ValueError("Adaptive sampling is only possible for randomized runs.")
+
+    path_to_tractogram = os.path.join(
+        base_path, kwargs.get("tractogram_name", TRACTOGRAM_NAME)
+    )
+    path_to_output_folder = os.path.join(base_path, output_folder)
+    os.makedirs(path_to_output_folder, exist_ok=True)
+    nb_streamlines = get_nb_streamlines(path_to_tractogram)
+
+    nb_subsets = 0
+    while is_subset_complete(path_to_output_folder, nb_subsets + 1):
+        nb_subsets += 1
+
+    def update_monitor():
+        for i in range(monitor.nb_subsets + 1, nb_subsets + 1):
+            monitor.add_subset_from_folder(path_to_output_folder, i)
+        monitor.write_history(os.path.join(path_to_output_folder, CONVERGENCE_FILENAME))
+
+    while nb_subsets < max_subsets:
+        if monitor is not None:
+            update_monitor()
+            if monitor.is_converged():
+                print(f"{output_folder}: P/N class sizes converged.")
+                break
+
+        if adaptive:
+            counts = get_vote_counts(path_to_output_folder, nb_streamlines)
+            if nb_subsets > 0:
+                widths = get_posterior_width(counts)
+                uncertain = get_uncertain_fraction(widths, target_width)
+                print(
+                    f"{output_folder}: {nb_subsets} subsets, "
+                    f"{uncertain:.2%} of streamlines uncertain"
+                )
+                if uncertain <= max_uncertain_fraction:
+                    break
+
+        nb_round = min(subsets_per_round, max_subsets - nb_subsets)
+        for i in range(nb_subsets + 1, nb_subsets + nb_round + 1):
+            path_to_indices = get_subset_paths(path_to_output_folder, i)["indices"]
+            # keep existing indices of interrupted runs
+            if not adaptive or os.path.exists(path_to_indices):
+                continue
+            rng = None
+            if seed is not None:
+                rng = np.random.default_rng([seed, sample_size, i])
+            idx_list = create_adaptive_streamline_indices(
+                counts, sample_size, min_weight=min_weight, rng=rng
+            )
+            write_list_of_streamline_indices(
+                path_to_indices, idx_list, path_to_tractogram
+            )
+
+        nb_subsets += nb_round
+        run_tasks(
+            build_experiment_tasks(
+                base_path,
+                randomized=randomized,
+                num_realisations=nb_subsets,
+                sample_size=sample_size,
+                output_folder=output_folder,
+                seed=seed,
+                **kwargs,
+            ),
+            budget,
+        )
+
+    if monitor is not None:
+        update_monitor()
+
+    if evaluate:
+        evaluate_output_folder(path_to_output_folder, nb_subsets)
+
+    if archive:
+        write_vote_archive(path_to_output_folder, nb_streamlines)
+
+    return nb_subsets
@@ -0,0 +1,288 @@
+"""
+In-process SIFT on subsets of a tractogram.
+
+The full tractogram is mapped once onto the fixels (or voxels) of the fibre
+density (FD) image, resulting in a sparse streamline x fixel incidence matrix
+holding the length of every streamline within every fixel. The SIFT cost
+minimisation for a subset of streamlines then only needs the corresponding rows
+of that matrix, so streamlines do not have to be re-mapped for every subset.
+
+Differences to `tcksift`: streamline segments are sampled at a fixed step size
+and attributed to the voxel containing the sample (instead of exact voxel
+intersection lengths), all fixels have the same weight in the cost function,
+and streamlines are removed in batches, ranked by the change in cost their
+individual removal would cause.
+"""
+
+import numpy as np
+import nibabel as nib
+import scipy.sparse as sp
+
+from typing import Optional, Tuple
+
+from randomised_filtering.classifier.preprocessing import concatenate_streamlines
+from randomised_filtering.classifier.streamline_loader import iter_streamline_chunks
+
+
+DEFAULT_STEP_SIZE = 0.5  # mm
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_REMOVE_FRACTION = 0.01
+
+
+def get_fixels_from_peaks(
+    peaks: np.ndarray, fd_threshold: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Determines fixels from a peaks image (e.g. output of MRtrix3 `sh2peaks`).
+
+    Parameters
+    ----------
+    peaks : np.ndarray
+        peak image of shape (X, Y, Z, 3 * nb_peaks); the length of every peak
+        vector is its amplitude
+    fd_threshold : float, optional
+        peaks with amplitude below or equal to the threshold are ignored
+
+    Returns
+    -------
+    fixel_fd : np.ndarray
+        fibre density of every fixel, shape (nb_fixels,)
+    fixel_dirs : np.ndarray
+        unit direction of every fixel, shape (nb_fixels, 3)
+    voxel_fixels : np.ndarray
+        fixel index of every peak of every voxel (-1 if not a fixel),
+        shape (nb_voxels, nb_peaks), voxels in C order
+    """
+    peaks = np.nan_to_num(np.asarray(peaks, dtype=np.float64))
+    peaks = peaks.reshape((-1, peaks.shape[-1] // 3, 3))
+    amplitudes = np.linalg.norm(peaks, axis=-1)
+
+    is_fixel = amplitudes > fd_threshold
+    voxel_fixels = np.full(is_fixel.shape, -1, dtype=np.int64)
+    voxel_fixels[is_fixel] = np.arange(is_fixel.sum())
+
+    fixel_fd = amplitudes[is_fixel]
+    fixel_dirs = peaks[is_fixel] / fixel_fd[:, None]
+    return fixel_fd, fixel_dirs, voxel_fixels
+
+
+def sample_segments(
+    points: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, step_size: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Samples all segments of a chunk of streamlines at (at most) `step_size`.
+
+    Returns
+    -------
+    positions : np.ndarray
+        sample positions, shape (nb_samples, 3)
+    directions : np.ndarray
+        unit direction of the segment of every sample
+    weights : np.ndarray
+        length of streamline represented by every sample
+    owners : np.ndarray
+        index of the streamline (within the chunk) of every sample
+    """
+    # segments between consecutive points of the same streamline
+    is_last = np.zeros(len(points), dtype=bool)
+    is_last[(offsets + lengths - 1)[lengths > 0]] = True
+    seg_start = np.where(~is_last)[0]
+    seg_owner = np.repeat(np.arange(len(lengths)), np.maximum(lengths - 1, 0))
+
+    seg_vec = points[seg_start + 1] - points[seg_start]
+    seg_len = np.linalg.norm(seg_vec, axis=1)
+    valid = seg_len > 0
+    seg_start, seg_owner = seg_start[valid], seg_owner[valid]
+    seg_vec, seg_len = seg_vec[valid], seg_len[valid]
+
+    # split every segment into equally long pieces, sample at their centres
+    nb_pieces = np.maximum(np.ceil(seg_len / step_size).astype(np.int64), 1)
+    piece_seg = np.repeat(np.arange(len(seg_len)), nb_pieces)
+    piece_first = np.repeat(np.cumsum(nb_pieces) - nb_pieces, nb_pieces)
+    frac = (np.arange(len(piece_seg)) - piece_first + 0.5) / nb_pieces[piece_seg]
+
+    positions = points[seg_start[piece_seg]] + frac[:, None] * seg_vec[piece_seg]
+    directions = seg_vec[piece_seg] / seg_len[piece_seg, None]
+    weights = seg_len[piece_seg] / nb_pieces[piece_seg]
+    return positions, directions, weights, seg_owner[piece_seg]
+
+
+def build_incidence_matrix(
+    trk_path: str,
+    fd_img: nib.Nifti1Image,
+    peaks: Optional[np.ndarray] = None,
+    step_size: float = DEFAULT_STEP_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """Maps all streamlines of a tractogram onto the fixels/voxels of an FD image.
+
+    Parameters
+    ----------
+    trk_path : str
+        path to tractogram file
+    fd_img : nib.Nifti1Image
+        image defining the voxel grid; in voxel mode (no peaks given), its values
+        are the fibre densities of the voxels (e.g. l=0 term of the FODs)
+    peaks : np.ndarray, optional
+        peaks on the same grid (see `get_fixels_from_peaks`); if given, streamline
+        segments are attributed to the best aligned fixel of their voxel
+    step_size : float, optional
+        maximal distance between samples along the streamlines (mm)
+    chunk_size : int, optional
+        number of streamlines mapped at once
+
+    Returns
+    -------
+    incidence : sp.csr_matrix
+        streamline x fixel matrix of streamline lengths within the fixels
+    fd : np.ndarray
+        fibre density of every fixel
+    """
+    shape = fd_img.shape[:3]
+    inv_affine = np.linalg.inv(fd_img.affine)
+
+    if peaks is None:
+        fd = np.asarray(fd_img.dataobj, dtype=np.float64).reshape(-1)
+        fd = np.nan_to_num(fd)
+    else:
+        fd, fixel_dirs, voxel_fixels = get_fixels_from_peaks(peaks)
+
+    blocks = []
+    for chunk in iter_streamline_chunks(trk_path, chunk_size):
+        points, offsets, lengths = concatenate_streamlines(chunk)
+        positions, directions, weights, owners = sample_segments(
+            points.astype(np.float64), offsets, lengths, step_size
+        )
+
+        # voxel of every sample (voxel centres at integer coordinates)
+        ijk = np.rint(positions @ inv_affine[:3, :3].T + inv_affine[:3, 3])
+        ijk = ijk.astype(np.int64)
+        inside = np.all((ijk >= 0) & (ijk < shape), axis=1)
+        voxels = np.ravel_multi_index(tuple(ijk[inside].T), shape)
+        owners, weights = owners[inside], weights[inside]
+        directions = directions[inside]
+
+        if peaks is None:
+            cols = voxels
+        else:
+            candidates = voxel_fixels[voxels]
+            alignment = np.abs(
+                np.einsum("ij,ikj->ik", directions, fixel_dirs[candidates])
+            )
+            alignment[candidates < 0] = -1
+            cols = candidates[np.arange(len(voxels)), np.argmax(alignment, axis=1)]
+
+        keep = (cols >= 0) & (fd[np.maximum(cols, 0)] > 0)
+        blocks.append(
+            sp.csr_matrix(
+                (weights[keep], (owners[keep], cols[keep])),
+                shape=(len(chunk), len(fd)),
+            )
+        )
+        print(f"mapped {sum(b.shape[0] for b in blocks)} streamlines")
+
+    if not blocks:
+        return sp.csr_matrix((0, len(fd))), fd
+    return sp.vstack(blocks, format="csr"), fd
+
+
+def save_incidence_matrix(path: str, incidence: sp.csr_matrix, fd: np.ndarray) -> None:
+    """Stores incidence matrix and fibre densities in one .npz file."""
+    np.savez(
+        path,
+        data=incidence.data.astype(np.float32),
+        indices=incidence.indices,
+        indptr=incidence.indptr,
+        shape=incidence.shape,
+        fd=fd.astype(np.float32),
+    )
+
+
+def load_incidence_matrix(path: str) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """Loads incidence matrix and fibre densities (see `save_incidence_matrix`)."""
+    with np.load(path) as f:
+        incidence = sp.csr_matrix(
+            (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+        )
+        fd = f["fd"].astype(np.float64)
+    return incidence, fd
+
+
+def sift_subset(
+    incidence: sp.csr_matrix,
+    fd: np.ndarray,
+    subset: np.ndarray,
+    remove_fraction: float = DEFAULT_REMOVE_FRACTION,
+    term_number: Optional[int] = None,
+) -> np.ndarray:
+    """Runs SIFT on a subset of the streamlines of the incidence matrix.
+
+    Iteratively removes the streamlines whose removal decreases the cost
+        sum_f (mu * TD_f - FD_f)^2,  mu = sum(FD) / sum(TD)
+    the most, until no removal decreases the cost any more (or `term_number`
+    streamlines are left). TD_f is the track density (streamline length) in
+    fixel f.
+
+    Parameters
+    ----------
+    incidence : sp.csr_matrix
+        streamline x fixel incidence matrix of the full tractogram
+    fd : np.ndarray
+        fibre density of every fixel
+    subset : np.ndarray
+        indices of the streamlines of the subset (in the full tractogram)
+    remove_fraction : float, optional
+        maximal fraction of the remaining streamlines removed per iteration
+    term_number : int, optional
+        number of streamlines at which to stop
+
+    Returns
+    -------
+    selection mask in subset order (1: kept, 0: removed), as in the
+    -out_selection file of tcksift
+    """
+    a = incidence[np.asarray(subset)].astype(np.float64)
+    a_length = np.asarray(a.sum(axis=1)).ravel()
+    a_squared = np.asarray(a.multiply(a).sum(axis=1)).ravel()
+
+    # only fixels traversed by the subset are considered (processing mask)
+    td = np.asarray(a.sum(axis=0)).ravel()
+    fd = np.where(td > 0, fd, 0)
+    fd_sum = fd.sum()
+    a_fd = a @ fd
+
+    keep = np.ones(a.shape[0], dtype=bool)
+    term_number = 0 if term_number is None else term_number
+
+    while keep.sum() > term_number:
+        td_sum = td.sum()
+        mu = fd_sum / td_sum
+        cost = np.sum((mu * td - fd) ** 2)
+
+        # cost after removing a single streamline s (incl. the change of mu):
+        #   sum_f (mu_s * (TD_f - a_sf) - FD_f)^2,  mu_s = sum(FD) / (sum(TD) - L_s)
+        with np.errstate(divide="ignore"):
+            mu_s = fd_sum / (td_sum - a_length)
+        a_td = a @ td
+        cost_s = (
+            mu_s**2 * (np.sum(td**2) - 2 * a_td + a_squared)
+            - 2 * mu_s * (np.sum(td * fd) - a_fd)
+            + np.sum(fd**2)
+        )
+        delta = np.where(keep & np.isfinite(cost_s), cost_s - cost, 0)
+
+        candidates = np.where(delta < 0)[0]
+        if len(candidates) == 0:
+            break
+
+        nb_remove = max(int(remove_fraction * keep.sum()), 1)
+        nb_remove = min(nb_remove, len(candidates), keep.sum() - term_number)
+        remove = candidates[np.argsort(delta[candidates])[:nb_remove]]
+
+        keep[remove] = False
+        td -= np.asarray(a[remove].sum(axis=0)).ravel()
+
+    return keep.astype(np.int8)
+
+
+def write_mrtrix_selection(path: str, selection: np.ndarray) -> None:
+    """Writes a selection mask in the format of tcksift's -out_selection file."""
+    np.savetxt(path, selection, fmt="%d")
@@ -0,0 +1,373 @@
+"""
+Spatial index of a tractogram for selecting streamlines by region of interest.
+
+The index is built in one pass over the tractogram and stored in a folder:
+  - endpoints.npy    : (nb_streamlines, 2, 3) float32, first and last point
+  - bboxes.npy       : (nb_streamlines, 2, 3) float32, minimum and maximum
+                       coordinates of every streamline
+  - endpoint_order.npy, cell_starts.npy : grid of the endpoints; the endpoints
+                       (flat index 2 * streamline + end) sorted by grid cell and
+                       the position of the first endpoint of every cell
+  - meta.json        : tractogram, number of streamlines and grid; written last,
+                       marks a complete index
+All coordinates are RASmm, as the streamlines loaded by nibabel.
+
+Endpoint queries only read the endpoints in grid cells overlapping the region.
+Streamlines passing through a region are preselected by their bounding boxes and,
+if exact results are needed, checked segment by segment with one pass over the
+tractogram (segments are resampled to half the voxel or grid cell size, so long
+segments of compressed tractograms crossing a small region are found). Results
+are sorted streamline indices, to be used as index arrays in the evaluation
+(e.g. `VoteStore.get_total_counts(streamline_ids)`) or written to an index file
+with `streamline_indices.write_list_of_streamline_indices`.
+"""
+
+import os
+import json
+import numpy as np
+import nibabel as nib
+
+from typing import List, Optional, Sequence, Tuple
+
+from randomised_filtering.classifier.preprocessing import concatenate_streamlines
+from randomised_filtering.classifier.streamline_loader import iter_streamline_chunks
+from randomised_filtering.instrumentation import current_span, traced
+
+
+ENDPOINTS_FILENAME = "endpoints.npy"
+BBOXES_FILENAME = "bboxes.npy"
+ORDER_FILENAME = "endpoint_order.npy"
+CELL_STARTS_FILENAME = "cell_starts.npy"
+META_FILENAME = "meta.json"
+
+DEFAULT_CELL_SIZE = 4.0  # mm
+DEFAULT_CHUNK_SIZE = 100000
+
+# which endpoints have to lie in the region
+ENDS_START = "start"
+ENDS_END = "end"
+ENDS_ANY = "any"
+ENDS_BOTH = "both"
+ENDS = (ENDS_START, ENDS_END, ENDS_ANY, ENDS_BOTH)
+
+
+def is_spatial_index(path_to_index: str) -> bool:
+    """Checks whether a (complete) spatial index exists at the given path."""
+    return os.path.exists(os.path.join(path_to_index, META_FILENAME))
+
+
+def get_streamline_extent(
+    streamlines: Sequence[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns endpoints and bounding boxes of streamlines, each (n, 2, 3)."""
+    points, offsets, lengths = concatenate_streamlines(streamlines)
+    if len(lengths) == 0:
+        return np.empty((0, 2, 3), np.float32), np.empty((0, 2, 3), np.float32)
+    endpoints = np.stack([points[offsets], points[offsets + lengths - 1]], axis=1)
+    bboxes = np.stack(
+        [np.minimum.reduceat(points, offsets), np.maximum.reduceat(points, offsets)],
+        axis=1,
+    )
+    return endpoints, bboxes
+
+
+def resample_segments(
+    streamlines: Sequence[np.ndarray], step: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Adds points to the segments of streamlines longer than `step` (mm).
+
+    Every segment is divided into equal parts of at most `step`.
+
+    Returns
+    -------
+    points : np.ndarray
+        all points of the resampled streamlines, shape (nb_points, 3)
+    owners : np.ndarray
+        index of the streamline of every point
+    """
+    points, offsets, lengths = concatenate_streamlines(streamlines)
+    steps = np.zeros_like(points)
+    steps[:-1] = points[1:] - points[:-1]
+    steps[offsets + lengths - 1] = 0  # no segment after the last point
+    nb_parts = np.ceil(np.linalg.norm(steps, axis=1) / step).astype(np.int64)
+    nb_parts = np.maximum(nb_parts, 1)
+
+    # point i is repeated nb_parts[i] times, moving along its following segment
+    source = np.repeat(np.arange(len(points)), nb_parts)
+    part = np.arange(len(source)) - np.repeat(np.cumsum(nb_parts) - nb_parts, nb_parts)
+    fraction = (part / nb_parts[source]).astype(np.float32)
+    resampled = points[source] + fraction[:, None] * steps[source]
+    owners = np.repeat(np.arange(len(lengths)), lengths)[source]
+    return resampled, owners
+
+
+@traced()
+def build_spatial_index(
+    path_to_index: str,
+    path_to_tractogram: str,
+    cell_size: float = DEFAULT_CELL_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """Builds the spatial index of a tractogram (one pass over the streamlines).
+
+    Parameters
+    ----------
+    path_to_index : str
+        folder to write the index to (created if necessary)
+    path_to_tractogram : str
+        path to tractogram file
+    cell_size : float, optional
+        edge length of the grid cells of the endpoints in mm
+    chunk_size : int, optional
+        number of streamlines read at once
+    """
+    current_span().set(unit="streamlines")
+    endpoint_chunks: List[np.ndarray] = []
+    bbox_chunks: List[np.ndarray] = []
+    for chunk in iter_streamline_chunks(path_to_tractogram, chunk_size):
+        chunk_endpoints, chunk_bboxes = get_streamline_extent(chunk)
+        endpoint_chunks.append(chunk_endpoints)
+        bbox_chunks.append(chunk_bboxes)
+        current_span().add_items(len(chunk))
+    empty = np.empty((0, 2, 3), np.float32)
+    all_endpoints = np.concatenate(endpoint_chunks + [empty])
+    all_bboxes = np.concatenate(bbox_chunks + [empty])
+
+    # sort the endpoints by grid cell
+    points = all_endpoints.reshape(-1, 3)
+    origin = points.min(axis=0) if len(points) else np.zeros(3, np.float32)
+    cells = np.floor((points - origin) / cell_size).astype(np.int64)
+    grid_shape = cells.max(axis=0) + 1 if len(points) else np.ones(3, np.int64)
+    keys = np.ravel_multi_index(tuple(cells.T), tuple(grid_shape))
+    order = np.argsort(keys, kind="stable")
+    cell_starts = np.searchsorted(keys[order], np.arange(np.prod(grid_shape) + 1))
+
+    os.makedirs(path_to_index, exist_ok=True)
+    np.save(os.path.join(path_to_index, ENDPOINTS_FILENAME), all_endpoints)
+    np.save(os.path.join(path_to_index, BBOXES_FILENAME), all_bboxes)
+    np.save(os.path.join(path_to_index, ORDER_FILENAME), order)
+    np.save(os.path.join(path_to_index, CELL_STARTS_FILENAME), cell_starts)
+    with open(os.path.join(path_to_index, META_FILENAME), "w") as f:
+        json.dump(
+            {
+                "tractogram": path_to_tractogram,
+                "nb_streamlines": len(all_endpoints),
+                "cell_size": cell_size,
+                "origin": origin.tolist(),
+                "grid_shape": grid_shape.tolist(),
+            },
+            f,
+        )
+
+
+class Region:
+    """Region of interest: a box or a mask, both in RASmm.
+
+    Use `Region.from_box` or `Region.from_mask`.
+    """
+
+    def __init__(
+        self,
+        bounds: np.ndarray,
+        mask: Optional[np.ndarray] = None,
+        affine: Optional[np.ndarray] = None,
+    ):
+        self.bounds = np.asarray(bounds, dtype=np.float64)  # (2, 3): min, max
+        self.mask = mask
+        self._inv_affine = None if affine is None else np.linalg.inv(affine)
+        # smallest voxel edge in mm, None for a box
+        self.voxel_size: Optional[float] = (
+            None if affine is None else float(nib.affines.voxel_sizes(affine).min())
+        )
+
+    @classmethod
+    def from_box(cls, lower: Sequence[float], upper: Sequence[float]) -> "Region":
+        """Box between the given corners (mm, inclusive)."""
+        return cls(np.array([lower, upper], dtype=np.float64))
+
+    @classmethod
+    def from_mask(cls, mask_img: nib.Nifti1Image) -> "Region":
+        """Non-zero voxels of a mask image."""
+        mask = np.asarray(mask_img.dataobj) > 0
+        ijk = np.argwhere(mask)
+        if len(ijk) == 0:
+            bounds = np.full((2, 3), np.nan)
+        else:
+            # corners of the outermost voxels (voxel centres at integer coordinates)
+            ranges = [[lo - 0.5, hi + 0.5] for lo, hi in zip(ijk.min(0), ijk.max(0))]
+            corners = np.array(np.meshgrid(*ranges)).reshape(3, -1).T
+            xyz = nib.affines.apply_affine(mask_img.affine, corners)
+            bounds = np.array([xyz.min(axis=0), xyz.max(axis=0)])
+        return cls(bounds, mask=mask, affine=mask_img.affine)
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """Returns whether every point (shape (n, 3), RASmm) lies in the region."""
+        points = np.asarray(points, dtype=np.float64)
+        inside = np.all((points >= self.bounds[0]) & (points <= self.bounds[1]), axis=1)
+        if self.mask is None:
+            return inside
+
+        ijk = np.rint(nib.affines.apply_affine(self._inv_affine, points[inside]))
+        ijk = ijk.astype(np.int64)
+        in_grid = np.all((ijk >= 0) & (ijk < self.mask.shape), axis=1)
+        in_mask = np.zeros(len(ijk), dtype=bool)
+        in_mask[in_grid] = self.mask[tuple(ijk[in_grid].T)]
+        inside[inside] = in_mask
+        return inside
+
+
+class SpatialIndex:
+    """Read access to a spatial index (memory-mapped).
+
+    Parameters
+    ----------
+    path_to_index : str
+        folder with a spatial index (see `build_spatial_index`)
+    """
+
+    def __init__(self, path_to_index: str):
+        if not is_spatial_index(path_to_index):
+            raise ValueError(f"No complete spatial index found at '{path_to_index}'.")
+        with open(os.path.join(path_to_index, META_FILENAME), "r") as f:
+            meta = json.load(f)
+
+        self.path_to_tractogram: str = meta["tractogram"]
+        self.nb_streamlines: int = meta["nb_streamlines"]
+        self.cell_size: float = meta["cell_size"]
+        self.origin = np.array(meta["origin"], dtype=np.float64)
+        self.grid_shape = tuple(meta["grid_shape"])
+
+        def load(filename):
+            return np.load(os.path.join(path_to_index, filename), mmap_mode="r")
+
+        self.endpoints = load(ENDPOINTS_FILENAME)
+        self.bboxes = load(BBOXES_FILENAME)
+        self.endpoint_order = load(ORDER_FILENAME)
+        self.cell_starts = load(CELL_STARTS_FILENAME)
+
+    def _get_candidate_endpoints(self, bounds: np.ndarray) -> np.ndarray:
+        """Flat indices of the endpoints in grid cells overlapping the bounds."""
+        if np.any(np.isnan(bounds)):
+            return np.empty(0, dtype=np.int64)
+        lower = np.floor((bounds[0] - self.origin) / self.cell_size).astype(np.int64)
+        upper = np.floor((bounds[1] - self.origin) / self.cell_size).astype(np.int64)
+        lower = np.maximum(lower, 0)
+        upper = np.minimum(upper, np.array(self.grid_shape) - 1)
+        if np.any(lower > upper):
+            return np.empty(0, dtype=np.int64)
+
+        # cells are contiguous along the last axis, read one run per (x, y)
+        x, y = np.meshgrid(
+            np.arange(lower[0], upper[0] + 1),
+            np.arange(lower[1], upper[1] + 1),
+            indexing="ij",
+        )
+        first = np.ravel_multi_index(
+            (x.ravel(), y.ravel(), np.full(x.size, lower[2])), self.grid_shape
+        )
+        starts = self.cell_starts[first]
+        stops = self.cell_starts[first + upper[2] - lower[2] + 1]
+        runs = [self.endpoint_order[a:b] for a, b in zip(starts, stops) if b > a]
+        if not runs:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(runs)
+
+    @traced()
+    def query_endpoints(self, region: Region, ends: str = ENDS_ANY) -> np.ndarray:
+        """Streamlines whose endpoints lie in the region.
+
+        Parameters
+        ----------
+        region : Region
+            region of interest
+        ends : str, optional
+            "start", "end", "any" (at least one endpoint) or "both"
+
+        Returns
+        -------
+        sorted indices of the streamlines
+        """
+        assert ends in ENDS, f"ends must be one of {ENDS}."
+        # read the endpoints in file order (faster if memory-mapped)
+        candidates = np.sort(self._get_candidate_endpoints(region.bounds))
+        points = self.endpoints.reshape(-1, 3)[candidates]
+        hits = candidates[region.contains(points)]
+        streamlines, end = hits // 2, hits % 2
+
+        if ends == ENDS_START:
+            result = streamlines[end == 0]
+        elif ends == ENDS_END:
+            result = streamlines[end == 1]
+        elif ends == ENDS_ANY:
+            result = np.unique(streamlines)
+        else:
+            ids, nb_ends = np.unique(streamlines, return_counts=True)
+            result = ids[nb_ends == 2]
+        current_span().set(unit="streamlines")
+        current_span().add_items(len(result))
+        return np.asarray(result, dtype=np.int64)
+
+    def query_bboxes(self, region: Region) -> np.ndarray:
+        """Streamlines whose bounding box overlaps the bounds of the region.
+
+        A superset of the streamlines passing through the region (see
+        `query_passing`).
+        """
+        if np.any(np.isnan(region.bounds)):
+            return np.empty(0, dtype=np.int64)
+        overlaps = np.all(
+            (self.bboxes[:, 0] <= region.bounds[1])
+            & (self.bboxes[:, 1] >= region.bounds[0]),
+            axis=1,
+        )
+        return np.where(overlaps)[0]
+
+    @traced()
+    def query_passing(
+        self,
+        region: Region,
+        exact: bool = True,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> np.ndarray:
+        """Streamlines passing through the region.
+
+        Parameters
+        ----------
+        region : Region
+            region of interest
+        exact : bool, optional
+            check the segments of the streamlines whose bounding box overlaps the
+            region (one pass over the tractogram); otherwise, return these
+            candidates. Segments are resampled to half the voxel size of a mask
+            or half the grid cell size, whichever is smaller; a segment only
+            clipping a corner of the region by less may be missed.
+        chunk_size : int, optional
+            number of streamlines read at once
+
+        Returns
+        -------
+        sorted indices of the streamlines
+        """
+        candidates = self.query_bboxes(region)
+        current_span().set(unit="streamlines", candidates=len(candidates))
+        if not exact or len(candidates) == 0:
+            return candidates
+
+        step = self.cell_size / 2
+        if region.voxel_size is not None:
+            step = min(step, region.voxel_size / 2)
+        is_candidate = np.zeros(self.nb_streamlines, dtype=bool)
+        is_candidate[candidates] = True
+        result = []
+        start = 0
+        for chunk in iter_streamline_chunks(self.path_to_tractogram, chunk_size):
+            ids = np.where(is_candidate[start : start + len(chunk)])[0]
+            if len(ids):
+                points, owners = resample_segments([chunk[i] for i in ids], step)
+                hit = np.unique(owners[region.contains(points)])
+                result.append(ids[hit] + start)
+            start += len(chunk)
+            if start > candidates[-1]:
+                break
+        current_span().add_items(start)
+        return np.concatenate(result + [np.empty(0, np.int64)]).astype(np.int64)
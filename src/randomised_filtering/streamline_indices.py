@@ -3,10 +3,79 @@
 import numpy as np
 import json
 
-from typing import Tuple, List
+from typing import Optional, Tuple, List
 from textwrap import dedent
 
+from randomised_filtering.instrumentation import current_span, traced
 
+
+def get_indices_from_json(filepath: str, dtype=None):
+    """Loads streamline indices from a json file
+
+    Parameters
+    ----------
+    filepath : str
+        path/name of file with the indices
+    dtype : numpy dtype, optional
+        if given, indices are converted to given data type
+
+    Returns
+    -------
+    array of the streamline indices
+    """
+
+    with open(filepath, "r") as f:
+        data = json.loads(f.readline())
+        ind_key = data["filenames"][0]
+        ind = data[ind_key]
+
+    if dtype:
+        ind = np.array(ind, dtype=dtype)
+
+    return ind
+
+
+@traced()
+def create_streamline_indices(
+    nb_streamlines: int,
+    num_streamlines: int,
+    randomized: bool,
+    set_id: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> List[int]:
+    """Create the streamline indices of one subset of a tractogram.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        number of streamlines in the tractogram
+    num_streamlines : int
+        number of streamlines in the subset
+    randomized : bool
+        draw streamlines at random (rSIFT) if True; otherwise, take the `set_id`-th
+        chunk of consecutive streamlines
+    set_id : int, optional
+        number of the set/chunk (starting at 1), only needed if not randomized
+    rng : np.random.Generator, optional
+        random generator (default: global numpy random state)
+
+    Returns
+    -------
+    list of streamline indices
+    """
+    current_span().set(unit="streamlines")
+    current_span().add_items(num_streamlines)
+    if randomized:
+        choice = np.random.choice if rng is None else rng.choice
+        return choice(
+            np.arange(nb_streamlines), size=num_streamlines, replace=False
+        ).tolist()
+
+    assert set_id is not None, "Sequential indices need the number of the set."
+    return np.arange((set_id - 1) * num_streamlines, set_id * num_streamlines).tolist()
+
+
+@traced()
 def get_list_of_streamline_indices_from_mrtrix(
     path_to_mrtrix_selection_file: str,
 ) -> Tuple[List[int], List[int]]:
@@ -30,6 +99,8 @@ def get_list_of_streamline_indices_from_mrtrix(
         l: List[int] = [int(line.rstrip()) for line in f]
 
     arr = np.array(l)
+    current_span().set(unit="streamlines")
+    current_span().add_items(len(arr))
 
     idx_0: np.ndarray = np.where(arr == 0)[0]
     idx_1: np.ndarray = np.where(arr == 1)[0]
@@ -46,6 +117,7 @@ def get_list_of_streamline_indices_from_mrtrix(
     return idx_0.tolist(), idx_1.tolist()
 
 
+@traced()
 def write_list_of_streamline_indices(
     path_to_json_file: str, list_sl_idx: List[int], path_to_tractogram: str
 ) -> None:
@@ -61,6 +133,8 @@ def write_list_of_streamline_indices(
         path to tractogram file which the streamline indices are referring to
     """
 
+    current_span().set(unit="streamlines")
+    current_span().add_items(len(list_sl_idx))
     obj = {"filenames": [path_to_tractogram], path_to_tractogram: list_sl_idx}
 
     with open(path_to_json_file, "w") as f:
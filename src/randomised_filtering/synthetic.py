@@ -0,0 +1,229 @@
+"""
+Synthetic data for testing and benchmarking without real subject data.
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from randomised_filtering.streamline_indices import write_list_of_streamline_indices
+
+
+def save_trk(
+    path: str, streamlines: Sequence[np.ndarray], affine: np.ndarray, shape
+) -> None:
+    """Writes streamlines (in RASmm) to a .trk file with the given reference grid."""
+    header = {
+        nib.streamlines.Field.VOXEL_TO_RASMM: affine,
+        nib.streamlines.Field.DIMENSIONS: tuple(shape[:3]),
+        nib.streamlines.Field.VOXEL_SIZES: tuple(np.sqrt((affine[:3, :3] ** 2).sum(0))),
+        nib.streamlines.Field.VOXEL_ORDER: "RAS",
+    }
+    tractogram = nib.streamlines.Tractogram(streamlines, affine_to_rasmm=np.eye(4))
+    nib.streamlines.save(tractogram, path, header=header)
+
+
+def make_synthetic_phantom(
+    shape: Tuple[int, int, int] = (30, 30, 30),
+    nb_streamlines: int = 2000,
+    oversampling: float = 2.0,
+    seed: Optional[int] = None,
+) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray, np.ndarray]:
+    """Creates a phantom of two crossing bundles with unit fibre density.
+
+    Bundle X runs along the x-axis through the lower half of the y-range, bundle
+    Y along the y-axis through the upper half of the x-range; both have a fibre
+    density of 1 in every voxel they pass. Bundle X is reconstructed with
+    `oversampling` times as many streamlines per voxel as bundle Y, so SIFT is
+    expected to remove mainly streamlines of bundle X.
+
+    Parameters
+    ----------
+    shape : tuple of int, optional
+        grid size (1mm isotropic voxels, identity affine)
+    nb_streamlines : int, optional
+        total number of streamlines (bundle X first, then bundle Y)
+    oversampling : float, optional
+        streamline density of bundle X relative to bundle Y
+    seed : int, optional
+        seed of the random generator
+
+    Returns
+    -------
+    streamlines : list of np.ndarray
+        streamlines in RASmm
+    affine : np.ndarray
+        voxel to RASmm affine
+    fd : np.ndarray
+        fibre density per voxel, shape `shape`
+    peaks : np.ndarray
+        peak image (two peaks per voxel, length = fibre density), shape
+        `shape` + (6,)
+    """
+    rng = np.random.default_rng(seed)
+    nx, ny, nz = shape
+    affine = np.eye(4)
+
+    # bundle regions (voxel ranges in the two directions orthogonal to the bundle)
+    x_range = (ny // 6, ny // 2), (nz // 6, 5 * nz // 6)
+    y_range = (nx // 2, 5 * nx // 6), (nz // 6, 5 * nz // 6)
+
+    fd = np.zeros(shape)
+    peaks = np.zeros(shape + (6,))
+    fd[:, slice(*x_range[0]), slice(*x_range[1])] += 1
+    peaks[:, slice(*x_range[0]), slice(*x_range[1]), 0] = 1
+    fd[slice(*y_range[0]), :, slice(*y_range[1])] += 1
+    peaks[slice(*y_range[0]), :, slice(*y_range[1]), 4] = 1
+
+    # number of streamlines relative to bundle volume and oversampling
+    volume_x = nx * np.diff(x_range[0])[0] * np.diff(x_range[1])[0]
+    volume_y = ny * np.diff(y_range[0])[0] * np.diff(y_range[1])[0]
+    share_x = oversampling * volume_x / (oversampling * volume_x + volume_y)
+    nb_x = int(round(nb_streamlines * share_x))
+
+    def make_bundle(nb, length, ranges, axis):
+        streamlines = []
+        for _ in range(nb):
+            nb_points = rng.integers(length // 2, length)
+            s = np.zeros((nb_points, 3), dtype=np.float32)
+            s[:, axis] = np.linspace(-0.5, length - 0.5, nb_points)
+            others = [a for a in range(3) if a != axis]
+            for a, (low, high) in zip(others, ranges):
+                s[:, a] = rng.uniform(low - 0.5, high - 0.5)
+            s[:, others] += rng.normal(scale=0.1, size=(nb_points, 2))
+            streamlines.append(s)
+        return streamlines
+
+    streamlines = make_bundle(nb_x, nx, x_range, axis=0) + make_bundle(
+        nb_streamlines - nb_x, ny, y_range, axis=1
+    )
+    return streamlines, affine, fd, peaks
+
+
+def save_synthetic_phantom(path_to_folder: str, **kwargs) -> None:
+    """Writes a phantom (see `make_synthetic_phantom`) as subject folder.
+
+    Creates `all.trk`, `fd.nii.gz` and `peaks.nii.gz` in the given folder.
+    """
+    os.makedirs(path_to_folder, exist_ok=True)
+    streamlines, affine, fd, peaks = make_synthetic_phantom(**kwargs)
+
+    save_trk(os.path.join(path_to_folder, "all.trk"), streamlines, affine, fd.shape)
+    nib.save(
+        nib.Nifti1Image(fd.astype(np.float32), affine),
+        os.path.join(path_to_folder, "fd.nii.gz"),
+    )
+    nib.save(
+        nib.Nifti1Image(peaks.astype(np.float32), affine),
+        os.path.join(path_to_folder, "peaks.nii.gz"),
+    )
+
+
+def iter_random_streamlines(
+    nb_streamlines: int,
+    min_points: int = 20,
+    max_points: int = 60,
+    box_size: float = 100.0,
+    chunk_size: int = 100000,
+    seed: Optional[int] = None,
+) -> Iterator[np.ndarray]:
+    """Yields random walk streamlines starting inside a box, chunk by chunk.
+
+    Parameters
+    ----------
+    nb_streamlines : int
+        number of streamlines
+    min_points, max_points : int, optional
+        range of the number of points per streamline
+    box_size : float, optional
+        edge length of the box (mm) in which streamlines start
+    chunk_size : int, optional
+        number of streamlines generated at once
+    seed : int, optional
+        seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, nb_streamlines, chunk_size):
+        nb = min(chunk_size, nb_streamlines - start)
+        lengths = rng.integers(min_points, max_points + 1, size=nb)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+        # random walk with steps of 1mm from a random start point
+        steps = rng.normal(size=(offsets[-1], 3))
+        steps /= np.linalg.norm(steps, axis=1, keepdims=True)
+        steps[offsets[:-1]] = rng.uniform(0, box_size, size=(nb, 3))
+        points = np.cumsum(steps, axis=0)
+        points -= np.repeat(points[offsets[:-1]] - steps[offsets[:-1]], lengths, axis=0)
+        points = points.astype(np.float32)
+        for i in range(nb):
+            yield points[offsets[i] : offsets[i + 1]]
+
+
+def save_synthetic_tractogram(path: str, nb_streamlines: int, **kwargs) -> None:
+    """Writes random streamlines (see `iter_random_streamlines`) to a .trk file.
+
+    The streamlines are written while they are generated, so that tractograms of
+    any size can be created with bounded memory.
+    """
+    box_size = kwargs.get("box_size", 100.0)
+    tractogram = nib.streamlines.LazyTractogram(
+        lambda: iter_random_streamlines(nb_streamlines, **kwargs),
+        affine_to_rasmm=np.eye(4),
+    )
+    header = {
+        nib.streamlines.Field.VOXEL_TO_RASMM: np.eye(4),
+        nib.streamlines.Field.DIMENSIONS: (int(box_size),) * 3,
+        nib.streamlines.Field.VOXEL_SIZES: (1.0, 1.0, 1.0),
+        nib.streamlines.Field.VOXEL_ORDER: "RAS",
+    }
+    nib.streamlines.save(tractogram, path, header=header)
+
+
+def save_synthetic_vote_folder(
+    path_to_folder: str,
+    path_to_tractogram: str,
+    nb_streamlines: int,
+    subset_size: int,
+    nb_subsets: int,
+    acceptance_rates: Optional[np.ndarray] = None,
+    seed: Optional[int] = None,
+) -> None:
+    """Writes random subset votes as an experiment output folder.
+
+    Creates `subset_<i>_plausible_ref.json` and `subset_<i>_implausible_ref.json`
+    for every subset, as written by an rSIFT experiment.
+
+    Parameters
+    ----------
+    path_to_folder : str
+        output folder (e.g. `output_<subset_size>`)
+    path_to_tractogram : str
+        reference tractogram written to the index files
+    nb_streamlines : int
+        number of streamlines in the tractogram
+    subset_size : int
+        number of streamlines per subset
+    nb_subsets : int
+        number of subsets
+    acceptance_rates : np.ndarray, optional
+        probability of every streamline to be accepted (default: uniform random)
+    seed : int, optional
+        seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    if acceptance_rates is None:
+        acceptance_rates = rng.uniform(size=nb_streamlines)
+
+    os.makedirs(path_to_folder, exist_ok=True)
+    for subset in range(1, nb_subsets + 1):
+        ids = rng.choice(nb_streamlines, size=subset_size, replace=False)
+        accepted = rng.uniform(size=subset_size) < acceptance_rates[ids]
+        base = os.path.join(path_to_folder, f"subset_{subset}")
+        write_list_of_streamline_indices(
+            base + "_plausible_ref.json", ids[accepted].tolist(), path_to_tractogram
+        )
+        write_list_of_streamline_indices(
+            base + "_implausible_ref.json", ids[~accepted].tolist(), path_to_tractogram
+        )
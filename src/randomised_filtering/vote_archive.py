@@ -0,0 +1,238 @@
+"""
+Packed vote archive of an rSIFT experiment (one output folder).
+
+The votes of all subsets are stored as two bit matrices of shape
+(subsets, streamlines), packed along the streamlines with `np.packbits`:
+  - votes_seen.npy     : bit set if the streamline was part of the subset
+  - votes_accepted.npy : bit set if the streamline was accepted by SIFT
+  - votes.json         : number of streamlines/subsets and reference tractogram
+The json file is written last and marks a complete archive.
+
+With one bit per subset and streamline, the archive of an experiment is small
+enough to be memory-mapped, and P/N counts, acceptance per subset, agreement of
+subsets and vote sequences of streamlines are computed from it without parsing
+the index files again.
+"""
+
+import os
+import json
+import numpy as np
+
+from typing import Optional, Sequence
+
+from randomised_filtering.streamline_indices import get_indices_from_json
+from randomised_filtering.evaluation import (
+    get_nb_streamlines_from_folder,
+    get_nb_subsets_from_folder,
+)
+
+
+SEEN_FILENAME = "votes_seen.npy"
+ACCEPTED_FILENAME = "votes_accepted.npy"
+META_FILENAME = "votes.json"
+
+# number of streamlines (multiple of 8) unpacked at once
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# number of set bits of every byte
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(packed: np.ndarray, axis: Optional[int] = None) -> np.ndarray:
+    """Counts the set bits of packed bit arrays (along the given axis)."""
+    return _POPCOUNT_TABLE[packed].sum(axis=axis, dtype=np.int64)
+
+
+def is_vote_archive(path_to_output_folder: str) -> bool:
+    """Checks whether a complete and up-to-date vote archive exists in the folder.
+
+    An archive is outdated if the folder contains more (or fewer) subsets than
+    the archive, e.g. because subsets were added after the archive was written.
+    """
+    path_to_meta = os.path.join(path_to_output_folder, META_FILENAME)
+    if not os.path.exists(path_to_meta):
+        return False
+    with open(path_to_meta, "r") as f:
+        archived_subsets = json.load(f)["subsets"]
+
+    subsets = get_nb_subsets_from_folder(path_to_output_folder)
+    if archived_subsets != subsets:
+        print(
+            f"Vote archive of {path_to_output_folder} is outdated "
+            f"({archived_subsets} of {subsets} subsets), it is not used."
+        )
+        return False
+    return True
+
+
+def write_vote_archive(
+    path_to_output_folder: str, nb_streamlines: Optional[int] = None
+) -> None:
+    """Writes the vote archive of an output folder from its reference index files.
+
+    Parameters
+    ----------
+    path_to_output_folder : str
+        output folder of an experiment
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram (default: read from the
+        reference tractogram of the index files)
+    """
+    subsets = get_nb_subsets_from_folder(path_to_output_folder)
+    if nb_streamlines is None:
+        nb_streamlines = get_nb_streamlines_from_folder(path_to_output_folder)
+
+    # the archive is incomplete until the json file is written again
+    path_to_meta = os.path.join(path_to_output_folder, META_FILENAME)
+    if os.path.exists(path_to_meta):
+        os.remove(path_to_meta)
+
+    print(f"Writing vote archive of {subsets} subsets to {path_to_output_folder}")
+    shape = (subsets, (nb_streamlines + 7) // 8)
+    matrices = [
+        np.lib.format.open_memmap(
+            os.path.join(path_to_output_folder, filename),
+            mode="w+",
+            dtype=np.uint8,
+            shape=shape,
+        )
+        for filename in [SEEN_FILENAME, ACCEPTED_FILENAME]
+    ]
+
+    row = np.zeros(nb_streamlines, dtype=bool)
+    for subset in range(1, subsets + 1):
+        base = os.path.join(path_to_output_folder, f"subset_{subset}")
+        plausible = get_indices_from_json(base + "_plausible_ref.json", dtype=np.int64)
+        implausible = get_indices_from_json(
+            base + "_implausible_ref.json", dtype=np.int64
+        )
+
+        row[:] = False
+        row[plausible] = True
+        matrices[1][subset - 1] = np.packbits(row)
+        row[implausible] = True
+        matrices[0][subset - 1] = np.packbits(row)
+
+    for matrix in matrices:
+        matrix.flush()
+    del matrices
+
+    reference = None
+    if subsets > 0:
+        path = os.path.join(path_to_output_folder, "subset_1_plausible_ref.json")
+        with open(path, "r") as f:
+            reference = json.loads(f.readline())["filenames"][0]
+
+    with open(path_to_meta, "w") as f:
+        json.dump(
+            {
+                "nb_streamlines": nb_streamlines,
+                "subsets": subsets,
+                "reference": reference,
+            },
+            f,
+        )
+
+
+class VoteArchive:
+    """Read access to the vote archive of an output folder (memory-mapped).
+
+    Parameters
+    ----------
+    path_to_output_folder : str
+        output folder with a vote archive (see `write_vote_archive`)
+    """
+
+    def __init__(self, path_to_output_folder: str):
+        if not is_vote_archive(path_to_output_folder):
+            raise ValueError(
+                f"No complete, up-to-date vote archive found in "
+                f"'{path_to_output_folder}'."
+            )
+        with open(os.path.join(path_to_output_folder, META_FILENAME), "r") as f:
+            meta = json.load(f)
+
+        self.nb_streamlines = meta["nb_streamlines"]
+        self.nb_subsets = meta["subsets"]
+        self.reference = meta["reference"]
+        self.seen = np.load(
+            os.path.join(path_to_output_folder, SEEN_FILENAME), mmap_mode="r"
+        )
+        self.accepted = np.load(
+            os.path.join(path_to_output_folder, ACCEPTED_FILENAME), mmap_mode="r"
+        )
+
+    def _iter_chunks(self, chunk_size: int):
+        """Yields (first streamline, unpacked seen, unpacked accepted) per chunk."""
+        chunk_bytes = max(chunk_size // 8, 1)
+        for start in range(0, self.seen.shape[1], chunk_bytes):
+            stop = min(start + chunk_bytes, self.seen.shape[1])
+            count = min(stop * 8, self.nb_streamlines) - start * 8
+            yield (
+                start * 8,
+                np.unpackbits(self.seen[:, start:stop], axis=1, count=count),
+                np.unpackbits(self.accepted[:, start:stop], axis=1, count=count),
+            )
+
+    def get_vote_counts(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """Counts the positive and negative votes of every streamline.
+
+        Returns
+        -------
+        array of shape (nb_streamlines, 2), as `evaluation.get_vote_counts`
+        """
+        counts = np.empty((self.nb_streamlines, 2), dtype=np.int32)
+        for start, seen, accepted in self._iter_chunks(chunk_size):
+            nb_accepted = accepted.sum(axis=0, dtype=np.int32)
+            counts[start : start + seen.shape[1], 0] = nb_accepted
+            counts[start : start + seen.shape[1], 1] = (
+                seen.sum(axis=0, dtype=np.int32) - nb_accepted
+            )
+        return counts
+
+    def get_subset_acceptance(self) -> np.ndarray:
+        """Computes the fraction of accepted streamlines of every subset."""
+        nb_seen = popcount(self.seen, axis=1)
+        nb_accepted = popcount(self.accepted, axis=1)
+        return nb_accepted / np.maximum(nb_seen, 1)
+
+    def get_pairwise_agreement(
+        self, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> np.ndarray:
+        """Computes how often two subsets agree on the streamlines they share.
+
+        The number of shared streamlines and of agreeing votes are popcounts of
+        bitwise ANDs of the rows, computed for all pairs at once as products of
+        the unpacked bit matrices.
+
+        Returns
+        -------
+        matrix of shape (subsets, subsets) with the fraction of shared streamlines
+        with the same vote in both subsets (NaN if no streamline is shared)
+        """
+        shared = np.zeros((self.nb_subsets,) * 2, dtype=np.float64)
+        agreeing = np.zeros((self.nb_subsets,) * 2, dtype=np.float64)
+        for _, seen, accepted in self._iter_chunks(chunk_size):
+            seen = seen.astype(np.float32)
+            accepted = accepted.astype(np.float32)
+            rejected = seen - accepted
+            shared += seen @ seen.T
+            agreeing += accepted @ accepted.T + rejected @ rejected.T
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(shared > 0, agreeing / shared, np.nan)
+
+    def get_vote_sequences(self, streamline_ids: Sequence[int]) -> np.ndarray:
+        """Returns the votes of the given streamlines in the order of the subsets.
+
+        Returns
+        -------
+        array of shape (len(streamline_ids), subsets) with 1 (accepted), 0 (rejected)
+        or -1 (not part of the subset)
+        """
+        ids = np.asarray(streamline_ids, dtype=np.int64)
+        # np.packbits stores the first element in the most significant bit
+        byte, shift = ids // 8, 7 - ids % 8
+        seen = (self.seen[:, byte] >> shift) & 1
+        accepted = (self.accepted[:, byte] >> shift) & 1
+        return np.where(seen == 1, accepted, -1).astype(np.int8).T
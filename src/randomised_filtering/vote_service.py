@@ -0,0 +1,291 @@
+"""
+Read-only HTTP service answering vote queries from a vote store.
+
+The store (see `vote_store.build_vote_store`) is memory-mapped once by the
+server; queries only read the requested streamlines, so they are answered
+without re-reading any index files. The server handles every request in its
+own thread, several clients (processes) can query it at the same time.
+
+Endpoints (JSON in, JSON out; `folder` is an output folder of the store or
+"all" for the votes summed over all subset sizes, the default):
+
+  GET  /info              folders, subsets per folder, number of streamlines
+  POST /counts            {"streamlines": [...], "folder": ...}
+                          -> {"counts": [[positive, negative], ...]}
+  POST /acceptance_rates  {"streamlines": [...], "folder": ...}
+                          -> {"acceptance_rates": [...]} (-1 for no votes)
+  POST /histograms        {"cohorts": {name: [streamlines]}, "folder": ...}
+                          -> per cohort, acceptance rate distribution (bins of
+                             `evaluation.ACCEPTANCE_RATE_BINS`) and the numbers
+                             of streamlines per P/N vote combination
+  POST /threshold         {"threshold": 50, "plausible": true, "folder": ...,
+                           "streamlines": [...] (optional, default: all)}
+                          -> {"streamlines": [...]} with acceptance rate
+                             >= threshold (plausible) or <= threshold (not
+                             plausible, includes streamlines without votes)
+
+`VoteServiceClient` sends these queries from Python.
+"""
+
+import json
+import threading
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from randomised_filtering.evaluation import (
+    ACCEPTANCE_RATE_BINS,
+    DEFAULT_CHUNK_SIZE,
+    get_acceptance_rate_distribution,
+    get_acceptance_rates,
+    get_cohort_vote_combinations,
+)
+from randomised_filtering.vote_store import VoteStore
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+ALL_FOLDERS = "all"
+
+
+class VoteQueries:
+    """Queries on a vote store, independent of the transport.
+
+    Parameters
+    ----------
+    store : VoteStore
+        memory-mapped vote store
+    chunk_size : int, optional
+        number of streamlines processed at once in queries over all streamlines
+    """
+
+    def __init__(self, store: VoteStore, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.store = store
+        self.chunk_size = chunk_size
+        self._total_counts: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _get_subsets(self, folder: str) -> int:
+        if folder == ALL_FOLDERS:
+            return sum(self.store.subsets)
+        return self.store.subsets[self.store.folders.index(folder)]
+
+    def _get_all_counts(self, folder: str) -> np.ndarray:
+        if folder != ALL_FOLDERS:
+            return self.store.get_counts(folder)
+        # the totals are needed by every query over all folders, sum them once
+        with self._lock:
+            if self._total_counts is None:
+                self._total_counts = self.store.get_total_counts(
+                    chunk_size=self.chunk_size
+                )
+        return self._total_counts
+
+    def _get_counts(self, folder: str, streamlines: Sequence[int]) -> np.ndarray:
+        ids = self._check_streamlines(streamlines)
+        return np.asarray(self._get_all_counts(folder)[ids], dtype=np.int32)
+
+    def _check_streamlines(self, streamlines: Sequence[int]) -> np.ndarray:
+        ids = np.asarray(streamlines, dtype=np.int64).ravel()
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.store.nb_streamlines):
+            raise ValueError(
+                f"Streamline indices must be in [0, {self.store.nb_streamlines})."
+            )
+        return ids
+
+    def _check_folder(self, request: Dict) -> str:
+        folder = request.get("folder", ALL_FOLDERS)
+        if folder != ALL_FOLDERS and folder not in self.store.folders:
+            raise ValueError(f"Unknown folder '{folder}'.")
+        return folder
+
+    def info(self) -> Dict:
+        return {
+            "folders": self.store.folders,
+            "subsets": self.store.subsets,
+            "nb_streamlines": self.store.nb_streamlines,
+        }
+
+    def counts(self, request: Dict) -> Dict:
+        folder = self._check_folder(request)
+        counts = self._get_counts(folder, request["streamlines"])
+        return {"counts": counts.tolist()}
+
+    def acceptance_rates(self, request: Dict) -> Dict:
+        folder = self._check_folder(request)
+        counts = self._get_counts(folder, request["streamlines"])
+        return {"acceptance_rates": get_acceptance_rates(counts).tolist()}
+
+    def histograms(self, request: Dict) -> Dict:
+        folder = self._check_folder(request)
+        names = list(request["cohorts"])
+        cohorts = [self._check_streamlines(request["cohorts"][n]) for n in names]
+        histograms = get_cohort_vote_combinations(
+            self._get_all_counts(folder), cohorts, self._get_subsets(folder)
+        )
+        distribution = get_acceptance_rate_distribution(histograms)
+        return {
+            "bins": ACCEPTANCE_RATE_BINS,
+            "cohorts": {
+                name: {
+                    "streamlines": len(cohorts[i]),
+                    "distribution": distribution[i].tolist(),
+                    "combinations": [
+                        [int(p), int(n), int(histograms[i, p, n])]
+                        for p, n in np.argwhere(histograms[i] > 0)
+                    ],
+                }
+                for i, name in enumerate(names)
+            },
+        }
+
+    def threshold(self, request: Dict) -> Dict:
+        folder = self._check_folder(request)
+        threshold = float(request["threshold"])
+        plausible = bool(request.get("plausible", True))
+
+        if request.get("streamlines") is not None:
+            ids = self._check_streamlines(request["streamlines"])
+            ar = get_acceptance_rates(self._get_all_counts(folder)[ids])
+            selected = ids[ar >= threshold if plausible else ar <= threshold]
+            return {"streamlines": selected.tolist()}
+
+        counts = self._get_all_counts(folder)
+        selected = []
+        for start in range(0, len(counts), self.chunk_size):
+            ar = get_acceptance_rates(counts[start : start + self.chunk_size])
+            mask = ar >= threshold if plausible else ar <= threshold
+            selected.append(np.where(mask)[0] + start)
+        return {"streamlines": np.concatenate(selected + [[]]).astype(int).tolist()}
+
+
+class _VoteRequestHandler(BaseHTTPRequestHandler):
+    """Dispatches requests to the `VoteQueries` of the server."""
+
+    def _send(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/info":
+            self._send(200, self.server.queries.info())
+        else:
+            self._send(404, {"error": f"Unknown endpoint '{self.path}'."})
+
+    def do_POST(self):
+        endpoint = self.path.strip("/")
+        if endpoint not in VoteServer.ENDPOINTS:
+            self._send(404, {"error": f"Unknown endpoint '{self.path}'."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            response = getattr(self.server.queries, endpoint)(request)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, response)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class VoteServer(ThreadingHTTPServer):
+    """HTTP server for the queries of a vote store (one thread per request).
+
+    Parameters
+    ----------
+    path_to_store : str
+        folder with a vote store (see `vote_store.build_vote_store`)
+    host : str, optional
+        address to listen on (default: localhost only)
+    port : int, optional
+        port to listen on (0: any free port, see `server_address`)
+    verbose : bool, optional
+        log every request to stderr
+    """
+
+    ENDPOINTS = ("counts", "acceptance_rates", "histograms", "threshold")
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path_to_store: str,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        verbose: bool = False,
+    ):
+        self.queries = VoteQueries(VoteStore(path_to_store))
+        self.verbose = verbose
+        super().__init__((host, port), _VoteRequestHandler)
+
+
+class VoteServiceClient:
+    """Sends queries to a running `VoteServer`.
+
+    Parameters
+    ----------
+    url : str, optional
+        address of the server (default: localhost with the default port)
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = (url or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}").rstrip("/")
+
+    def _query(self, endpoint: str, request: Optional[Dict] = None) -> Dict:
+        data = None if request is None else json.dumps(request).encode()
+        http_request = Request(
+            f"{self.url}/{endpoint}",
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urlopen(http_request) as response:
+                return json.loads(response.read())
+        except HTTPError as e:
+            raise ValueError(json.loads(e.read()).get("error", str(e))) from None
+
+    def info(self) -> Dict:
+        return self._query("info")
+
+    def counts(self, streamlines: Sequence[int], folder: str = ALL_FOLDERS):
+        request = {"streamlines": _to_list(streamlines), "folder": folder}
+        return np.array(self._query("counts", request)["counts"], dtype=np.int32)
+
+    def acceptance_rates(self, streamlines: Sequence[int], folder: str = ALL_FOLDERS):
+        request = {"streamlines": _to_list(streamlines), "folder": folder}
+        rates = self._query("acceptance_rates", request)["acceptance_rates"]
+        return np.array(rates, dtype=np.float32)
+
+    def histograms(
+        self, cohorts: Dict[str, Sequence[int]], folder: str = ALL_FOLDERS
+    ) -> Dict:
+        request = {
+            "cohorts": {name: _to_list(ids) for name, ids in cohorts.items()},
+            "folder": folder,
+        }
+        return self._query("histograms", request)
+
+    def threshold(
+        self,
+        threshold: float,
+        plausible: bool = True,
+        folder: str = ALL_FOLDERS,
+        streamlines: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        request = {"threshold": threshold, "plausible": plausible, "folder": folder}
+        if streamlines is not None:
+            request["streamlines"] = _to_list(streamlines)
+        return np.array(self._query("threshold", request)["streamlines"], dtype=int)
+
+
+def _to_list(streamlines: Sequence[int]) -> List[int]:
+    return np.asarray(streamlines, dtype=np.int64).ravel().tolist()
@@ -0,0 +1,185 @@
+"""
+Vote counts of all subset sizes of a subject in one memory-mapped tensor.
+
+In contrast to `evaluation.get_meta_streamline_index`, which merges the votes of
+all experiment instances, the store keeps the subset sizes apart: a folder with
+  - counts.npy : (nb_sizes, nb_streamlines, 2) uint16, positive and negative
+                 votes of every streamline per output folder
+  - meta.json  : output folders (in the order of the first axis), their number of
+                 subsets and the number of streamlines; written last, marks a
+                 complete store
+Totals over all subset sizes are a sum over the first axis.
+"""
+
+import os
+import json
+import numpy as np
+
+from typing import List, Optional, Sequence
+
+from randomised_filtering.evaluation import (
+    DEFAULT_CHUNK_SIZE,
+    get_nb_streamlines_from_folder,
+    get_nb_subsets_from_folder,
+    get_vote_counts,
+)
+from randomised_filtering.vote_archive import VoteArchive, is_vote_archive
+
+
+COUNTS_FILENAME = "counts.npy"
+META_FILENAME = "meta.json"
+
+
+def is_vote_store(path_to_store: str) -> bool:
+    """Checks whether a (complete) vote store exists at the given path."""
+    return os.path.exists(os.path.join(path_to_store, META_FILENAME))
+
+
+def build_vote_store(
+    path_to_store: str,
+    folders: Sequence[str],
+    base_path: Optional[str] = None,
+    nb_streamlines: Optional[int] = None,
+) -> None:
+    """Counts the votes of all output folders into a vote store, in one pass.
+
+    Parameters
+    ----------
+    path_to_store : str
+        folder to write the store to (created if necessary)
+    folders : sequence of str
+        output folders, one per subset size
+    base_path : str, optional
+        path where folders are based (default: current working directory)
+    nb_streamlines : int, optional
+        number of streamlines in the reference tractogram (default: read from the
+        reference tractogram of the first folder)
+    """
+    if base_path is None:
+        base_path = os.getcwd()
+    paths = [os.path.join(base_path, folder) for folder in folders]
+    if nb_streamlines is None:
+        nb_streamlines = get_nb_streamlines_from_folder(paths[0])
+
+    os.makedirs(path_to_store, exist_ok=True)
+    # the store is incomplete until the meta file is written again
+    path_to_meta = os.path.join(path_to_store, META_FILENAME)
+    if os.path.exists(path_to_meta):
+        os.remove(path_to_meta)
+
+    counts = np.lib.format.open_memmap(
+        os.path.join(path_to_store, COUNTS_FILENAME),
+        mode="w+",
+        dtype=np.uint16,
+        shape=(len(paths), nb_streamlines, 2),
+    )
+
+    subsets = []
+    for i, path in enumerate(paths):
+        print("Counting votes for", path)
+        if is_vote_archive(path):
+            archive = VoteArchive(path)
+            counts[i] = archive.get_vote_counts()
+            subsets.append(archive.nb_subsets)
+        else:
+            get_vote_counts(path, out=counts[i])
+            subsets.append(get_nb_subsets_from_folder(path))
+    counts.flush()
+    del counts
+
+    with open(path_to_meta, "w") as f:
+        json.dump(
+            {
+                "folders": list(folders),
+                "subsets": subsets,
+                "nb_streamlines": nb_streamlines,
+            },
+            f,
+        )
+
+
+class VoteStore:
+    """Read access to a vote store (memory-mapped).
+
+    Parameters
+    ----------
+    path_to_store : str
+        folder with a vote store (see `build_vote_store`)
+    """
+
+    def __init__(self, path_to_store: str):
+        if not is_vote_store(path_to_store):
+            raise ValueError(f"No complete vote store found at '{path_to_store}'.")
+        with open(os.path.join(path_to_store, META_FILENAME), "r") as f:
+            meta = json.load(f)
+
+        self.folders: List[str] = meta["folders"]
+        self.subsets: List[int] = meta["subsets"]
+        self.nb_streamlines: int = meta["nb_streamlines"]
+        self.counts = np.load(
+            os.path.join(path_to_store, COUNTS_FILENAME), mmap_mode="r"
+        )
+
+    def is_up_to_date(
+        self,
+        folders: Sequence[str],
+        nb_streamlines: int,
+        base_path: Optional[str] = None,
+    ) -> bool:
+        """Checks whether the store holds the votes of all subsets of the folders.
+
+        The store is outdated if output folders or subsets were added or removed
+        since it was built, or if it refers to a different tractogram size.
+
+        Parameters
+        ----------
+        folders : sequence of str
+            current output folders (see `build_vote_store`)
+        nb_streamlines : int
+            number of streamlines in the reference tractogram
+        base_path : str, optional
+            path where folders are based (default: current working directory)
+        """
+        if base_path is None:
+            base_path = os.getcwd()
+        subsets = [
+            get_nb_subsets_from_folder(os.path.join(base_path, folder))
+            for folder in folders
+        ]
+        return (
+            self.folders == list(folders)
+            and self.subsets == subsets
+            and self.nb_streamlines == nb_streamlines
+        )
+
+    def get_counts(self, folder: str) -> np.ndarray:
+        """Returns the votes of one output folder, shape (nb_streamlines, 2)."""
+        return self.counts[self.folders.index(folder)]
+
+    def get_total_counts(
+        self,
+        streamline_ids: Optional[np.ndarray] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> np.ndarray:
+        """Sums the votes over all subset sizes.
+
+        Parameters
+        ----------
+        streamline_ids : np.ndarray, optional
+            restrict to these streamlines (default: all)
+        chunk_size : int, optional
+            number of streamlines summed at once
+
+        Returns
+        -------
+        int32 array of shape (nb_streamlines, 2), as `evaluation.get_vote_counts`
+        """
+        if streamline_ids is not None:
+            return self.counts[:, streamline_ids].sum(axis=0, dtype=np.int32)
+
+        totals = np.empty((self.nb_streamlines, 2), dtype=np.int32)
+        for start in range(0, self.nb_streamlines, chunk_size):
+            totals[start : start + chunk_size] = self.counts[
+                :, start : start + chunk_size
+            ].sum(axis=0, dtype=np.int32)
+        return totals
@@ -0,0 +1,161 @@
+"""
+Voxel maps of acceptance rates and votes.
+
+All points of a chunk of streamlines are mapped to the voxels of a reference
+image (e.g. `data.nii.gz`) at once; every streamline counts once per voxel it
+passes, no matter how many of its points lie in that voxel. Per voxel, the
+maps hold
+  - mean_acceptance_rate : mean acceptance rate of the streamlines with votes
+                           passing the voxel (NaN if there are none)
+  - streamline_density   : number of streamlines with votes passing the voxel
+  - vote_density         : number of votes of all streamlines passing the voxel
+                           (only if the number of votes per streamline is known)
+Sums are accumulated chunk by chunk, so memory depends on the chunk size and the
+grid, not on the size of the tractogram.
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+
+from typing import Dict, Optional, Tuple
+
+from randomised_filtering.classifier.preprocessing import concatenate_streamlines
+from randomised_filtering.classifier.streamline_loader import iter_streamline_chunks
+from randomised_filtering.instrumentation import current_span, traced
+
+
+DEFAULT_CHUNK_SIZE = 100000
+
+MAP_MEAN_ACCEPTANCE_RATE = "mean_acceptance_rate"
+MAP_STREAMLINE_DENSITY = "streamline_density"
+MAP_VOTE_DENSITY = "vote_density"
+
+
+def get_streamline_voxels(
+    points: np.ndarray,
+    lengths: np.ndarray,
+    affine: np.ndarray,
+    shape: Tuple[int, int, int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Determines the voxels passed by every streamline of a flat point buffer.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        points of all streamlines in RASmm, shape (total_nb_points, 3)
+        (see `preprocessing.concatenate_streamlines`)
+    lengths : np.ndarray
+        number of points of every streamline
+    affine : np.ndarray
+        voxel to RASmm affine of the reference image
+    shape : tuple of int
+        grid size of the reference image
+
+    Returns
+    -------
+    owners : np.ndarray
+        streamline (position in the buffer) of every streamline-voxel pair
+    voxels : np.ndarray
+        voxel (index into the flattened grid, C order) of every pair; every pair
+        occurs once, points outside of the grid are ignored
+    """
+    inv_affine = np.linalg.inv(affine)
+    owners = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+
+    # voxel of every point (voxel centres at integer coordinates)
+    ijk = np.rint(points @ inv_affine[:3, :3].T + inv_affine[:3, 3]).astype(np.int64)
+    inside = np.all((ijk >= 0) & (ijk < shape), axis=1)
+    voxels = np.ravel_multi_index(tuple(ijk[inside].T), shape)
+
+    nb_voxels = int(np.prod(shape))
+    pairs = np.unique(owners[inside] * nb_voxels + voxels)
+    return pairs // nb_voxels, pairs % nb_voxels
+
+
+@traced()
+def compute_voxel_maps(
+    path_to_tractogram: str,
+    reference_img: nib.Nifti1Image,
+    acceptance_rates: np.ndarray,
+    nb_votes: Optional[np.ndarray] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, np.ndarray]:
+    """Computes voxel maps of the acceptance rates of all streamlines.
+
+    Parameters
+    ----------
+    path_to_tractogram : str
+        reference tractogram of the votes
+    reference_img : nib.Nifti1Image
+        image defining the voxel grid (e.g. data.nii.gz)
+    acceptance_rates : np.ndarray
+        acceptance rate of every streamline of the tractogram; NaN or negative
+        values (-1) mark streamlines without votes
+        (see `evaluation.get_acceptance_rates`)
+    nb_votes : np.ndarray, optional
+        number of votes of every streamline, for the vote density map
+    chunk_size : int, optional
+        number of streamlines voxelized at once
+
+    Returns
+    -------
+    dictionary of map name -> float32 array of the shape of the grid
+    """
+    dims = reference_img.shape
+    shape = (int(dims[0]), int(dims[1]), int(dims[2]))
+    nb_voxels = int(np.prod(shape))
+    current_span().set(unit="streamlines")
+
+    ar_sums = np.zeros(nb_voxels, dtype=np.float64)
+    streamline_density = np.zeros(nb_voxels, dtype=np.int64)
+    vote_density = np.zeros(nb_voxels, dtype=np.float64)
+
+    start = 0
+    for chunk in iter_streamline_chunks(path_to_tractogram, chunk_size):
+        if start + len(chunk) > len(acceptance_rates):
+            raise ValueError(
+                "Tractogram has more streamlines than acceptance rates "
+                f"({len(acceptance_rates)})."
+            )
+        points, _, lengths = concatenate_streamlines(chunk)
+        owners, voxels = get_streamline_voxels(
+            points.astype(np.float64), lengths, reference_img.affine, shape
+        )
+
+        ar = np.asarray(acceptance_rates[start : start + len(chunk)], np.float64)
+        ar = ar[owners]
+        seen = ar >= 0  # False for NaN
+        ar_sums += np.bincount(voxels[seen], weights=ar[seen], minlength=nb_voxels)
+        streamline_density += np.bincount(voxels[seen], minlength=nb_voxels)
+        if nb_votes is not None:
+            votes = np.asarray(nb_votes[start : start + len(chunk)], np.float64)
+            vote_density += np.bincount(
+                voxels, weights=votes[owners], minlength=nb_voxels
+            )
+
+        start += len(chunk)
+        current_span().add_items(len(chunk))
+        print(f"voxelized {start} streamlines")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_ar = np.where(streamline_density > 0, ar_sums / streamline_density, np.nan)
+    maps = {
+        MAP_MEAN_ACCEPTANCE_RATE: mean_ar,
+        MAP_STREAMLINE_DENSITY: streamline_density,
+    }
+    if nb_votes is not None:
+        maps[MAP_VOTE_DENSITY] = vote_density
+    return {name: m.astype(np.float32).reshape(shape) for name, m in maps.items()}
+
+
+def save_voxel_maps(
+    path_prefix: str, maps: Dict[str, np.ndarray], reference_img: nib.Nifti1Image
+) -> None:
+    """Writes every map to `<path_prefix>_<map name>.nii.gz` (grid of the reference)."""
+    folder = os.path.dirname(path_prefix)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    for name, data in maps.items():
+        img = nib.Nifti1Image(data, reference_img.affine)
+        nib.save(img, f"{path_prefix}_{name}.nii.gz")